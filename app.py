@@ -4,6 +4,12 @@ from datetime import datetime, timedelta
 import os
 from dotenv import load_dotenv
 from models import db, Item, Receipt
+from pagination import keyset_page, parse_limit
+from http_cache import conditional
+from response_cache import cached, invalidate as invalidate_cache
+from metrics import init_metrics
+from slow_query import init_slow_query_admin
+from stats import get_item_stats, enable_daily_summary, items_with_status, status_summary
 
 # Load environment variables
 load_dotenv()
@@ -21,21 +27,35 @@ if not database_url:
 app.config['SQLALCHEMY_DATABASE_URI'] = database_url
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# Per-route timings at /metrics, slowest statements at /admin/slow_queries
+init_metrics(app)
+init_slow_query_admin(app)
+
 # Initialize database
 db.init_app(app)
 migrate = Migrate(app, db)
 
+# Optionally serve analytics from the precomputed daily_item_summary table
+if os.getenv('DAILY_SUMMARY_ENABLED', 'false').lower() == 'true':
+    enable_daily_summary()
+
 @app.route('/')
+@conditional
+@cached
 def index():
     """Main dashboard showing all items with expiration tracking"""
-    items = Item.query.order_by(Item.expirationDate.asc().nulls_last()).all()
-    return render_template('mobile_index.html', items=items)
+    today = datetime.now().date()
+    items = items_with_status(Item.query.order_by(Item.expiration_date.asc().nulls_last()), today)
+    return render_template('mobile_index.html', items=items, summary=status_summary(today))
 
 @app.route('/desktop')
+@conditional
+@cached
 def desktop_index():
     """Desktop version of the dashboard"""
-    items = Item.query.order_by(Item.expirationDate.asc().nulls_last()).all()
-    return render_template('index.html', items=items)
+    today = datetime.now().date()
+    items = items_with_status(Item.query.order_by(Item.expiration_date.asc().nulls_last()), today)
+    return render_template('index.html', items=items, summary=status_summary(today))
 
 @app.route('/add_item', methods=['GET', 'POST'])
 def add_item():
@@ -63,6 +83,7 @@ def add_item():
             # Add to database
             db.session.add(item)
             db.session.commit()
+            invalidate_cache()
             
             flash(f'Item "{product_name}" added successfully!', 'success')
             return redirect(url_for('index'))
@@ -92,6 +113,7 @@ def edit_item(item_id):
             
             # Update in database
             db.session.commit()
+            invalidate_cache()
             
             flash(f'Item "{item.product_name}" updated successfully!', 'success')
             return redirect(url_for('index'))
@@ -111,6 +133,7 @@ def delete_item(item_id):
         product_name = item.product_name
         db.session.delete(item)
         db.session.commit()
+        invalidate_cache()
         flash(f'Item "{product_name}" deleted successfully!', 'success')
     except Exception as e:
         db.session.rollback()
@@ -119,59 +142,64 @@ def delete_item(item_id):
     return redirect(url_for('index'))
 
 @app.route('/api/items')
+@conditional
+@cached
 def api_items():
-    """API endpoint to get all items as JSON"""
-    items = Item.query.order_by(Item.expirationDate.asc().nulls_last()).all()
-    return jsonify([item.to_dict() for item in items])
+    """API endpoint to get items as JSON, one keyset page at a time
+
+    Pass ``all=1`` to get the legacy unpaginated list of every item.
+    """
+    if request.args.get('all') == '1':
+        items = Item.query.order_by(Item.expiration_date.asc().nulls_last(), Item.id.asc()).all()
+        return jsonify([item.to_dict() for item in items])
+    
+    try:
+        limit = parse_limit(request.args.get('limit'))
+        items, next_cursor = keyset_page(Item.query, request.args.get('cursor'), limit)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify({
+        'items': [item.to_dict() for item in items],
+        'next_cursor': next_cursor
+    })
 
 @app.route('/expiring_soon')
+@conditional
+@cached
 def expiring_soon():
     """Show items expiring within the next 7 days"""
     today = datetime.now().date()
     next_week = today + timedelta(days=7)
     
-    items = Item.query.filter(
+    items = items_with_status(Item.query.filter(
         Item.expiration_date >= today,
         Item.expiration_date <= next_week
-    ).order_by(Item.expiration_date.asc()).all()
+    ).order_by(Item.expiration_date.asc()), today)
     
     return render_template('mobile_items_list.html', items=items)
 
 @app.route('/items_list')
+@conditional
+@cached
 def items_list():
     """Show all items organized by category"""
-    items = Item.query.order_by(Item.expirationDate.asc().nulls_last()).all()
+    items = items_with_status(Item.query.order_by(Item.expiration_date.asc().nulls_last()))
     return render_template('mobile_items_list.html', items=items)
 
 @app.route('/receipt_details')
+@cached
 def receipt_details():
     """Show receipt details with items"""
     items = Item.query.order_by(Item.purchase_date.desc()).all()
     return render_template('mobile_receipt_details.html', items=items)
 
 @app.route('/analytics')
+@conditional
 def analytics():
     """Show analytics and statistics"""
-    total_items = Item.query.count()
-    
-    # Items by status
-    today = datetime.now().date()
-    expired_count = Item.query.filter(Item.expiration_date < today).count()
-    
-    expiring_soon_count = Item.query.filter(
-        Item.expiration_date >= today,
-        Item.expiration_date <= today + timedelta(days=3)
-    ).count()
-    
-    # Total value
-    total_value = db.session.query(db.func.sum(Item.price)).scalar() or 0
-    
-    analytics_data = {
-        'total_items': total_items,
-        'expired_count': expired_count,
-        'expiring_soon_count': expiring_soon_count,
-        'total_value': total_value
-    }
+    # Counts by status and total value in one round trip (or from the daily rollup)
+    analytics_data = get_item_stats()
     
     return render_template('analytics.html', analytics=analytics_data)
 
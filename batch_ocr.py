@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+Incremental batch OCR of a directory of receipt images
+
+Usage: python -m batch_ocr [DIRECTORY] [--engine simple|enhanced] [--workers N] [--force]
+
+Each image's text is written next to it as <name>.txt. A SQLite manifest
+(DIRECTORY/.ocr_manifest.sqlite) records the path, size, mtime, SHA-256
+and pipeline version of every image done, committed one image at a time,
+so unchanged images are skipped without being read and an interrupted
+run picks up where it stopped. Images that were only moved or copied
+are recognised by content and reuse the stored text; so are stored
+photos that receipt_storage re-encoded as WebP or moved into the cold
+tier, by the receipt_<sha256> name they keep, as long as the cold tier
+is inside DIRECTORY (the default receipts/cold).
+"""
+
+import argparse
+import contextlib
+import hashlib
+import os
+import re
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from PIL import Image
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.webp')
+# Derived copies made by the web app, not receipts in their own right
+SKIP_DIRS = {'variants', 'uploads'}
+MANIFEST_NAME = '.ocr_manifest.sqlite'
+ENGINES = ('simple', 'enhanced')
+# Stored photos are named by content hash and keep the name when re-encoded
+_PHOTO_NAME = re.compile(r'^receipt_([0-9a-f]{64})\.(jpg|webp)$')
+
+
+class Manifest:
+    """What has been OCR'd, keyed by image path relative to the batch directory"""
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS images (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                sha256 TEXT NOT NULL,
+                engine TEXT NOT NULL,
+                version TEXT NOT NULL,
+                text TEXT,
+                seconds REAL,
+                updated_at REAL NOT NULL,
+                photo_id TEXT
+            )''')
+        if 'photo_id' not in {column[1] for column in self.db.execute('PRAGMA table_info(images)')}:
+            # Manifests written before photo ids were recorded
+            self.db.execute('ALTER TABLE images ADD COLUMN photo_id TEXT')
+        self.db.execute('CREATE INDEX IF NOT EXISTS ix_images_sha256 ON images (sha256)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS ix_images_photo_id ON images (photo_id)')
+        self.db.commit()
+
+    def get(self, path):
+        return self.db.execute(
+            'SELECT size, mtime_ns, sha256, engine, version FROM images WHERE path = ?', (path,)
+        ).fetchone()
+
+    def record(self, path, size, mtime_ns, sha256, engine, version, text, seconds):
+        self.db.execute(
+            'INSERT OR REPLACE INTO images (path, size, mtime_ns, sha256, engine, version, text, seconds, '
+            'updated_at, photo_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (path, size, mtime_ns, sha256, engine, version, text, seconds, time.time(), photo_id(path)))
+        self.db.commit()
+
+    def find_text(self, path, sha256, engine, version):
+        """Text already extracted from the same content under another path, or None
+
+        Content is the same if the bytes are, or if both paths are the same
+        stored photo (receipt_<sha256>) in another format or tier.
+        """
+        row = self.db.execute(
+            'SELECT text FROM images WHERE (sha256 = ? OR (photo_id = ? AND path != ?)) '
+            'AND engine = ? AND version = ? AND text IS NOT NULL',
+            (sha256, photo_id(path), path, engine, version)).fetchone()
+        return row[0] if row else None
+
+    def prune(self, seen):
+        """Forget images that are no longer in the directory; returns how many"""
+        gone = [path for (path,) in self.db.execute('SELECT path FROM images') if path not in seen]
+        self.db.executemany('DELETE FROM images WHERE path = ?', [(path,) for path in gone])
+        self.db.commit()
+        return len(gone)
+
+    def touch(self, path, size, mtime_ns):
+        """Note a new size/mtime for an image whose content is unchanged"""
+        self.db.execute('UPDATE images SET size = ?, mtime_ns = ?, updated_at = ? WHERE path = ?',
+                        (size, mtime_ns, time.time(), path))
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+
+def photo_id(path):
+    """Content hash in a stored photo's name (receipt_<sha256>.jpg or .webp), or None"""
+    match = _PHOTO_NAME.match(os.path.basename(path))
+    return match.group(1) if match else None
+
+
+def file_hash(path):
+    """SHA-256 of a file, read in 1 MB chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def find_images(directory):
+    """Image files under directory, in a stable order"""
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = sorted(d for d in dirs if d not in SKIP_DIRS and not d.startswith('.'))
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                yield os.path.join(root, name)
+
+
+def pipeline_version(engine):
+    """Results from a different engine, pipeline or Tesseract version are redone"""
+    from ocr_cache import PIPELINE_VERSION
+    import ocr_engine
+    try:
+        tesseract = ocr_engine.version()
+    except Exception:
+        tesseract = 'unavailable'
+    return f"{engine}/{PIPELINE_VERSION}/{tesseract}"
+
+
+def write_text(image_path, text):
+    """Write text to <image>.txt atomically, so a crash never leaves half a file"""
+    text_path = os.path.splitext(image_path)[0] + '.txt'
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(image_path), suffix='.tmp')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, text_path)
+
+
+def ocr_file(path, engine, verbose=False):
+    """Pool task: OCR one image and write its text beside it; returns (text, seconds)"""
+    start = time.perf_counter()
+    if engine == 'enhanced':
+        from enhanced_receipt_ocr import convert_image_to_text_enhanced
+        with open(os.devnull, 'w') as devnull, \
+                contextlib.nullcontext() if verbose else contextlib.redirect_stdout(devnull):
+            # Parallelism comes from this pool, so each image runs inline
+            result = convert_image_to_text_enhanced(path, workers=1, strips=False)
+        if not result:
+            raise RuntimeError('enhanced OCR found no text')
+        text = result['best_text']
+    else:
+        import ocr_engine
+        from receipt_geometry import prepare_for_ocr
+        with Image.open(path) as img:
+            text = ocr_engine.image_to_string(prepare_for_ocr(img.convert('RGB')))
+    write_text(path, text)
+    return text, time.perf_counter() - start
+
+
+def plan(directory, manifest, engine, version, force=False):
+    """Work out what needs OCR; returns (todo, skipped, seen)
+
+    todo holds (path, key, size, mtime_ns, sha256) for each image to OCR.
+    An image whose size and mtime match the manifest is skipped without
+    being read; otherwise it is hashed, and skipped if the manifest
+    already has text for the same content or the same stored photo.
+    """
+    todo = []
+    skipped = 0
+    seen = set()
+    for path in find_images(directory):
+        key = os.path.relpath(path, directory)
+        seen.add(key)
+        # stat before hashing, so a write racing with this run is seen next time
+        stat = os.stat(path)
+        row = manifest.get(key)
+        if not force and row is not None and row[3:] == (engine, version) \
+                and (stat.st_size, stat.st_mtime_ns) == row[:2]:
+            skipped += 1
+            continue
+
+        sha256 = file_hash(path)
+        text = None if force else manifest.find_text(key, sha256, engine, version)
+        if text is None:
+            todo.append((path, key, stat.st_size, stat.st_mtime_ns, sha256))
+            continue
+        if row is None or row[2] != sha256:
+            # Moved, copied or re-encoded from an image that was already OCR'd
+            write_text(path, text)
+            manifest.record(key, stat.st_size, stat.st_mtime_ns, sha256, engine, version, text, 0.0)
+        else:
+            manifest.touch(key, stat.st_size, stat.st_mtime_ns)
+        skipped += 1
+    return todo, skipped, seen
+
+
+def run(directory, engine='simple', workers=None, manifest_path=None, force=False, verbose=False):
+    """OCR new and changed images under directory; returns a stats dictionary"""
+    manifest = Manifest(manifest_path or os.path.join(directory, MANIFEST_NAME))
+    version = pipeline_version(engine)
+    started = time.perf_counter()
+    stats = {'processed': 0, 'skipped': 0, 'failed': 0}
+    try:
+        todo, stats['skipped'], seen = plan(directory, manifest, engine, version, force)
+        stats['forgotten'] = manifest.prune(seen)
+        print(f"{len(todo)} image(s) to OCR, {stats['skipped']} unchanged")
+
+        if todo:
+            with ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+                futures = {pool.submit(ocr_file, item[0], engine, verbose): item for item in todo}
+                for future in as_completed(futures):
+                    path, key, size, mtime_ns, sha256 = futures[future]
+                    try:
+                        text, seconds = future.result()
+                    except Exception as e:
+                        stats['failed'] += 1
+                        print(f"✗ {key}: {e}")
+                        continue
+                    # Recorded only once the text file is in place: a crash
+                    # before this line just means the image is done again
+                    manifest.record(key, size, mtime_ns, sha256, engine, version, text, seconds)
+                    stats['processed'] += 1
+                    print(f"✓ {key} ({seconds:.1f}s, {len(text)} chars)")
+    finally:
+        manifest.close()
+
+    stats['seconds'] = time.perf_counter() - started
+    stats['images_per_second'] = stats['processed'] / stats['seconds'] if stats['seconds'] else 0.0
+    return stats
+
+
+def main(argv=None):
+    """Main function"""
+    parser = argparse.ArgumentParser(description='OCR new and changed receipt images')
+    parser.add_argument('directory', nargs='?', default='receipts')
+    parser.add_argument('--engine', choices=ENGINES, default='simple')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--manifest', help=f'manifest path (default: DIRECTORY/{MANIFEST_NAME})')
+    parser.add_argument('--force', action='store_true', help='OCR every image again')
+    parser.add_argument('--verbose', action='store_true', help='show OCR progress for each image')
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.directory):
+        print(f"Directory not found: {args.directory}")
+        return
+
+    stats = run(args.directory, args.engine, args.workers, args.manifest, args.force, args.verbose)
+    print(f"\nOCR'd {stats['processed']} image(s), skipped {stats['skipped']} unchanged, "
+          f"{stats['failed']} failed in {stats['seconds']:.1f}s "
+          f"({stats['images_per_second']:.2f} images/sec)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+"""
+Shared pytest fixtures
+"""
+
+import importlib
+import sys
+
+import pytest
+
+
+@pytest.fixture
+def load_app(tmp_path, monkeypatch):
+    """Reload simple_app against a throwaway SQLite database under tmp_path
+
+    Returns a loader taking extra environment variables, since simple_app
+    reads its configuration at import time. Receipt photos are written
+    under tmp_path too.
+    """
+    def load(**env):
+        monkeypatch.setenv('DATABASE_URL', f"sqlite:///{tmp_path / 'test.db'}")
+        for name, value in env.items():
+            monkeypatch.setenv(name, value)
+        if 'simple_app' in sys.modules:
+            simple_app = importlib.reload(sys.modules['simple_app'])
+        else:
+            simple_app = importlib.import_module('simple_app')
+        monkeypatch.setattr(simple_app.app, 'root_path', str(tmp_path))
+        with simple_app.app.app_context():
+            simple_app.db.create_all()
+        return simple_app
+    return load
@@ -3,118 +3,434 @@
 Enhanced receipt OCR with image preprocessing
 """
 
+import argparse
+import atexit
 import os
-import sys
+from concurrent.futures import ProcessPoolExecutor, wait
+from multiprocessing import shared_memory
 from pathlib import Path
-from PIL import Image, ImageEnhance, ImageFilter
-import pytesseract
 import cv2
 import numpy as np
 
-def preprocess_image(image_path):
-    """Preprocess image for better OCR results"""
-    try:
-        # Load image with OpenCV
-        img = cv2.imread(image_path)
-        
-        # Convert to grayscale
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        
-        # Apply different preprocessing techniques
-        processed_images = []
-        
-        # 1. Original grayscale
-        processed_images.append(("Original Grayscale", gray))
-        
-        # 2. Gaussian blur + threshold
-        blurred = cv2.GaussianBlur(gray, (5, 5), 0)
-        thresh = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1]
-        processed_images.append(("Gaussian Blur + OTSU", thresh))
-        
-        # 3. Adaptive threshold
-        adaptive = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 2)
-        processed_images.append(("Adaptive Threshold", adaptive))
-        
-        # 4. Morphological operations
-        kernel = np.ones((1, 1), np.uint8)
-        morph = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, kernel)
-        processed_images.append(("Morphological", morph))
-        
-        # 5. Denoising
-        denoised = cv2.fastNlMeansDenoising(gray)
-        processed_images.append(("Denoised", denoised))
-        
-        return processed_images
-        
-    except Exception as e:
-        print(f"Error preprocessing image: {e}")
-        return []
+import ocr_engine
+from receipt_geometry import find_strips, prepare_receipt, OCR_DETECT_RECEIPT
+
+# Processes used to run OCR candidates; 1 runs them inline
+OCR_GRID_WORKERS = int(os.getenv('OCR_GRID_WORKERS', 1))
+# Stop searching once a candidate's mean word confidence (0-100) reaches this
+OCR_CONFIDENCE_THRESHOLD = float(os.getenv('OCR_CONFIDENCE_THRESHOLD', 85))
+# Most preprocessing x config combinations tried per image
+OCR_MAX_CANDIDATES = int(os.getenv('OCR_MAX_CANDIDATES', 30))
+# Results with fewer words than this have their confidence scaled down
+MIN_CONFIDENT_WORDS = 3
+# Opt in to OCR'ing tall receipts as strips of about OCR_STRIP_HEIGHT rows,
+# one per worker. Off by default: stitched strips can read differently from
+# the whole receipt, and the worker count must not change the result.
+OCR_STRIPS = os.getenv('OCR_STRIPS', 'false').lower() == 'true'
+OCR_STRIP_HEIGHT = int(os.getenv('OCR_STRIP_HEIGHT', 1200))
+STRIP_OVERLAP = 60
+
+# Different OCR configurations to try
+OCR_CONFIGS = [
+    '',  # Default
+    '--psm 6',  # Assume a single uniform block of text
+    '--psm 8',  # Treat the image as a single word
+    '--psm 13', # Raw line. Treat the image as a single text line
+    '--psm 6 --oem 3',  # Default OCR Engine Mode
+    '--psm 6 -c tessedit_char_whitelist=0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz.,-$ ',
+]
+
+PREPROCESSING = [
+    "Original Grayscale",
+    "Gaussian Blur + OTSU",
+    "Adaptive Threshold",
+    "Morphological",
+    "Denoised",
+]
+
+# Image metric cut-offs used to order candidates
+LOW_CONTRAST = 40      # grayscale standard deviation
+BLURRY = 100           # variance of the Laplacian
+NOISY = 5              # estimated noise sigma, in gray levels
+SKEWED_DEGREES = 2
+
+_NOISE_KERNEL = np.array([[1, -2, 1], [-2, 4, -2], [1, -2, 1]], np.float32)
+
+_pool = None
+_pool_workers = 0
+
+
+class PreprocessedImage:
+    """Preprocessing variants of one grayscale image, computed on first use"""
+
+    def __init__(self, gray):
+        self.gray = gray
+        self._variants = {"Original Grayscale": gray}
+
+    def __getitem__(self, name):
+        if name not in self._variants:
+            self._variants[name] = self._make(name)
+        return self._variants[name]
+
+    def _make(self, name):
+        gray = self.gray
+        if name == "Gaussian Blur + OTSU":
+            blurred = cv2.GaussianBlur(gray, (5, 5), 0)
+            return cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1]
+        if name == "Adaptive Threshold":
+            return cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 2)
+        if name == "Morphological":
+            kernel = np.ones((1, 1), np.uint8)
+            return cv2.morphologyEx(self["Gaussian Blur + OTSU"], cv2.MORPH_CLOSE, kernel)
+        if name == "Denoised":
+            return cv2.fastNlMeansDenoising(gray)
+        raise KeyError(name)
+
+
+def load_grayscale(image_path):
+    """Load an image file as a grayscale array, or None if it can't be read"""
+    img = cv2.imread(image_path)
+    if img is None:
+        return None
+    return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+
+def image_metrics(gray):
+    """Cheap quality measurements used to decide what to try first
+
+    ``blur`` is the variance of the Laplacian (low means soft focus),
+    ``noise`` an estimate of the sensor noise sigma (Immerkaer's method),
+    ``contrast`` the grayscale standard deviation and ``skew`` the
+    estimated text angle in degrees.
+    """
+    scale = 800 / max(gray.shape)
+    small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1 else gray
+
+    ink = cv2.threshold(small, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)[1]
+    coords = cv2.findNonZero(ink)
+    skew = 0.0
+    if coords is not None and len(coords) > 50:
+        angle = cv2.minAreaRect(coords)[-1]
+        # The angle convention differs across OpenCV versions; fold it to
+        # the nearest axis either way
+        skew = (angle + 45) % 90 - 45
+
+    # Noise is measured on a full-resolution centre crop, since resizing
+    # averages it away
+    h, w = gray.shape
+    crop = gray[max(0, h // 2 - 512):h // 2 + 512, max(0, w // 2 - 512):w // 2 + 512]
+    noise = np.abs(cv2.filter2D(crop.astype(np.float32), -1, _NOISE_KERNEL)[1:-1, 1:-1]).mean()
+    noise *= np.sqrt(np.pi / 2) / 6
+
+    return {
+        'blur': float(cv2.Laplacian(small, cv2.CV_64F).var()),
+        'noise': float(noise),
+        'contrast': float(small.std()),
+        'skew': float(skew),
+    }
+
+
+def candidate_order(metrics, configs=OCR_CONFIGS):
+    """(preprocessing, config) pairs, most promising first for this image"""
+    if metrics['noise'] > NOISY:
+        variants = ["Denoised", "Adaptive Threshold", "Gaussian Blur + OTSU", "Original Grayscale", "Morphological"]
+    elif metrics['contrast'] < LOW_CONTRAST or metrics['blur'] < BLURRY:
+        variants = ["Adaptive Threshold", "Gaussian Blur + OTSU", "Original Grayscale", "Denoised", "Morphological"]
+    else:
+        variants = ["Original Grayscale", "Gaussian Blur + OTSU", "Adaptive Threshold", "Denoised", "Morphological"]
+
+    # A receipt is one block of text; single-word and single-line modes
+    # rarely win. Tilted text needs the default automatic layout analysis.
+    preferred = ['--psm 6', '', '--psm 6 --oem 3']
+    if abs(metrics['skew']) > SKEWED_DEGREES:
+        preferred = ['', '--psm 6', '--psm 6 --oem 3']
+    config_rank = {config: (preferred.index(config) if config in preferred else len(preferred) + i)
+                   for i, config in enumerate(configs)}
+    variant_rank = {name: i for i, name in enumerate(variants)}
+
+    pairs = [(name, config) for name in variants for config in configs]
+    return sorted(pairs, key=lambda pair: (variant_rank[pair[0]] + config_rank[pair[1]], variant_rank[pair[0]]))
+
 
 def extract_text_with_config(image, config=''):
     """Extract text using different Tesseract configurations"""
     try:
-        text = pytesseract.image_to_string(image, config=config)
+        text = ocr_engine.image_to_string(image, config)
         return text.strip()
     except Exception as e:
         print(f"Error with config '{config}': {e}")
         return ""
 
-def convert_image_to_text_enhanced(image_path):
-    """Convert image to text with enhanced preprocessing"""
+
+def extract_text_with_confidence(image, config=''):
+    """Text and confidence (0-100) from one Tesseract pass
+
+    Confidence is the mean of Tesseract's per-word confidences weighted by
+    word length, scaled down for results with fewer than
+    MIN_CONFIDENT_WORDS words.
+    """
     try:
-        if not os.path.exists(image_path):
+        data = ocr_engine.image_to_data(image, config)
+    except Exception as e:
+        print(f"Error with config '{config}': {e}")
+        return "", 0.0, 0
+
+    lines = []
+    line_key = block = None
+    weighted = chars = words = 0
+    for i, word in enumerate(data['text']):
+        word = word.strip()
+        if not word:
+            continue
+        key = (data['block_num'][i], data['par_num'][i], data['line_num'][i])
+        if key != line_key:
+            if block is not None and key[0] != block:
+                lines.append('')
+            lines.append(word)
+            line_key, block = key, key[0]
+        else:
+            lines[-1] += ' ' + word
+        conf = float(data['conf'][i])
+        if conf >= 0:
+            weighted += conf * len(word)
+            chars += len(word)
+            words += 1
+
+    confidence = weighted / chars if chars else 0.0
+    confidence *= min(1.0, words / MIN_CONFIDENT_WORDS)
+    return '\n'.join(lines).strip(), round(confidence, 2), words
+
+
+def _ocr_shared(shm_name, shape, dtype, config, rows=None):
+    """Pool task: OCR an image (or a band of rows of it) held in shared memory"""
+    shm = _attach(shm_name)
+    image = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    try:
+        if rows is not None:
+            image = image[rows[0]:rows[1]]
+        return extract_text_with_confidence(image, config)
+    finally:
+        # The view has to go before the mapping can be closed
+        del image
+        shm.close()
+
+
+def _attach(shm_name):
+    # Only the parent owns (and unlinks) the block; Python 3.13+ can be
+    # told not to track it here as well
+    try:
+        return shared_memory.SharedMemory(name=shm_name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=shm_name)
+
+
+def _get_pool(workers):
+    """Process pool reused across images so workers start only once"""
+    global _pool, _pool_workers
+    if _pool is None or _pool_workers != workers:
+        if _pool is not None:
+            _pool.shutdown()
+        _pool = ProcessPoolExecutor(max_workers=workers)
+        _pool_workers = workers
+    return _pool
+
+
+@atexit.register
+def shutdown_pool():
+    """Stop the candidate worker processes, if any were started"""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
+
+
+def stitch_strips(texts, overlapped=None, max_overlap_lines=3):
+    """Join strip texts in order, dropping lines repeated across a shared overlap
+
+    ``overlapped[i]`` says strip i shares rows with strip i - 1 (a forced
+    cut from find_strips). Only there can a line have been read twice; at
+    a cut through a blank gap a repeated line is a real repeat and kept.
+    """
+    overlapped = overlapped or [False] * len(texts)
+    lines = []
+    previous = []
+    for text, shared in zip(texts, overlapped):
+        strip_lines = text.split('\n') if text else []
+        new_lines = strip_lines
+        if shared:
+            normalized_tail = [' '.join(line.split()) for line in previous[-max_overlap_lines:]]
+            for count in range(min(max_overlap_lines, len(new_lines), len(normalized_tail)), 0, -1):
+                head = [' '.join(line.split()) for line in new_lines[:count]]
+                if any(head) and head == normalized_tail[-count:]:
+                    new_lines = new_lines[count:]
+                    break
+        lines.extend(new_lines)
+        previous = strip_lines
+    return '\n'.join(lines).strip()
+
+
+def _combine_strips(results, strips):
+    """One (text, confidence, words) result from per-strip results, in order"""
+    words = sum(result[2] for result in results)
+    confidence = sum(result[1] * result[2] for result in results) / words if words else 0.0
+    text = stitch_strips([result[0] for result in results], [overlapped for _, _, overlapped in strips])
+    return text, round(confidence, 2), words
+
+
+def run_candidates(variants, candidates, workers=1, strips=None):
+    """Yield (preprocessing, config, (text, confidence, words)) in candidate order
+
+    With more than one worker, candidates run on a process pool in batches
+    of ``workers``, and results are still yielded in order, so stopping
+    early picks the same candidate as a sequential run. With ``strips``
+    (row ranges from find_strips) each candidate is instead OCR'd as
+    strips, which run concurrently and are stitched back together. Each
+    preprocessed array goes into shared memory once; workers read it in
+    place instead of receiving a pickled copy per task.
+    """
+    if workers <= 1:
+        for name, config in candidates:
+            if strips:
+                image = variants[name]
+                result = _combine_strips([extract_text_with_confidence(image[top:bottom], config)
+                                          for top, bottom, _ in strips], strips)
+            else:
+                result = extract_text_with_confidence(variants[name], config)
+            yield name, config, result
+        return
+
+    blocks = {}
+    futures = []
+
+    def submit(name, config, rows=None):
+        if name not in blocks:
+            image = np.ascontiguousarray(variants[name])
+            shm = shared_memory.SharedMemory(create=True, size=max(image.nbytes, 1))
+            np.ndarray(image.shape, dtype=image.dtype, buffer=shm.buf)[:] = image
+            blocks[name] = (shm, image.shape, image.dtype.str)
+        shm, shape, dtype = blocks[name]
+        future = pool.submit(_ocr_shared, shm.name, shape, dtype, config, rows)
+        futures.append(future)
+        return future
+
+    try:
+        pool = _get_pool(workers)
+        if strips:
+            for name, config in candidates:
+                pending = [submit(name, config, (top, bottom)) for top, bottom, _ in strips]
+                yield name, config, _combine_strips([future.result() for future in pending], strips)
+            return
+
+        for start in range(0, len(candidates), workers):
+            batch = candidates[start:start + workers]
+            pending = [submit(name, config) for name, config in batch]
+            for (name, config), future in zip(batch, pending):
+                yield name, config, future.result()
+    finally:
+        # After an early exit, let running passes finish before their
+        # shared memory goes away
+        for future in futures:
+            future.cancel()
+        wait(futures)
+        for shm, _, _ in blocks.values():
+            shm.close()
+            shm.unlink()
+
+
+def convert_image_to_text_enhanced(image_path, workers=None, confidence_threshold=None,
+                                   order=None, max_candidates=None, detect=None, strips=None,
+                                   image=None):
+    """Convert image to text with enhanced preprocessing
+
+    Candidates are tried most promising first (``order``: None for the
+    image-metric based order, 'grid' for every preprocessing with every
+    config, or an explicit list of (preprocessing, config) pairs). The
+    search stops at the first result whose confidence reaches
+    ``confidence_threshold`` or after ``max_candidates`` passes; the most
+    confident result wins. ``workers`` processes share the passes and
+    give the same answer as running them one at a time. With ``detect``
+    (default OCR_DETECT_RECEIPT) the receipt is first cropped out of the
+    photo, straightened and scaled to a standard text height. With
+    ``strips`` a tall receipt is cut at blank gaps between lines into
+    strips of about OCR_STRIP_HEIGHT rows that are OCR'd concurrently;
+    the default (None) follows OCR_STRIPS, whatever the worker count.
+    ``image`` is the already decoded picture at image_path, if the caller
+    has it, so the file is not decoded a second time.
+    """
+    if workers is None:
+        workers = OCR_GRID_WORKERS
+    if confidence_threshold is None:
+        confidence_threshold = OCR_CONFIDENCE_THRESHOLD
+    if max_candidates is None:
+        max_candidates = OCR_MAX_CANDIDATES
+    if detect is None:
+        detect = OCR_DETECT_RECEIPT
+    if strips is None:
+        strips = OCR_STRIPS
+
+    try:
+        if image is None and not os.path.exists(image_path):
             print(f"Error: Image file not found: {image_path}")
             return None
         
         print(f"Processing image: {image_path}")
         
-        # Preprocess image
-        processed_images = preprocess_image(image_path)
-        
-        if not processed_images:
+        gray = load_grayscale(image_path) if image is None else np.asarray(image.convert('L'))
+        if gray is None:
             print("Failed to preprocess image")
             return None
+        geometry = None
+        if detect:
+            original_shape = gray.shape
+            gray, geometry = prepare_receipt(gray)
+            print(f"Receipt {'cropped' if geometry['cropped'] else 'not found'}, "
+                  f"rotated {geometry['angle']}°, scaled {geometry['scale']}x: "
+                  f"{original_shape[1]}x{original_shape[0]} -> {gray.shape[1]}x{gray.shape[0]}")
+        variants = PreprocessedImage(gray)
         
-        best_text = ""
-        best_score = 0
+        strip_rows = find_strips(gray, OCR_STRIP_HEIGHT, STRIP_OVERLAP) if strips else []
+        if len(strip_rows) > 1:
+            print(f"OCR in {len(strip_rows)} strips")
+        else:
+            strip_rows = None
         
-        # Different OCR configurations to try
-        configs = [
-            '',  # Default
-            '--psm 6',  # Assume a single uniform block of text
-            '--psm 8',  # Treat the image as a single word
-            '--psm 13', # Raw line. Treat the image as a single text line
-            '--psm 6 --oem 3',  # Default OCR Engine Mode
-            '--psm 6 -c tessedit_char_whitelist=0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz.,-$ ',
-        ]
+        metrics = image_metrics(gray)
+        if order is None:
+            candidates = candidate_order(metrics)
+        elif order == 'grid':
+            candidates = [(name, config) for name in PREPROCESSING for config in OCR_CONFIGS]
+        else:
+            candidates = list(order)
+        candidates = candidates[:max_candidates]
+        print(f"Blur {metrics['blur']:.0f}, noise {metrics['noise']:.1f}, "
+              f"contrast {metrics['contrast']:.0f}, skew {metrics['skew']:.1f}°")
         
+        best_text = ""
+        best_score = 0
         results = []
+        tried = 0
         
-        for name, processed_img in processed_images:
-            print(f"\nTrying preprocessing: {name}")
+        for name, config, (text, confidence, words) in run_candidates(variants, candidates, workers, strip_rows):
+            tried += 1
+            config_name = config if config else "default"
+            if not text:
+                continue
             
-            for config in configs:
-                config_name = config if config else "default"
-                text = extract_text_with_config(processed_img, config)
-                
-                if text:
-                    # Simple scoring based on text length and character diversity
-                    score = len(text) + len(set(text.lower())) * 2
-                    
-                    results.append({
-                        'preprocessing': name,
-                        'config': config_name,
-                        'text': text,
-                        'score': score,
-                        'length': len(text)
-                    })
-                    
-                    print(f"  Config '{config_name}': {len(text)} chars, score: {score}")
-                    print(f"  Preview: {text[:100]}...")
-                    
-                    if score > best_score:
-                        best_score = score
-                        best_text = text
+            results.append({
+                'preprocessing': name,
+                'config': config_name,
+                'text': text,
+                'score': confidence,
+                'words': words,
+                'length': len(text)
+            })
+            print(f"  {name} + '{config_name}': {words} words, confidence {confidence:.1f}")
+            
+            if confidence > best_score:
+                best_score = confidence
+                best_text = text
+            if confidence >= confidence_threshold:
+                break
         
         # Sort results by score
         results.sort(key=lambda x: x['score'], reverse=True)
@@ -122,6 +438,10 @@ def convert_image_to_text_enhanced(image_path):
         return {
             'best_text': best_text,
             'best_score': best_score,
+            'metrics': metrics,
+            'geometry': geometry,
+            'strips': len(strip_rows) if strip_rows else 1,
+            'candidates_tried': tried,
             'all_results': results
         }
         
@@ -129,8 +449,24 @@ def convert_image_to_text_enhanced(image_path):
         print(f"Error processing image: {e}")
         return None
 
+
 def main():
     """Main function to process receipt images"""
+    parser = argparse.ArgumentParser(description='OCR receipt images with several preprocessing variants')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='processes for OCR passes (1 = sequential)')
+    parser.add_argument('--confidence-threshold', type=float, default=OCR_CONFIDENCE_THRESHOLD,
+                        help='stop at the first result this confident (0-100; above 100 tries everything)')
+    parser.add_argument('--max-candidates', type=int, default=OCR_MAX_CANDIDATES,
+                        help='most preprocessing x config combinations to try')
+    parser.add_argument('--no-detect', dest='detect', action='store_false', default=OCR_DETECT_RECEIPT,
+                        help='OCR the whole photo instead of the cropped, straightened receipt')
+    parser.add_argument('--strips', action=argparse.BooleanOptionalAction, default=OCR_STRIPS,
+                        help='OCR tall receipts as concurrent strips (default: OCR_STRIPS)')
+    parser.add_argument('--order', choices=('adaptive', 'grid'), default='adaptive',
+                        help='try candidates by image metrics, or every preprocessing with every config')
+    args = parser.parse_args()
+    
     receipts_dir = Path("receipts")
     
     if not receipts_dir.exists():
@@ -155,14 +491,17 @@ def main():
         print(f"{'='*80}")
         
         # Convert image to text with enhanced processing
-        result = convert_image_to_text_enhanced(str(image_file))
+        result = convert_image_to_text_enhanced(
+            str(image_file), workers=args.workers, confidence_threshold=args.confidence_threshold,
+            order=None if args.order == 'adaptive' else args.order, max_candidates=args.max_candidates,
+            detect=args.detect, strips=args.strips)
         
         if result and result['best_text']:
             print(f"\n{'='*80}")
             print("BEST RESULT:")
             print(f"{'='*80}")
             print(result['best_text'])
-            print(f"\nScore: {result['best_score']}")
+            print(f"\nConfidence: {result['best_score']} after {result['candidates_tried']} pass(es)")
             
             # Save best result
             text_file = image_file.with_suffix('.txt')
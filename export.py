@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Streaming NDJSON/CSV export of items and receipts
+"""
+
+import csv
+import io
+import json
+from datetime import date, datetime
+
+from sqlalchemy import select
+
+from models import db, Item, Receipt
+
+# Rows fetched per round trip; on Postgres this is a server-side cursor batch
+EXPORT_BATCH_SIZE = 1000
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+# Export field name -> column, keeping the camelCase keys used by to_dict()
+ITEM_FIELDS = [
+    ('id', Item.id),
+    ('receiptId', Item.receipt_id),
+    ('productName', Item.product_name),
+    ('purchaseDate', Item.purchase_date),
+    ('expirationDate', Item.expiration_date),
+    ('price', Item.price),
+    ('createdAt', Item.created_at),
+    ('updatedAt', Item.updated_at),
+]
+
+RECEIPT_FIELDS = [
+    ('id', Receipt.id),
+    ('receiptId', Receipt.receipt_id),
+    ('storeName', Receipt.store_name),
+    ('purchaseDate', Receipt.purchase_date),
+    ('totalAmount', Receipt.total_amount),
+    ('taxAmount', Receipt.tax_amount),
+    ('createdAt', Receipt.created_at),
+]
+
+EXPORTS = {
+    'items': ITEM_FIELDS,
+    'receipts': RECEIPT_FIELDS,
+}
+
+
+def _plain(value):
+    """Convert a column value to something JSON/CSV can represent"""
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+def stream_rows(fields, batch_size=EXPORT_BATCH_SIZE):
+    """Yield result rows in primary-key order without buffering the table.
+
+    ``yield_per`` makes SQLAlchemy fetch in batches and, on Postgres,
+    implies ``stream_results`` so psycopg2 uses a named server-side cursor.
+    """
+    columns = [column for _, column in fields]
+    stmt = select(*columns).order_by(columns[0]).execution_options(yield_per=batch_size)
+    result = db.session.execute(stmt)
+    try:
+        for row in result:
+            yield row
+    finally:
+        result.close()
+
+
+def generate_ndjson(fields, batch_size=EXPORT_BATCH_SIZE):
+    """Yield NDJSON chunks, one chunk per fetched batch"""
+    names = [name for name, _ in fields]
+    chunk = []
+    for row in stream_rows(fields, batch_size):
+        record = {name: _plain(value) for name, value in zip(names, row)}
+        chunk.append(json.dumps(record, separators=(',', ':')))
+        if len(chunk) >= batch_size:
+            yield '\n'.join(chunk) + '\n'
+            chunk = []
+    if chunk:
+        yield '\n'.join(chunk) + '\n'
+
+
+def generate_csv(fields, batch_size=EXPORT_BATCH_SIZE):
+    """Yield CSV chunks, starting with the header row"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([name for name, _ in fields])
+    yield buffer.getvalue()
+
+    buffer.seek(0)
+    buffer.truncate()
+    pending = 0
+    for row in stream_rows(fields, batch_size):
+        writer.writerow([_plain(value) for value in row])
+        pending += 1
+        if pending >= batch_size:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    if pending:
+        yield buffer.getvalue()
+
+
+def generate_export(table, export_format, batch_size=EXPORT_BATCH_SIZE):
+    """Return a chunk generator for the given table and format"""
+    fields = EXPORTS[table]
+    if export_format == 'csv':
+        return generate_csv(fields, batch_size)
+    return generate_ndjson(fields, batch_size)
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Conditional GET (ETag / Last-Modified) support for read endpoints
+"""
+
+import hashlib
+from datetime import datetime, time, timezone
+from functools import wraps
+
+from flask import g, request, session, make_response
+
+from models import db, Item, ItemTombstone
+
+
+def data_version():
+    """Return a cheap fingerprint of the items table and its last write time.
+
+    Every insert raises max(id), every ORM update bumps max(updated_at)
+    and every ORM delete writes a tombstone, so together they change on
+    any write. Each aggregate is answered from an index in one round trip.
+    """
+    row = db.session.query(
+        db.session.query(db.func.max(Item.updated_at)).scalar_subquery(),
+        db.session.query(db.func.max(Item.id)).scalar_subquery(),
+        db.session.query(db.func.max(ItemTombstone.id)).scalar_subquery(),
+        db.session.query(db.func.max(ItemTombstone.deleted_at)).scalar_subquery(),
+    ).one()
+    last_update, max_item_id, max_tombstone_id, last_delete = row
+
+    fingerprint = f'{last_update}|{max_item_id}|{max_tombstone_id}'
+    writes = [moment for moment in (last_update, last_delete) if moment]
+    last_write = max(writes) if writes else None
+    return fingerprint, last_write
+
+
+def _last_modified(last_write, today):
+    """Content also changes at midnight because expiry status is date-based"""
+    midnight = datetime.combine(today, time.min).astimezone(timezone.utc)
+    if last_write is None:
+        return midnight
+    return max(last_write.replace(tzinfo=timezone.utc), midnight).replace(microsecond=0)
+
+
+def conditional(view):
+    """Answer 304 before running the view when the client copy is current.
+
+    The ETag covers the path, the query string, today's date and the data
+    fingerprint and decides alone when the client sends one. Last-Modified
+    is only sent, and only trusted, once its second has passed. Requests with pending flash messages are always rendered
+    so the message is not swallowed by a 304.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.method not in ('GET', 'HEAD') or session.get('_flashes'):
+            return view(*args, **kwargs)
+
+        try:
+            fingerprint, last_write = data_version()
+        except Exception as e:
+            print(f"Data version unavailable: {e}")
+            db.session.rollback()
+            return view(*args, **kwargs)
+
+        g.data_fingerprint = fingerprint
+        today = datetime.now().date()
+        key = f'{request.path}?{request.query_string.decode("latin-1")}|{today}|{fingerprint}'
+        etag = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        last_modified = _last_modified(last_write, today)
+        # Last-Modified has whole seconds, so a second that has not ended
+        # yet can still take writes that would not move it
+        settled = last_modified < datetime.now(timezone.utc).replace(microsecond=0)
+
+        if request.if_none_match:
+            not_modified = request.if_none_match.contains(etag)
+        else:
+            since = request.if_modified_since
+            not_modified = settled and since is not None and last_modified <= since
+
+        if not_modified:
+            response = make_response('', 304)
+        else:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+
+        response.set_etag(etag)
+        if settled:
+            response.last_modified = last_modified
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+
+    return wrapper
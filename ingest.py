@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Bulk, idempotent ingestion of a receipt and its items
+"""
+
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload
+
+from models import db, Item, Receipt, mark_items_changed
+from stats import apply_bulk_insert
+
+DEFAULT_EXPIRATION_DAYS = 7
+
+
+class DuplicateReceipt(Exception):
+    """Raised when a client-supplied receipt_id is already stored"""
+
+
+def new_receipt_id():
+    """Receipt id that cannot collide between saves in the same second"""
+    return f"REC-{datetime.now().strftime('%Y%m%d')}-{uuid.uuid4().hex[:12]}"
+
+
+def _parse_date(value):
+    if not value:
+        return None
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def _parse_amount(value):
+    """Accept 45.67 as well as OCR-style strings like '$45.67'"""
+    if value in (None, ''):
+        return None
+    if isinstance(value, str):
+        value = value.replace('$', '').replace(',', '').strip()
+    return float(value)
+
+
+def _item_row(receipt_id, purchase_date, item_data, now):
+    """Column values for one item of the multi-row INSERT"""
+    name = item_data.get('name') or item_data.get('productName')
+    if not name:
+        raise ValueError('Every item needs a name')
+
+    expiration_date = _parse_date(item_data.get('expiration_date') or item_data.get('expirationDate'))
+    if expiration_date is None:
+        days = int(item_data.get('expiration_days', DEFAULT_EXPIRATION_DAYS))
+        expiration_date = purchase_date + timedelta(days=days)
+
+    price = _parse_amount(item_data.get('price'))
+    if price is None:
+        raise ValueError(f'Item {name!r} needs a price')
+
+    return {
+        'receipt_id': receipt_id,
+        'product_name': name,
+        'purchase_date': purchase_date,
+        'expiration_date': expiration_date,
+        'price': price,
+        'created_at': now,
+        'updated_at': now,
+    }
+
+
+def find_receipt(idempotency_key=None, receipt_id=None):
+    """Load a receipt and its items in two statements"""
+    query = Receipt.query.options(selectinload(Receipt.items))
+    if idempotency_key is not None:
+        return query.filter_by(idempotency_key=idempotency_key).first()
+    return query.filter_by(receipt_id=receipt_id).first()
+
+
+def ingest_receipt(data, idempotency_key=None):
+    """Store a receipt and all of its items in one transaction.
+
+    Items go in as a single multi-row INSERT. When ``idempotency_key`` has
+    been seen before, nothing is written and the stored receipt is
+    returned instead, so client retries are safe. Returns
+    ``(receipt_dict, created)``.
+    """
+    if idempotency_key:
+        existing = find_receipt(idempotency_key=idempotency_key)
+        if existing is not None:
+            return existing.to_dict(), False
+
+    now = datetime.utcnow()
+    purchase_date = _parse_date(data.get('purchase_date')) or datetime.now().date()
+    receipt_id = data.get('receipt_id') or new_receipt_id()
+    rows = [_item_row(receipt_id, purchase_date, item_data, now) for item_data in data.get('items', [])]
+
+    try:
+        db.session.execute(insert(Receipt.__table__).values(
+            receipt_id=receipt_id,
+            store_name=data.get('store_name'),
+            purchase_date=purchase_date,
+            total_amount=_parse_amount(data.get('total_amount')),
+            tax_amount=_parse_amount(data.get('tax_amount')),
+            idempotency_key=idempotency_key or None,
+            image_hash=data.get('image_hash'),
+            created_at=now
+        ))
+        if rows:
+            db.session.execute(insert(Item.__table__).values(rows))
+            mark_items_changed(db.session)
+            apply_bulk_insert(db.session.connection(), rows)
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        # A concurrent retry with the same key won the race
+        if idempotency_key:
+            existing = find_receipt(idempotency_key=idempotency_key)
+            if existing is not None:
+                return existing.to_dict(), False
+        # Only a taken receipt_id is the client's doing; anything else is a bug
+        if Receipt.query.filter_by(receipt_id=receipt_id).first() is not None:
+            raise DuplicateReceipt(f'Receipt {receipt_id} already exists')
+        raise
+
+    return find_receipt(receipt_id=receipt_id).to_dict(), True
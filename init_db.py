@@ -5,16 +5,16 @@ Creates tables and adds sample data
 """
 
 from app import app, db
-from models import Item, Receipt
+from models import Item, Receipt, upgrade_schema
 from datetime import datetime, timedelta
 import os
 
 def init_database():
     """Initialize the database with tables and sample data"""
     with app.app_context():
-        # Create all tables
+        # Create all tables and add columns from newer releases
         print("Creating database tables...")
-        db.create_all()
+        upgrade_schema()
         print("✓ Tables created successfully")
         
         # Check if we already have data
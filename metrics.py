@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Per-request performance instrumentation exposed in Prometheus text format
+"""
+
+import threading
+import time
+
+from flask import Response, g, has_request_context, request, before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+class Histogram:
+    """Cumulative Prometheus histogram keyed by a fixed set of labels"""
+
+    def __init__(self, name, description, buckets, labels=('route',)):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self.labels = labels
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['buckets'][i] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for label_values, series in sorted(self._series.items()):
+                labels = ','.join(f'{k}="{v}"' for k, v in zip(self.labels, label_values))
+                for bound, count in zip(self.buckets, series['buckets']):
+                    lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {series["count"]}')
+                lines.append(f'{self.name}_sum{{{labels}}} {series["sum"]}')
+                lines.append(f'{self.name}_count{{{labels}}} {series["count"]}')
+        return '\n'.join(lines)
+
+
+REQUEST_DURATION = Histogram('expiry_request_duration_seconds', 'Wall time per request',
+                             TIME_BUCKETS, labels=('route', 'method', 'status'))
+SQL_STATEMENTS = Histogram('expiry_sql_statements_per_request', 'SQL statements executed per request',
+                           COUNT_BUCKETS)
+SQL_DURATION = Histogram('expiry_sql_duration_seconds', 'Time spent in SQL per request', TIME_BUCKETS)
+TEMPLATE_DURATION = Histogram('expiry_template_render_seconds', 'Template render time per request', TIME_BUCKETS)
+RESPONSE_SIZE = Histogram('expiry_response_size_bytes', 'Response body size', SIZE_BUCKETS)
+
+HISTOGRAMS = (REQUEST_DURATION, SQL_STATEMENTS, SQL_DURATION, TEMPLATE_DURATION, RESPONSE_SIZE)
+
+
+_statement_observers = []
+
+
+def add_statement_observer(observer):
+    """Call observer(conn, statement, parameters, executemany, seconds) after every statement
+
+    Lets other instrumentation (the slow-query log) reuse this one pair of
+    Engine timing listeners.
+    """
+    if observer not in _statement_observers:
+        _statement_observers.append(observer)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['metrics_query_start'].pop()
+    if has_request_context() and 'metrics' in g:
+        g.metrics['sql_count'] += 1
+        g.metrics['sql_time'] += elapsed
+    for observer in _statement_observers:
+        observer(conn, statement, parameters, executemany, elapsed)
+
+
+def _before_render(sender, template, context, **extra):
+    if 'metrics' in g:
+        g.metrics['template_start'] = time.perf_counter()
+
+
+def _after_render(sender, template, context, **extra):
+    if 'metrics' in g and g.metrics.get('template_start') is not None:
+        g.metrics['template_time'] += time.perf_counter() - g.metrics.pop('template_start')
+
+
+def _start_request():
+    g.metrics = {'start': time.perf_counter(), 'sql_count': 0, 'sql_time': 0.0, 'template_time': 0.0}
+
+
+def _finish_request(response):
+    metrics = g.pop('metrics', None)
+    if metrics is None:
+        return response
+
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    REQUEST_DURATION.observe(time.perf_counter() - metrics['start'], route, request.method, str(response.status_code))
+    SQL_STATEMENTS.observe(metrics['sql_count'], route)
+    SQL_DURATION.observe(metrics['sql_time'], route)
+    TEMPLATE_DURATION.observe(metrics['template_time'], route)
+    if not response.is_streamed:
+        RESPONSE_SIZE.observe(response.calculate_content_length() or 0, route)
+    return response
+
+
+def render_metrics():
+    """All histograms in Prometheus text exposition format"""
+    return '\n'.join(histogram.render() for histogram in HISTOGRAMS) + '\n'
+
+
+def init_metrics(app):
+    """Record per-route timings on the app and serve them at /metrics.
+
+    Histograms live in process memory, so with several gunicorn workers
+    each scrape reports the worker that answered it.
+    """
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_after_render, app)
+
+    @app.route('/metrics')
+    def metrics():
+        """Prometheus scrape endpoint"""
+        return Response(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
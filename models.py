@@ -1,9 +1,16 @@
+import json
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime
-from sqlalchemy import func
+from datetime import datetime, timedelta
+from sqlalchemy import func, event, case, null, select, update, bindparam, inspect, text
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import get_history
+from slow_query import install_slow_query_log
 
 db = SQLAlchemy()
 
+# Log statements slower than SLOW_QUERY_MS, with EXPLAIN captured on Postgres
+install_slow_query_log()
+
 class Item(db.Model):
     """Item model matching the specified document structure"""
     __tablename__ = 'items'
@@ -12,10 +19,22 @@ class Item(db.Model):
     receipt_id = db.Column(db.String(100), nullable=True, index=True)
     product_name = db.Column(db.String(200), nullable=False, index=True)
     purchase_date = db.Column(db.Date, nullable=False, index=True)
-    expiration_date = db.Column(db.Date, nullable=True, index=True)
-    price = db.Column(db.Float, nullable=False)
+    # active_history loads the old value on assignment, even after a commit
+    # expired the row, so the rollup listeners can apply the exact delta
+    expiration_date = db.column_property(db.Column(db.Date, nullable=True, index=True), active_history=True)
+    price = db.column_property(db.Column(db.Float, nullable=False), active_history=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Delta-sync position, assigned in commit order by stamp_sync_sequence;
+    # NULL until the writing transaction commits
+    change_seq = db.Column(db.BigInteger, nullable=True, index=True, onupdate=null())
+    
+    __table_args__ = (
+        # Backs keyset pagination ordered by (expiration_date NULLS LAST, id)
+        db.Index('ix_items_expiration_date_id', 'expiration_date', 'id'),
+        # Backs the data_version() fingerprint for conditional GETs
+        db.Index('ix_items_updated_at_id', 'updated_at', 'id'),
+    )
     
     def __repr__(self):
         return f'<Item {self.product_name}>'
@@ -33,18 +52,43 @@ class Item(db.Model):
             'updatedAt': self.updated_at.isoformat() if self.updated_at else None
         }
     
+    # Set by items_with_status for the "today" of the request
+    _status = None
+    _days_until_expiration = None
+    
     @property
     def days_until_expiration(self):
         """Calculate days until expiration"""
+        if self._days_until_expiration is not None:
+            return self._days_until_expiration
+        
         if not self.expiration_date:
             return None
         
         today = datetime.now().date()
         return (self.expiration_date - today).days
     
+    @classmethod
+    def status_expression(cls, today):
+        """SQL equivalent of ``status`` for a fixed "today"
+        
+        Usable in select, filter and group_by so the database buckets the
+        rows instead of Python recomputing them per access.
+        """
+        return case(
+            (cls.expiration_date.is_(None), 'no_expiration'),
+            (cls.expiration_date < today, 'expired'),
+            (cls.expiration_date <= today + timedelta(days=3), 'expiring_soon'),
+            (cls.expiration_date <= today + timedelta(days=7), 'expiring_this_week'),
+            else_='fresh'
+        )
+    
     @property
     def status(self):
         """Get expiration status"""
+        if self._status is not None:
+            return self._status
+        
         if not self.expiration_date:
             return 'no_expiration'
         
@@ -68,6 +112,10 @@ class Receipt(db.Model):
     purchase_date = db.Column(db.Date, nullable=True)
     total_amount = db.Column(db.Float, nullable=True)
     tax_amount = db.Column(db.Float, nullable=True)
+    # Client-supplied key so retried uploads return the first result
+    idempotency_key = db.Column(db.String(100), unique=True, nullable=True, index=True)
+    # SHA-256 of the stored receipt photo (receipts/receipt_<hash>.jpg)
+    image_hash = db.Column(db.String(64), nullable=True, index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Relationship with items
@@ -85,6 +133,243 @@ class Receipt(db.Model):
             'purchaseDate': self.purchase_date.isoformat() if self.purchase_date else None,
             'totalAmount': self.total_amount,
             'taxAmount': self.tax_amount,
+            'imageHash': self.image_hash,
             'createdAt': self.created_at.isoformat() if self.created_at else None,
             'items': [item.to_dict() for item in self.items]
         }
+
+class ItemTombstone(db.Model):
+    """Record of a deleted item so sync clients can drop their copy"""
+    __tablename__ = 'item_tombstones'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    item_id = db.Column(db.Integer, nullable=False)
+    deleted_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+    change_seq = db.Column(db.BigInteger, nullable=True, index=True)
+    
+    def __repr__(self):
+        return f'<ItemTombstone {self.item_id}>'
+
+class SyncCounter(db.Model):
+    """Single-row counter that numbers item changes in commit order"""
+    __tablename__ = 'sync_counter'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    value = db.Column(db.BigInteger, nullable=False, default=0)
+
+@event.listens_for(SyncCounter.__table__, 'after_create')
+def seed_sync_counter(target, connection, **kw):
+    connection.execute(target.insert().values(id=1, value=0))
+
+@event.listens_for(Item, 'after_delete')
+def record_item_tombstone(mapper, connection, target):
+    """Write a tombstone in the same transaction as every ORM item delete
+    
+    Bulk ``Query.delete()`` and Core ``DELETE`` statements skip mapper
+    events and leave no tombstone, so sync clients would keep those items;
+    delete items through the session.
+    """
+    connection.execute(
+        ItemTombstone.__table__.insert().values(item_id=target.id, deleted_at=datetime.utcnow())
+    )
+
+def mark_items_changed(session):
+    """Have the next commit number item rows written with Core statements"""
+    session.info['stamp_sync'] = True
+
+@event.listens_for(Session, 'after_flush')
+def _note_item_changes(session, flush_context):
+    if any(isinstance(obj, Item) for obj in (*session.new, *session.dirty, *session.deleted)):
+        mark_items_changed(session)
+
+@event.listens_for(Session, 'before_commit')
+def stamp_sync_sequence(session):
+    """Number this transaction's item changes and tombstones just before commit
+    
+    Rows are written with a NULL change_seq. Here they get the next values
+    of sync_counter, whose row lock is held until the commit, so numbers
+    become visible in increasing order and a sync token never skips a row
+    that commits later. Timestamps could not promise that under long
+    transactions or clock skew between processes.
+    """
+    session.flush()
+    if not session.info.pop('stamp_sync', False):
+        return
+    
+    connection = session.connection()
+    pending = []
+    for table in (Item.__table__, ItemTombstone.__table__):
+        ids = connection.execute(
+            select(table.c.id).where(table.c.change_seq.is_(None)).order_by(table.c.id)
+        ).scalars().all()
+        pending.append((table, ids))
+    total = sum(len(ids) for _, ids in pending)
+    if not total:
+        return
+    
+    counter = SyncCounter.__table__
+    connection.execute(update(counter).where(counter.c.id == 1).values(value=counter.c.value + total))
+    seq = connection.execute(select(counter.c.value).where(counter.c.id == 1)).scalar_one() - total
+    for table, ids in pending:
+        if ids:
+            connection.execute(
+                update(table).where(table.c.id == bindparam('row_id')).values(change_seq=bindparam('seq')),
+                [{'row_id': row_id, 'seq': seq + n + 1} for n, row_id in enumerate(ids)]
+            )
+            seq += len(ids)
+
+def upgrade_schema():
+    """Create missing tables and add columns and indexes added since a database was created
+    
+    ``db.create_all()`` only creates whole tables, so columns added to
+    existing ones (items.change_seq, receipts.idempotency_key and
+    receipts.image_hash) and their indexes are added here. Every step checks
+    first, so it is safe to run on each deploy. Items written before
+    change_seq existed are then numbered so delta sync sends them once.
+    """
+    db.create_all()
+    inspector = inspect(db.engine)
+    with db.engine.begin() as connection:
+        for table in (Item.__table__, Receipt.__table__):
+            columns = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in columns:
+                    ddl = column.type.compile(dialect=connection.dialect)
+                    connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {ddl}'))
+            indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in indexes:
+                    index.create(connection)
+        
+        counter = SyncCounter.__table__
+        if connection.execute(select(counter.c.id).where(counter.c.id == 1)).first() is None:
+            connection.execute(counter.insert().values(id=1, value=0))
+    
+    mark_items_changed(db.session)
+    db.session.commit()
+
+class DailyItemSummary(db.Model):
+    """Precomputed dashboard counters for one calendar day"""
+    __tablename__ = 'daily_item_summary'
+    
+    summary_date = db.Column(db.Date, primary_key=True)
+    total_items = db.Column(db.Integer, nullable=False, default=0)
+    expired_count = db.Column(db.Integer, nullable=False, default=0)
+    expiring_soon_count = db.Column(db.Integer, nullable=False, default=0)
+    total_value = db.Column(db.Float, nullable=False, default=0)
+    refreshed_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<DailyItemSummary {self.summary_date}>'
+    
+    def to_dict(self):
+        """Convert model to the dictionary shape used by the analytics views"""
+        return {
+            'total_items': self.total_items,
+            'expired_count': self.expired_count,
+            'expiring_soon_count': self.expiring_soon_count,
+            'total_value': self.total_value
+        }
+
+# Matches the 'expiring_soon' bucket of Item.status
+EXPIRING_SOON_DAYS = 3
+
+def summary_contribution(expiration_date, price, today):
+    """What one item adds to each counter of a given day"""
+    soon = today + timedelta(days=EXPIRING_SOON_DAYS)
+    expired = expiration_date is not None and expiration_date < today
+    expiring = expiration_date is not None and today <= expiration_date <= soon
+    return 1, int(expired), int(expiring), price or 0
+
+def apply_summary_delta(connection, before, after):
+    """Add the difference of two contributions to today's row, if it exists.
+    
+    A missing row is left alone; stats.refresh_daily_summary builds it in full.
+    """
+    delta = [new - old for old, new in zip(before, after)]
+    if not any(delta):
+        return
+    summary = DailyItemSummary.__table__.c
+    connection.execute(
+        update(DailyItemSummary.__table__)
+        .where(summary.summary_date == datetime.now().date())
+        .values(
+            total_items=summary.total_items + delta[0],
+            expired_count=summary.expired_count + delta[1],
+            expiring_soon_count=summary.expiring_soon_count + delta[2],
+            total_value=summary.total_value + delta[3],
+        )
+    )
+
+def _previous(target, attribute):
+    """Value an attribute had before the flush that is in progress"""
+    history = get_history(target, attribute)
+    if history.deleted:
+        return history.deleted[0]
+    return getattr(target, attribute)
+
+# Registered with the model rather than by the web app, so every process
+# that writes items (web, ocr_worker, scripts) keeps the rollup exact
+@event.listens_for(Item, 'after_insert')
+def _summary_after_insert(mapper, connection, target):
+    today = datetime.now().date()
+    apply_summary_delta(connection, (0, 0, 0, 0),
+                        summary_contribution(target.expiration_date, target.price, today))
+
+@event.listens_for(Item, 'after_update')
+def _summary_after_update(mapper, connection, target):
+    today = datetime.now().date()
+    before = summary_contribution(_previous(target, 'expiration_date'), _previous(target, 'price'), today)
+    after = summary_contribution(target.expiration_date, target.price, today)
+    apply_summary_delta(connection, before, after)
+
+@event.listens_for(Item, 'after_delete')
+def _summary_after_delete(mapper, connection, target):
+    today = datetime.now().date()
+    apply_summary_delta(connection, summary_contribution(target.expiration_date, target.price, today),
+                        (0, 0, 0, 0))
+
+class OcrJob(db.Model):
+    """Durable OCR work item shared by every web and worker process"""
+    __tablename__ = 'ocr_jobs'
+    
+    id = db.Column(db.String(32), primary_key=True)
+    status = db.Column(db.String(20), nullable=False, default='queued', index=True)
+    image_id = db.Column(db.String(64), nullable=False)
+    image_path = db.Column(db.String(500), nullable=False)
+    result = db.Column(db.Text, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    worker_id = db.Column(db.String(100), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    claimed_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    
+    def __repr__(self):
+        return f'<OcrJob {self.id} {self.status}>'
+    
+    def to_dict(self):
+        """Convert model to the job-status shape returned by /jobs/<id>"""
+        data = {'id': self.id, 'status': self.status}
+        if self.result is not None:
+            data['result'] = json.loads(self.result)
+        if self.error is not None:
+            data['error'] = self.error
+        return data
+
+class OcrResult(db.Model):
+    """Cached OCR and parse output for one stored image, engine and pipeline version"""
+    __tablename__ = 'ocr_results'
+    __table_args__ = (
+        db.UniqueConstraint('image_hash', 'engine', 'config_version', name='uq_ocr_results_key'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    image_hash = db.Column(db.String(64), nullable=False)
+    engine = db.Column(db.String(50), nullable=False)
+    config_version = db.Column(db.String(100), nullable=False)
+    result = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<OcrResult {self.image_hash[:12]} {self.engine} {self.config_version}>'
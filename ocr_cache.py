@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+OCR result cache keyed by (image hash, engine, pipeline version)
+"""
+
+import json
+from functools import lru_cache
+
+from sqlalchemy.exc import IntegrityError
+
+from models import db, OcrResult
+
+# Bump whenever preprocessing, OCR settings or receipt parsing change so
+# results from the previous pipeline are no longer served
+PIPELINE_VERSION = '3'
+
+BASIC_ENGINE = 'tesseract'
+ENHANCED_ENGINE = 'tesseract-enhanced'
+
+
+@lru_cache(maxsize=1)
+def config_version():
+    """Pipeline version plus the OCR engine and its version, or None without OCR"""
+    try:
+        import ocr_engine
+        return f"{PIPELINE_VERSION}/{ocr_engine.version()}"
+    except Exception:
+        # Placeholder results from a host without Tesseract are never cached
+        return None
+
+
+def get_cached_result(image_hash, engine):
+    """Cached result for an image under the current pipeline, or None"""
+    version = config_version()
+    if version is None:
+        return None
+    row = db.session.query(OcrResult.result).filter_by(
+        image_hash=image_hash, engine=engine, config_version=version
+    ).first()
+    return json.loads(row.result) if row else None
+
+
+def store_cached_result(image_hash, engine, result):
+    """Remember a result under the current pipeline"""
+    version = config_version()
+    if version is None:
+        return
+    db.session.add(OcrResult(image_hash=image_hash, engine=engine,
+                             config_version=version, result=json.dumps(result)))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Another worker cached the same image first
+        db.session.rollback()
+
+
+def purge_stale_results():
+    """Delete results cached by older pipelines; returns how many
+
+    Run from maintenance (``python -m receipt_storage``) rather than on
+    every write.
+    """
+    version = config_version()
+    if version is None:
+        return 0
+    purged = OcrResult.query.filter(OcrResult.config_version != version).delete(synchronize_session=False)
+    db.session.commit()
+    return purged
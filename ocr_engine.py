@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Tesseract OCR engines: persistent in-process handles with a subprocess fallback
+
+OCR_ENGINE selects the backend: 'tesserocr' keeps an initialized Tesseract
+API handle alive per thread (and per process) and feeds it pixel buffers
+directly; 'pytesseract' runs the tesseract binary for every call; 'auto'
+(the default) uses tesserocr when it is installed.
+"""
+
+import os
+import shlex
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+from PIL import Image
+
+OCR_ENGINE = os.getenv('OCR_ENGINE', 'auto').lower()
+OCR_LANG = os.getenv('OCR_LANG', 'eng')
+
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+DATA_KEYS = ('text', 'conf', 'block_num', 'par_num', 'line_num')
+
+
+def parse_config(config):
+    """Split a pytesseract-style config string into (psm, oem, variables)"""
+    psm = oem = None
+    variables = {}
+    args = shlex.split(config or '')
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg == '--psm':
+            psm = int(args[i + 1])
+            i += 1
+        elif arg == '--oem':
+            oem = int(args[i + 1])
+            i += 1
+        elif arg == '-c':
+            name, _, value = args[i + 1].partition('=')
+            variables[name] = value
+            i += 1
+        i += 1
+    return psm, oem, variables
+
+
+def _as_array(image):
+    """8-bit grayscale or RGB pixels from a PIL image or numpy array"""
+    if isinstance(image, Image.Image) and image.mode == '1':
+        # Bilevel pixels come out as booleans, which would read as 0 and 1
+        image = image.convert('L')
+    pixels = np.asarray(image)
+    if pixels.dtype == bool:
+        pixels = pixels.astype(np.uint8) * 255
+    elif pixels.dtype != np.uint8:
+        pixels = pixels.astype(np.uint8)
+    if pixels.ndim == 3 and pixels.shape[2] == 4:
+        pixels = pixels[:, :, :3]
+    return np.ascontiguousarray(pixels)
+
+
+class PytesseractEngine:
+    """One tesseract subprocess per call (always available)"""
+
+    name = 'pytesseract'
+
+    def image_to_string(self, image, config=''):
+        import pytesseract
+        return pytesseract.image_to_string(image, config=config)
+
+    def image_to_data(self, image, config=''):
+        import pytesseract
+        data = pytesseract.image_to_data(image, config=config, output_type=pytesseract.Output.DICT)
+        return {key: data[key] for key in DATA_KEYS}
+
+    def version(self):
+        import pytesseract
+        return f"tesseract-{pytesseract.get_tesseract_version()}"
+
+
+class TesserocrEngine:
+    """Initialized Tesseract API handles reused across calls
+
+    Loading traineddata is most of the cost of a small OCR call, so each
+    thread keeps its own handle per OCR engine mode. Handles are never
+    shared across threads or inherited across a fork.
+    """
+
+    name = 'tesserocr'
+
+    def __init__(self, lang=OCR_LANG):
+        self.lang = lang
+        self._local = threading.local()
+
+    def _api(self, oem):
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            local.pid = os.getpid()
+            local.handles = {}
+        oem = tesserocr.OEM.DEFAULT if oem is None else oem
+        if oem not in local.handles:
+            local.handles[oem] = tesserocr.PyTessBaseAPI(lang=self.lang, oem=oem)
+        return local.handles[oem]
+
+    @contextmanager
+    def _recognized(self, image, config):
+        """Recognize image with config applied; the handle is reset on exit
+
+        Variables are restored even if setting them or recognition fails,
+        so one bad call never leaks its settings into the next.
+        """
+        psm, oem, variables = parse_config(config)
+        api = self._api(oem)
+        previous = {}
+        try:
+            api.SetPageSegMode(tesserocr.PSM.AUTO if psm is None else psm)
+            for name, value in variables.items():
+                previous[name] = api.GetVariableAsString(name)
+                api.SetVariable(name, value)
+
+            pixels = _as_array(image)
+            height, width = pixels.shape[:2]
+            channels = 1 if pixels.ndim == 2 else pixels.shape[2]
+            api.SetImageBytes(pixels.tobytes(), width, height, channels, width * channels)
+            api.Recognize()
+            yield api
+        finally:
+            for name, value in previous.items():
+                api.SetVariable(name, value or '')
+            api.Clear()
+
+    def image_to_string(self, image, config=''):
+        with self._recognized(image, config) as api:
+            return api.GetUTF8Text()
+
+    def image_to_data(self, image, config=''):
+        data = {key: [] for key in DATA_KEYS}
+        with self._recognized(image, config) as api:
+            iterator = api.GetIterator()
+            if iterator is None:
+                return data
+            level = tesserocr.RIL.WORD
+            block = par = line = 0
+            for word in tesserocr.iterate_level(iterator, level):
+                if word.IsAtBeginningOf(tesserocr.RIL.BLOCK):
+                    block, par, line = block + 1, 0, 0
+                if word.IsAtBeginningOf(tesserocr.RIL.PARA):
+                    par, line = par + 1, 0
+                if word.IsAtBeginningOf(tesserocr.RIL.TEXTLINE):
+                    line += 1
+                data['text'].append(word.GetUTF8Text(level) or '')
+                data['conf'].append(word.Confidence(level))
+                data['block_num'].append(block)
+                data['par_num'].append(par)
+                data['line_num'].append(line)
+            return data
+
+    def version(self):
+        return f"tesserocr-{tesserocr.tesseract_version().split()[1]}"
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    """The configured engine, created on first use"""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                use_tesserocr = OCR_ENGINE == 'tesserocr' or (OCR_ENGINE == 'auto' and tesserocr is not None)
+                if use_tesserocr and tesserocr is None:
+                    raise RuntimeError('OCR_ENGINE=tesserocr but tesserocr is not installed')
+                _engine = TesserocrEngine() if use_tesserocr else PytesseractEngine()
+    return _engine
+
+
+def image_to_string(image, config=''):
+    """Text from a PIL image or numpy array"""
+    return get_engine().image_to_string(image, config)
+
+
+def image_to_data(image, config=''):
+    """Words with confidences and block/paragraph/line numbers, as lists"""
+    return get_engine().image_to_data(image, config)
+
+
+def version():
+    """Engine and Tesseract version, e.g. 'tesseract-5.3.0'"""
+    return get_engine().version()
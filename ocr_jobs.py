@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Bounded background execution of OCR jobs with status polling
+"""
+
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+OCR_WORKERS = int(os.getenv('OCR_WORKERS', 2))
+OCR_QUEUE_DEPTH = int(os.getenv('OCR_QUEUE_DEPTH', 16))
+# Finished jobs are kept this long for clients to collect them
+OCR_JOB_TTL = int(os.getenv('OCR_JOB_TTL', 3600))
+
+
+class QueueFull(RuntimeError):
+    """Raised when OCR capacity is exhausted and the job was not accepted"""
+
+
+class JobRunner:
+    """Run OCR work on a fixed-size pool so HTTP workers are never blocked.
+
+    Tesseract runs as a subprocess, so threads release the GIL while it
+    works. ``queue_depth`` bounds queued plus running jobs; callers get
+    QueueFull instead of an ever-growing backlog. Jobs live in this
+    process only; simple_app also records them in the ocr_jobs table so
+    any gunicorn worker can report their status.
+    """
+
+    def __init__(self, workers=OCR_WORKERS, queue_depth=OCR_QUEUE_DEPTH, ttl=OCR_JOB_TTL):
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self.ttl = ttl
+        self._executor = None
+        self._jobs = {}
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        # Created lazily so gunicorn's fork happens before any threads start
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='ocr')
+        return self._executor
+
+    def submit(self, func, *args, job_id=None, **kwargs):
+        """Queue func(*args, **kwargs) and return the job id (new unless given)"""
+        with self._lock:
+            self._prune()
+            if self._pending >= self.queue_depth:
+                raise QueueFull(f'OCR queue is full ({self.queue_depth} jobs)')
+            job_id = job_id or uuid.uuid4().hex
+            self._jobs[job_id] = {'id': job_id, 'status': 'queued', 'created_at': time.time()}
+            self._pending += 1
+        self._pool().submit(self._run, job_id, func, args, kwargs)
+        return job_id
+
+    def _run(self, job_id, func, args, kwargs):
+        job = self._jobs[job_id]
+        job['status'] = 'running'
+        try:
+            job['result'] = func(*args, **kwargs)
+            job['status'] = 'done'
+        except Exception as e:
+            job['error'] = str(e)
+            job['status'] = 'failed'
+        finally:
+            job['finished_at'] = time.time()
+            with self._lock:
+                self._pending -= 1
+
+    def _prune(self):
+        cutoff = time.time() - self.ttl
+        expired = [job_id for job_id, job in self._jobs.items() if job.get('finished_at', cutoff + 1) < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def get(self, job_id):
+        """Public view of a job, or None if unknown or expired"""
+        job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        return {key: value for key, value in job.items() if key in ('id', 'status', 'result', 'error')}
+
+
+runner = JobRunner()
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Durable OCR job queue stored in the ocr_jobs table
+"""
+
+import json
+import os
+import threading
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from sqlalchemy import or_, update
+
+from models import db, OcrJob
+
+# A running job whose worker has been silent this long is handed out again
+OCR_VISIBILITY_TIMEOUT = int(os.getenv('OCR_VISIBILITY_TIMEOUT', 600))
+OCR_MAX_ATTEMPTS = int(os.getenv('OCR_MAX_ATTEMPTS', 3))
+
+
+def enqueue_job(image_id, image_path):
+    """Record a queued job for an image already written to shared storage"""
+    job = OcrJob(id=uuid.uuid4().hex, status='queued', image_id=image_id, image_path=image_path)
+    db.session.add(job)
+    db.session.commit()
+    return job.id
+
+
+def start_local_job(image_id, image_path, worker_id):
+    """Record a job that this process runs on its own thread pool
+
+    It is stored as already claimed by worker_id, so status polls answered
+    by any web worker can find it, and an ocr_worker only takes it over if
+    this process dies and the claim goes stale.
+    """
+    job = OcrJob(id=uuid.uuid4().hex, status='running', image_id=image_id, image_path=image_path,
+                 worker_id=worker_id, claimed_at=datetime.utcnow(), attempts=1)
+    db.session.add(job)
+    db.session.commit()
+    return job.id
+
+
+def finish_local_job(job_id, result=None, error=None):
+    """Record how a job run by start_local_job's process ended
+
+    Failures are final: they come from the image itself, not from a worker
+    going away.
+    """
+    job = db.session.get(OcrJob, job_id)
+    if job is None:
+        return
+    if error is None:
+        complete_job(job, result)
+    else:
+        fail_job(job, error, retry=False)
+
+
+def discard_job(job_id):
+    """Forget a job that was recorded but never started"""
+    OcrJob.query.filter_by(id=job_id).delete()
+    db.session.commit()
+
+
+def get_job(job_id):
+    """Job status dictionary, or None if the id is unknown"""
+    job = db.session.get(OcrJob, job_id)
+    return job.to_dict() if job else None
+
+
+def _stale(now):
+    return (OcrJob.status == 'running') & \
+        (OcrJob.claimed_at < now - timedelta(seconds=OCR_VISIBILITY_TIMEOUT))
+
+
+def _claimable(now):
+    return or_(
+        OcrJob.status == 'queued',
+        _stale(now) & (OcrJob.attempts < OCR_MAX_ATTEMPTS)
+    )
+
+
+def fail_abandoned_jobs(now=None):
+    """Mark failed the stale jobs that already used every attempt
+
+    A job that crashes or kills its worker would otherwise be picked up
+    again forever.
+    """
+    now = now or datetime.utcnow()
+    failed = db.session.execute(
+        update(OcrJob)
+        .where(_stale(now), OcrJob.attempts >= OCR_MAX_ATTEMPTS)
+        .values(status='failed', finished_at=now,
+                error=f'Worker stopped responding on each of {OCR_MAX_ATTEMPTS} attempts')
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.session.commit()
+    return failed
+
+
+def claim_job(worker_id):
+    """Atomically take the oldest available job, or return None.
+
+    Postgres uses SELECT ... FOR UPDATE SKIP LOCKED so concurrent workers
+    never wait on each other's rows. Other databases fall back to a
+    compare-and-set UPDATE that only one worker can win.
+    """
+    now = datetime.utcnow()
+    attempts = 0
+    fail_abandoned_jobs(now)
+
+    if db.engine.dialect.name == 'postgresql':
+        job = OcrJob.query.filter(_claimable(now)).order_by(OcrJob.created_at) \
+            .with_for_update(skip_locked=True).first()
+        if job is None:
+            db.session.rollback()
+            return None
+        job.status = 'running'
+        job.worker_id = worker_id
+        job.claimed_at = now
+        job.attempts += 1
+        db.session.commit()
+        return job
+
+    while attempts < 5:
+        attempts += 1
+        candidate = db.session.query(OcrJob.id, OcrJob.status, OcrJob.claimed_at) \
+            .filter(_claimable(now)).order_by(OcrJob.created_at).first()
+        if candidate is None:
+            db.session.rollback()
+            return None
+        claimed = db.session.execute(
+            update(OcrJob)
+            .where(OcrJob.id == candidate.id, OcrJob.status == candidate.status,
+                   OcrJob.claimed_at.is_(None) if candidate.claimed_at is None
+                   else OcrJob.claimed_at == candidate.claimed_at)
+            .values(status='running', worker_id=worker_id, claimed_at=now, attempts=OcrJob.attempts + 1)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.session.commit()
+        if claimed == 1:
+            return db.session.get(OcrJob, candidate.id, populate_existing=True)
+    return None
+
+
+def touch_job(job_id, worker_id):
+    """Refresh a running job's claim; False once another worker has taken it"""
+    touched = db.session.execute(
+        update(OcrJob)
+        .where(OcrJob.id == job_id, OcrJob.worker_id == worker_id, OcrJob.status == 'running')
+        .values(claimed_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.session.commit()
+    return touched == 1
+
+
+@contextmanager
+def heartbeat(app, job_id, worker_id, interval=None):
+    """Keep a job's claim fresh from a background thread while the block runs
+
+    Without it, OCR that takes longer than OCR_VISIBILITY_TIMEOUT would be
+    claimed again and processed twice.
+    """
+    interval = interval or OCR_VISIBILITY_TIMEOUT / 3
+    stop = threading.Event()
+
+    def beat():
+        # Its own app context, so its own session
+        with app.app_context():
+            while True:
+                try:
+                    touch_job(job_id, worker_id)
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"Heartbeat for OCR job {job_id} failed: {e}")
+                if stop.wait(interval):
+                    break
+
+    thread = threading.Thread(target=beat, name=f'ocr-heartbeat-{job_id[:8]}', daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def complete_job(job, result):
+    """Store the result of a finished job"""
+    job.status = 'done'
+    job.result = json.dumps(result)
+    job.error = None
+    job.finished_at = datetime.utcnow()
+    db.session.commit()
+
+
+def fail_job(job, error, retry=True):
+    """Requeue a failed job, or mark it failed once it is out of attempts"""
+    job.error = error
+    if not retry or job.attempts >= OCR_MAX_ATTEMPTS:
+        job.status = 'failed'
+        job.finished_at = datetime.utcnow()
+    else:
+        job.status = 'queued'
+        job.claimed_at = None
+    db.session.commit()
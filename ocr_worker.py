@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Standalone OCR worker for the database-backed job queue
+
+Usage: python -m ocr_worker [--once] [--poll-interval SECONDS]
+"""
+
+import argparse
+import os
+import signal
+import socket
+import time
+
+from enhanced_receipt_ocr import convert_image_to_text_enhanced
+from ocr_cache import get_cached_result, store_cached_result, ENHANCED_ENGINE
+from models import db
+from ocr_queue import claim_job, complete_job, fail_job, heartbeat
+from receipt_processing import receipt_result, store_receipt_image
+
+_stopping = False
+
+
+def _request_stop(signum, frame):
+    """Finish the current job, then exit (sent by deploys and Ctrl+C)"""
+    global _stopping
+    _stopping = True
+
+
+def run_job(job, root_path):
+    """Run the enhanced OCR pipeline on a job's image and build its result
+
+    Images are stored by content hash, so a result cached for the same
+    image by any earlier job is reused.
+    """
+    cached = get_cached_result(job.image_id, ENHANCED_ENGINE)
+    if cached is not None:
+        return cached
+
+    # The web request only parked the upload; decode and store it here, or
+    # find the photo wherever receipt_storage has moved it since
+    receipts_dir = os.path.dirname(os.path.join(root_path, job.image_path))
+    image_path, img = store_receipt_image(receipts_dir, job.image_id)
+    ocr = convert_image_to_text_enhanced(image_path, image=img)
+    if ocr is None:
+        raise RuntimeError(f'OCR failed for {job.image_path}')
+    result = receipt_result(job.image_id, os.path.basename(job.image_path), ocr['best_text'])
+    store_cached_result(job.image_id, ENHANCED_ENGINE, result)
+    return result
+
+
+def work(app, worker_id, poll_interval=2.0, once=False):
+    """Claim and process jobs until stopped (or the queue is empty with once)"""
+    processed = 0
+    with app.app_context():
+        while not _stopping:
+            job = claim_job(worker_id)
+            if job is None:
+                if once:
+                    break
+                time.sleep(poll_interval)
+                continue
+
+            print(f"Processing OCR job {job.id} (attempt {job.attempts})")
+            try:
+                with heartbeat(app, job.id, worker_id):
+                    result = run_job(job, app.root_path)
+                complete_job(job, result)
+                print(f"✓ Job {job.id} done")
+            except Exception as e:
+                # The session may be mid-way through a failed flush or commit
+                db.session.rollback()
+                print(f"✗ Job {job.id} failed: {e}")
+                fail_job(job, str(e))
+            processed += 1
+    return processed
+
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description='Process queued receipt OCR jobs')
+    parser.add_argument('--once', action='store_true', help='exit when the queue is empty')
+    parser.add_argument('--poll-interval', type=float, default=2.0, help='seconds to wait when idle')
+    parser.add_argument('--worker-id', default=f'{socket.gethostname()}:{os.getpid()}')
+    args = parser.parse_args()
+
+    signal.signal(signal.SIGTERM, _request_stop)
+    signal.signal(signal.SIGINT, _request_stop)
+
+    from simple_app import app, DATABASE_AVAILABLE
+    if not DATABASE_AVAILABLE:
+        print("Database not available; the OCR worker needs the ocr_jobs table")
+        return
+
+    print(f"OCR worker {args.worker_id} started")
+    processed = work(app, args.worker_id, args.poll_interval, args.once)
+    print(f"OCR worker {args.worker_id} stopped after {processed} job(s)")
+
+
+if __name__ == "__main__":
+    main()
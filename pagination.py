@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Keyset (cursor) pagination helpers for the items API
+"""
+
+import base64
+import json
+from datetime import date
+
+from sqlalchemy import tuple_
+from sqlalchemy.orm import selectinload
+
+from models import Item, Receipt
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+
+class InvalidCursor(ValueError):
+    """Raised when a client sends a cursor we did not issue"""
+
+
+def encode_token(values):
+    """Pack a list of JSON-able values into an opaque URL-safe token"""
+    payload = json.dumps(values, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_token(token):
+    """Unpack a token produced by encode_token"""
+    padded = token + '=' * (-len(token) % 4)
+    return json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+
+
+def encode_cursor(item):
+    """Build an opaque cursor pointing just past the given item"""
+    expiration = item.expiration_date.isoformat() if item.expiration_date else None
+    return encode_token([expiration, item.id])
+
+
+def decode_cursor(cursor):
+    """Decode a cursor back into an (expiration_date, id) tuple"""
+    try:
+        expiration, item_id = decode_token(cursor)
+        if expiration is not None:
+            expiration = date.fromisoformat(expiration)
+        return expiration, int(item_id)
+    except Exception as e:
+        raise InvalidCursor(f'Invalid cursor: {cursor!r}') from e
+
+
+def parse_limit(value, default=DEFAULT_PAGE_SIZE, maximum=MAX_PAGE_SIZE):
+    """Clamp the ``limit`` query parameter to a sane page size"""
+    if value in (None, ''):
+        return default
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'Invalid limit: {value!r}')
+    return max(1, min(limit, maximum))
+
+
+def dated_items_after(query, cursor):
+    """Items with an expiration date, after the cursor if it is in the dated phase
+
+    A row-value comparison on ``(expiration_date, id)`` is a single range
+    seek on ix_items_expiration_date_id.
+    """
+    query = query.filter(Item.expiration_date.isnot(None))
+    if cursor is not None:
+        query = query.filter(tuple_(Item.expiration_date, Item.id) > tuple_(*cursor))
+    return query.order_by(Item.expiration_date.asc(), Item.id.asc())
+
+
+def undated_items_after(query, cursor):
+    """Items without an expiration date, after the cursor if it is in that phase"""
+    query = query.filter(Item.expiration_date.is_(None))
+    if cursor is not None and cursor[0] is None:
+        query = query.filter(Item.id > cursor[1])
+    return query.order_by(Item.id.asc())
+
+
+def keyset_page(query, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """Fetch one page of items plus the cursor for the next page.
+
+    Items come ordered by ``(expiration_date NULLS LAST, id)``, read as two
+    phases: dated items, then the NULL block by id. Each phase is one index
+    range seek, so a page costs the same however deep into the table the
+    client is; a page that spans the boundary runs both.
+    """
+    cursor = decode_cursor(cursor) if cursor else None
+
+    rows = []
+    if cursor is None or cursor[0] is not None:
+        rows = dated_items_after(query, cursor).limit(limit + 1).all()
+    if len(rows) <= limit:
+        rows += undated_items_after(query, cursor).limit(limit + 1 - len(rows)).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1])
+
+    return rows, next_cursor
+
+
+def receipt_page(cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """Fetch one page of receipts, newest first, with their items.
+
+    Items for the whole page arrive in a single batched ``IN`` query, so
+    serializing a page costs two statements however many receipts it holds.
+    """
+    query = Receipt.query.options(selectinload(Receipt.items))
+    if cursor:
+        try:
+            (receipt_pk,) = decode_token(cursor)
+            query = query.filter(Receipt.id < int(receipt_pk))
+        except Exception as e:
+            raise InvalidCursor(f'Invalid cursor: {cursor!r}') from e
+
+    rows = query.order_by(Receipt.id.desc()).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_token([rows[-1].id])
+
+    return rows, next_cursor
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Find the receipt in a photo, straighten it and crop away the background
+"""
+
+import os
+
+import cv2
+import numpy as np
+
+OCR_DETECT_RECEIPT = os.getenv('OCR_DETECT_RECEIPT', 'true').lower() == 'true'
+# Character height in pixels that Tesseract reads best; receipts are rescaled to it
+TARGET_TEXT_HEIGHT = int(os.getenv('OCR_TARGET_TEXT_HEIGHT', 30))
+
+DETECT_SIZE = 800           # longest side used for finding the paper
+MIN_RECEIPT_AREA = 0.15     # fraction of the photo the paper must cover
+MAX_RECEIPT_AREA = 0.97     # more than this means the paper fills the frame
+MIN_SKEW_DEGREES = 0.5
+
+
+def _order_corners(points):
+    """Corners as top-left, top-right, bottom-right, bottom-left"""
+    points = points.reshape(4, 2).astype(np.float32)
+    sums = points.sum(axis=1)
+    diffs = np.diff(points, axis=1).ravel()
+    return np.array([
+        points[np.argmin(sums)],
+        points[np.argmin(diffs)],
+        points[np.argmax(sums)],
+        points[np.argmax(diffs)],
+    ], dtype=np.float32)
+
+
+def find_receipt(gray):
+    """Corners of the paper in full-resolution coordinates, or None
+
+    Receipts are bright paper on a darker background: after a closing
+    that merges the printed text into the paper, the largest bright
+    region is taken as the receipt.
+    """
+    scale = DETECT_SIZE / max(gray.shape)
+    small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1 else gray
+    scale = min(scale, 1.0)
+
+    blurred = cv2.GaussianBlur(small, (5, 5), 0)
+    paper = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1]
+    paper = cv2.morphologyEx(paper, cv2.MORPH_CLOSE, np.ones((15, 15), np.uint8))
+    contours = cv2.findContours(paper, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[0]
+    if not contours:
+        return None
+
+    contour = max(contours, key=cv2.contourArea)
+    area = cv2.contourArea(contour) / (small.shape[0] * small.shape[1])
+    if not MIN_RECEIPT_AREA <= area <= MAX_RECEIPT_AREA:
+        return None
+
+    approx = cv2.approxPolyDP(contour, 0.02 * cv2.arcLength(contour, True), True)
+    if len(approx) == 4 and cv2.isContourConvex(approx):
+        corners = approx
+    else:
+        # Curled or torn paper: fall back to the tightest rotated box
+        corners = cv2.boxPoints(cv2.minAreaRect(contour))
+    return _order_corners(np.asarray(corners) / scale)
+
+
+def warp_to_rectangle(gray, corners):
+    """Perspective-correct the quadrilateral at corners into an upright rectangle"""
+    tl, tr, br, bl = corners
+    width = int(round(max(np.linalg.norm(tr - tl), np.linalg.norm(br - bl))))
+    height = int(round(max(np.linalg.norm(bl - tl), np.linalg.norm(br - tr))))
+    target = np.array([[0, 0], [width - 1, 0], [width - 1, height - 1], [0, height - 1]], dtype=np.float32)
+    matrix = cv2.getPerspectiveTransform(corners, target)
+    return cv2.warpPerspective(gray, matrix, (width, height), flags=cv2.INTER_CUBIC,
+                               borderMode=cv2.BORDER_REPLICATE)
+
+
+def _ink(gray):
+    return cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)[1]
+
+
+def text_angle(gray):
+    """Rotation of the printed lines in degrees, from the dark pixels' bounding box"""
+    coords = cv2.findNonZero(_ink(gray))
+    if coords is None or len(coords) < 50:
+        return 0.0
+    angle = cv2.minAreaRect(coords)[-1]
+    # The angle convention differs across OpenCV versions; fold it to the
+    # nearest axis either way
+    return float((angle + 45) % 90 - 45)
+
+
+def deskew(gray, angle):
+    """Rotate by angle degrees, growing the canvas so no corner is cut off"""
+    height, width = gray.shape
+    matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+    cos, sin = abs(matrix[0, 0]), abs(matrix[0, 1])
+    new_width, new_height = int(height * sin + width * cos), int(height * cos + width * sin)
+    matrix[0, 2] += new_width / 2 - width / 2
+    matrix[1, 2] += new_height / 2 - height / 2
+    return cv2.warpAffine(gray, matrix, (new_width, new_height), flags=cv2.INTER_CUBIC,
+                          borderMode=cv2.BORDER_REPLICATE)
+
+
+def text_height(gray):
+    """Median height of character-sized blobs, or None if there is no text"""
+    _, _, stats, _ = cv2.connectedComponentsWithStats(_ink(gray), connectivity=8)
+    heights = stats[1:, cv2.CC_STAT_HEIGHT]
+    widths = stats[1:, cv2.CC_STAT_WIDTH]
+    # Skip specks and rules/borders that are much wider than a character
+    mask = (heights >= 6) & (heights <= gray.shape[0] / 4) & (widths <= heights * 4)
+    if mask.sum() < 10:
+        return None
+    return float(np.median(heights[mask]))
+
+
+def prepare_receipt(gray, target_text_height=TARGET_TEXT_HEIGHT):
+    """Crop, straighten and scale a grayscale photo of a receipt for OCR
+
+    Returns (image, info). The paper is located and perspective-corrected
+    when it can be found, remaining tilt of the text lines is removed and
+    the result is resized so characters are about target_text_height
+    pixels tall. Anything that cannot be measured is left as it was.
+    """
+    info = {'cropped': False, 'angle': 0.0, 'scale': 1.0}
+
+    corners = find_receipt(gray)
+    if corners is not None:
+        gray = warp_to_rectangle(gray, corners)
+        info['cropped'] = True
+
+    angle = text_angle(gray)
+    if abs(angle) >= MIN_SKEW_DEGREES:
+        gray = deskew(gray, angle)
+        info['angle'] = round(angle, 2)
+
+    height = text_height(gray)
+    if height:
+        scale = min(max(target_text_height / height, 0.25), 4.0)
+        if abs(scale - 1) > 0.15:
+            interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_CUBIC
+            gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=interpolation)
+            info['scale'] = round(scale, 3)
+    return gray, info
+
+
+def prepare_for_ocr(image):
+    """Grayscale pixels of a PIL image or array, prepared when OCR_DETECT_RECEIPT is on"""
+    gray = np.asarray(image.convert('L')) if hasattr(image, 'convert') else np.asarray(image)
+    if gray.ndim == 3:
+        gray = cv2.cvtColor(gray, cv2.COLOR_RGB2GRAY)
+    if OCR_DETECT_RECEIPT:
+        gray = prepare_receipt(gray)[0]
+    return gray
+
+
+def find_strips(gray, strip_height, overlap):
+    """Row ranges (top, bottom, overlapped) that split a tall receipt into strips of about strip_height
+
+    Cuts go through the blank gap between text lines nearest each
+    strip_height boundary, so no line is split. Where there is no gap
+    within half a strip, the cut is forced: the strip below starts
+    ``overlap`` rows early, shares them with the one above and is marked
+    ``overlapped``, so stitching drops the repeated line there and only
+    there.
+    """
+    height, width = gray.shape
+    ink_per_row = (_ink(gray) > 0).sum(axis=1)
+    blank = ink_per_row <= max(1, width // 500)
+
+    strips = []
+    top = 0
+    overlapped = False
+    while height - top > strip_height * 1.5:
+        target = top + strip_height
+        low, high = target - strip_height // 2, min(height, target + strip_height // 2)
+        rows = np.flatnonzero(blank[low:high]) + low
+        if len(rows):
+            # Split the blank rows into runs and cut through the middle of
+            # the run closest to the target
+            runs = np.split(rows, np.flatnonzero(np.diff(rows) > 1) + 1)
+            centres = [int(run[len(run) // 2]) for run in runs]
+            cut = min(centres, key=lambda row: abs(row - target))
+            strips.append((top, cut, overlapped))
+            top, overlapped = cut, False
+        else:
+            strips.append((top, min(height, target + overlap // 2), overlapped))
+            top, overlapped = target - overlap // 2, True
+    strips.append((top, height, overlapped))
+    return strips
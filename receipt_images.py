@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Resized receipt image variants for lists and detail pages
+"""
+
+import io
+import os
+import re
+import tempfile
+
+from PIL import Image
+
+from receipt_storage import locate_original, shard_dir
+
+# Longest side in pixels; 'full' is the stored original
+VARIANT_SIZES = {'thumb': 200, 'medium': 800}
+VARIANT_QUALITY = {'JPEG': 80, 'WEBP': 75}
+
+_FILENAME = re.compile(r'^receipt_[0-9a-f-]+\.(jpg|webp)$')
+
+
+def is_receipt_filename(filename):
+    """Only names produced by store_receipt_image may be served"""
+    return bool(_FILENAME.match(filename))
+
+
+def variant_path(receipts_dir, filename, size, accept_webp=False):
+    """File and format of the copy of a stored image to send, or (None, None).
+
+    Originals may have been re-encoded or moved to cold storage by
+    receipt_storage; they are found wherever they are. Resized copies are
+    made on first use under sharded receipts/variants/ab/cd/ directories
+    and, since originals never change, only written once; they go to a
+    temporary name first so concurrent requests never see a partial file.
+    A WebP original asked for in full by a browser without WebP support is
+    converted in memory and returned as a file object rather than stored
+    a second time at full size.
+    """
+    original = locate_original(receipts_dir, filename)
+    if original is None:
+        return None, None
+
+    original_fmt = 'WEBP' if original.endswith('.webp') else 'JPEG'
+    if size == 'full' and (original_fmt == 'JPEG' or accept_webp):
+        return original, original_fmt
+
+    fmt = 'WEBP' if accept_webp else 'JPEG'
+    if size == 'full':
+        buf = io.BytesIO()
+        with Image.open(original) as img:
+            img.convert('RGB').save(buf, fmt, quality=VARIANT_QUALITY[fmt])
+        buf.seek(0)
+        return buf, fmt
+
+    variants_dir = shard_dir(os.path.join(receipts_dir, 'variants'), filename)
+    stem = os.path.splitext(filename)[0]
+    path = os.path.join(variants_dir, f"{stem}_{size}.{fmt.lower()}")
+    if os.path.exists(path):
+        return path, fmt
+
+    os.makedirs(variants_dir, exist_ok=True)
+    with Image.open(original) as img:
+        # draft() lets the JPEG decoder skip detail the thumbnail won't use
+        bound = VARIANT_SIZES[size]
+        img.draft('RGB', (bound, bound))
+        img.thumbnail((bound, bound), Image.LANCZOS)
+        fd, tmp_path = tempfile.mkstemp(dir=variants_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            img.save(f, fmt, quality=VARIANT_QUALITY[fmt])
+    os.replace(tmp_path, path)
+    return path, fmt
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Receipt image processing: save the upload and extract text with OCR
+"""
+
+import io
+import os
+import tempfile
+from datetime import datetime
+
+from PIL import Image, UnidentifiedImageError
+
+from receipt_storage import locate_original
+
+
+def load_receipt_image(source):
+    """Decode an image once from a path, file object or bytes, as RGB"""
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    img = Image.open(source)
+    img.load()
+    # Convert to RGB if needed
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    return img
+
+
+def normalize_image(img):
+    """Canonical stored form of a receipt photo: RGB JPEG at quality 85"""
+    buf = io.BytesIO()
+    img.save(buf, 'JPEG', quality=85, optimize=True)
+    return buf.getvalue()
+
+
+def receipt_filename(image_id):
+    return f"receipt_{image_id}.jpg"
+
+
+def pending_upload_path(receipts_dir, image_id):
+    """Where an upload waits, still undecoded, for its OCR job
+
+    Kept out of receipts/uploads, which prune_uploads empties of anything
+    old, so a job that waits long in the queue still finds its image.
+    """
+    return os.path.join(receipts_dir, 'queued', f"{image_id}.upload")
+
+
+def check_image(path):
+    """Raise ValueError unless the file is an image Pillow can open
+
+    Only the header is read; the pixels are decoded later, by the OCR job.
+    """
+    try:
+        with Image.open(path):
+            pass
+    except UnidentifiedImageError:
+        raise ValueError('Upload is not a supported image') from None
+
+
+def park_upload(upload_path, receipts_dir, image_id):
+    """Hand a spooled upload, named by the SHA-256 of its bytes, to its OCR job
+
+    The upload is moved next to the stored photos rather than decoded
+    here, so requests and the in-memory queue never hold pixels. Returns
+    the filename the photo is stored under.
+    """
+    filename = receipt_filename(image_id)
+    if locate_original(receipts_dir, filename) is not None:
+        os.remove(upload_path)
+    else:
+        pending = pending_upload_path(receipts_dir, image_id)
+        os.makedirs(os.path.dirname(pending), exist_ok=True)
+        os.replace(upload_path, pending)
+    return filename
+
+
+def store_receipt_image(receipts_dir, image_id):
+    """Decode a queued photo once and make sure it is stored; returns (path, image)
+
+    The image is the parked upload's own pixels, decoded once for both
+    storage and OCR. Stored photos are normalized JPEGs written under a
+    temporary name first, so readers never see a partial file. The copy is
+    looked for in every tier and format receipt_storage may have moved it
+    to, so uploading the same bytes again, or running a job again later,
+    reuses it (and decodes that copy instead).
+    """
+    filename = receipt_filename(image_id)
+    stored = locate_original(receipts_dir, filename)
+    if stored is not None:
+        return stored, load_receipt_image(stored)
+
+    pending = pending_upload_path(receipts_dir, image_id)
+    try:
+        img = load_receipt_image(pending)
+    except FileNotFoundError:
+        # Another job for the same upload stored it first
+        stored = locate_original(receipts_dir, filename)
+        if stored is not None:
+            return stored, load_receipt_image(stored)
+        raise
+
+    image_path = os.path.join(receipts_dir, filename)
+
+    fd, tmp_path = tempfile.mkstemp(dir=receipts_dir, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(normalize_image(img))
+    os.replace(tmp_path, image_path)
+    try:
+        os.remove(pending)
+    except FileNotFoundError:
+        pass
+
+    print(f"Image saved to: {image_path}")
+    return image_path, img
+
+
+def extract_text(image):
+    """Plain single-pass Tesseract OCR
+
+    Failures (including Tesseract not being installed) propagate, so the
+    job is recorded as failed and nothing is cached for the image.
+    """
+    import ocr_engine
+    from receipt_geometry import prepare_for_ocr
+    ocr_text = ocr_engine.image_to_string(prepare_for_ocr(image))
+    print(f"OCR extracted text: {ocr_text[:100]}...")
+    return ocr_text
+
+
+def receipt_result(image_id, filename, ocr_text):
+    """Receipt data returned to the camera page for a processed image"""
+    # For now, return mock data with OCR text - in production you'd parse OCR results
+    return {
+        'is_receipt': True,
+        'vendor': 'Safeway',
+        'date': datetime.now().strftime('%Y-%m-%d'),
+        'total': '$45.67',
+        'image_path': f"receipts/{filename}",
+        'image_id': image_id,
+        'image_hash': image_id,
+        'ocr_text': ocr_text,
+        'items': [
+            {'name': 'Organic Milk', 'price': 4.99, 'expiration_days': 7},
+            {'name': 'Whole Wheat Bread', 'price': 2.49, 'expiration_days': 5},
+            {'name': 'Free Range Eggs', 'price': 5.99, 'expiration_days': 14},
+            {'name': 'Greek Yogurt', 'price': 3.99, 'expiration_days': 10},
+            {'name': 'Fresh Spinach', 'price': 2.99, 'expiration_days': 3}
+        ]
+    }
+
+
+def ocr_receipt(img, image_id, filename):
+    """OCR an already stored receipt photo and return the receipt data"""
+    return receipt_result(image_id, filename, extract_text(img))
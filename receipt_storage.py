@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Compaction and cold-tier storage for stored receipt photos
+
+Usage: python -m receipt_storage [--older-than DAYS] [--dry-run]
+
+Originals whose OCR has finished are re-encoded as WebP, OCR results
+cached by older pipelines are deleted, and photos older than the cutoff
+move from receipts/ into a sharded cold directory
+(receipts/cold/ab/cd/receipt_abcd....jpg by default), so no single
+directory grows without bound. serve_receipt_image finds a photo
+in whichever tier and format it ended up.
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from PIL import Image
+
+RECEIPTS_COLD_DIR = os.getenv('RECEIPTS_COLD_DIR')
+COLD_AFTER_DAYS = int(os.getenv('RECEIPTS_COLD_AFTER_DAYS', 90))
+WEBP_QUALITY = int(os.getenv('RECEIPTS_WEBP_QUALITY', 80))
+
+_EXTENSIONS = ('.jpg', '.webp')
+
+
+def cold_dir(receipts_dir):
+    return RECEIPTS_COLD_DIR or os.path.join(receipts_dir, 'cold')
+
+
+def _image_id(filename):
+    return os.path.splitext(filename)[0][len('receipt_'):]
+
+
+def shard_dir(base_dir, filename):
+    """base_dir/ab/cd for photo receipt_abcd..., so no one directory grows without bound"""
+    image_id = _image_id(filename)
+    return os.path.join(base_dir, image_id[:2], image_id[2:4])
+
+
+def cold_path(receipts_dir, filename):
+    """Sharded cold-tier location for a stored photo"""
+    return os.path.join(shard_dir(cold_dir(receipts_dir), filename), filename)
+
+
+def locate_original(receipts_dir, filename):
+    """Current path of a stored photo in any tier or format, or None"""
+    stem = os.path.splitext(filename)[0]
+    for ext in _EXTENSIONS:
+        path = os.path.join(receipts_dir, stem + ext)
+        if os.path.exists(path):
+            return path
+    for ext in _EXTENSIONS:
+        path = cold_path(receipts_dir, stem + ext)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def ocr_finished_ids():
+    """Image ids that no longer need their original for OCR"""
+    from models import db, OcrJob, OcrResult, Receipt
+
+    ids = set()
+    ids.update(row[0] for row in db.session.query(OcrResult.image_hash).distinct())
+    ids.update(row[0] for row in db.session.query(Receipt.image_hash).filter(Receipt.image_hash.isnot(None)))
+    ids.update(row[0] for row in db.session.query(OcrJob.image_id).filter(OcrJob.status == 'done'))
+    return ids
+
+
+def _hot_originals(receipts_dir):
+    for entry in os.scandir(receipts_dir):
+        if entry.is_file() and entry.name.startswith('receipt_') and entry.name.endswith(_EXTENSIONS):
+            yield entry
+
+
+def recompress(path):
+    """Re-encode a JPEG as WebP if that is smaller; returns (new_path, bytes_saved)
+
+    The file keeps its modification time so tiering still sees its age.
+    """
+    before = os.stat(path)
+    target = os.path.splitext(path)[0] + '.webp'
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with Image.open(path) as img, os.fdopen(fd, 'wb') as f:
+            img.save(f, 'WEBP', quality=WEBP_QUALITY, method=6)
+        saved = before.st_size - os.path.getsize(tmp_path)
+        if saved <= 0:
+            os.remove(tmp_path)
+            return path, 0
+        os.utime(tmp_path, (before.st_atime, before.st_mtime))
+        os.replace(tmp_path, target)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.remove(path)
+    return target, saved
+
+
+def compact(receipts_dir, finished_ids, older_than_days=COLD_AFTER_DAYS, dry_run=False):
+    """Re-encode finished originals and move old ones to the cold tier"""
+    stats = {'recompressed': 0, 'moved': 0, 'bytes_before': 0, 'bytes_reclaimed': 0}
+    cutoff = time.time() - older_than_days * 86400
+
+    for entry in list(_hot_originals(receipts_dir)):
+        path = entry.path
+        info = entry.stat()
+        stats['bytes_before'] += info.st_size
+
+        if path.endswith('.jpg') and _image_id(entry.name) in finished_ids and not dry_run:
+            path, saved = recompress(path)
+            if saved:
+                stats['recompressed'] += 1
+                stats['bytes_reclaimed'] += saved
+
+        if info.st_mtime < cutoff:
+            stats['moved'] += 1
+            if not dry_run:
+                destination = cold_path(receipts_dir, os.path.basename(path))
+                os.makedirs(os.path.dirname(destination), exist_ok=True)
+                if os.path.exists(destination):
+                    # Re-uploaded after it went cold; the cold copy is the same image
+                    os.remove(path)
+                else:
+                    shutil.move(path, destination)
+    return stats
+
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description='Compact and tier stored receipt photos')
+    parser.add_argument('--older-than', type=int, default=COLD_AFTER_DAYS,
+                        help='move photos older than this many days to cold storage')
+    parser.add_argument('--dry-run', action='store_true', help='report what would move without changing files')
+    args = parser.parse_args()
+
+    from simple_app import app, DATABASE_AVAILABLE
+    receipts_dir = os.path.join(app.root_path, 'receipts')
+    if not os.path.isdir(receipts_dir):
+        print(f"No receipts directory at {receipts_dir}")
+        return
+
+    finished_ids = set()
+    if DATABASE_AVAILABLE:
+        from ocr_cache import purge_stale_results
+        with app.app_context():
+            finished_ids = ocr_finished_ids()
+            print(f"Purged {purge_stale_results()} OCR result(s) from older pipelines")
+    else:
+        print("Database not available; skipping re-encoding")
+
+    stats = compact(receipts_dir, finished_ids, args.older_than, args.dry_run)
+    print(f"Scanned {stats['bytes_before'] / 1e6:.1f} MB in receipts/")
+    print(f"Re-encoded {stats['recompressed']} photo(s), "
+          f"reclaimed {stats['bytes_reclaimed'] / 1e6:.1f} MB")
+    print(f"{'Would move' if args.dry_run else 'Moved'} {stats['moved']} photo(s) "
+          f"older than {args.older_than} days to {cold_dir(receipts_dir)}")
+
+
+if __name__ == "__main__":
+    main()
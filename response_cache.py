@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+Read-through cache for rendered pages and API payloads
+"""
+
+import base64
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from functools import wraps
+
+from flask import g, request, session, make_response
+
+from http_cache import data_version
+
+
+CACHE_TTL = int(os.getenv('CACHE_TTL', 300))
+# How long one worker may hold the right to compute a key before others
+# give up waiting and compute it themselves
+CACHE_LOCK_MS = int(os.getenv('CACHE_LOCK_MS', 5000))
+CACHE_POLL_SECONDS = 0.05
+
+
+class LRUBackend:
+    """In-process LRU cache; each gunicorn worker holds its own copy"""
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def lock(self, key, ttl_ms):
+        """Nothing to coordinate beyond this process's SingleFlight"""
+        return 'local'
+
+    def locked(self, key):
+        return False
+
+    def unlock(self, key, token):
+        pass
+
+
+class RedisBackend:
+    """Cache shared by every worker through Redis (or anything with its API)
+
+    Clearing bumps a generation counter that is part of every key, so
+    stale entries simply stop being read and age out through their TTL.
+    Entries are stored as JSON, never pickled, since any client of the
+    shared Redis can write to it.
+    """
+
+    def __init__(self, client, prefix='expiry:cache'):
+        self.client = client
+        self.prefix = prefix
+
+    def _key(self, key):
+        generation = self.client.get(f'{self.prefix}:generation') or b'0'
+        if isinstance(generation, bytes):
+            generation = generation.decode('ascii')
+        return f'{self.prefix}:{generation}:{key}'
+
+    def get(self, key):
+        value = self.client.get(self._key(key))
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, value, ttl):
+        self.client.set(self._key(key), json.dumps(value), ex=int(ttl))
+
+    def clear(self):
+        self.client.incr(f'{self.prefix}:generation')
+
+    def lock(self, key, ttl_ms):
+        """Take the right to compute key across all workers; a token, or None if held"""
+        token = uuid.uuid4().hex
+        if self.client.set(f'{self._key(key)}:lock', token, nx=True, px=ttl_ms):
+            return token
+        return None
+
+    def locked(self, key):
+        return self.client.get(f'{self._key(key)}:lock') is not None
+
+    def unlock(self, key, token):
+        lock_key = f'{self._key(key)}:lock'
+        current = self.client.get(lock_key)
+        if isinstance(current, bytes):
+            current = current.decode('ascii')
+        # Only release our own lock; if it expired someone else may hold it now
+        if current == token:
+            self.client.delete(lock_key)
+
+
+class SingleFlight:
+    """Coalesce concurrent computations of the same key into one call"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, compute):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {'done': threading.Event(), 'result': None, 'error': None}
+
+        if not leader:
+            call['done'].wait()
+            if call['error'] is not None:
+                raise call['error']
+            return call['result']
+
+        try:
+            call['result'] = compute()
+            return call['result']
+        except Exception as e:
+            call['error'] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call['done'].set()
+
+
+def create_backend():
+    """Pick the backend from CACHE_BACKEND ('memory' or 'redis')"""
+    if os.getenv('CACHE_BACKEND', 'memory').lower() == 'redis':
+        try:
+            import redis
+            client = redis.Redis.from_url(os.getenv('CACHE_REDIS_URL', 'redis://localhost:6379/0'))
+            return RedisBackend(client)
+        except Exception as e:
+            print(f"Redis cache not available, using in-process cache: {e}")
+    return LRUBackend(int(os.getenv('CACHE_MAX_ENTRIES', 256)))
+
+
+backend = create_backend()
+_flights = SingleFlight()
+
+
+def invalidate():
+    """Drop cached responses; called by every route that writes items"""
+    backend.clear()
+
+
+def _cache_key():
+    """Route, sorted query parameters, today's date and the data fingerprint.
+
+    The fingerprint makes entries from other workers' caches unreachable
+    as soon as the data changes, even before they are invalidated.
+    """
+    fingerprint = getattr(g, 'data_fingerprint', None)
+    if fingerprint is None:
+        fingerprint, _ = data_version()
+    params = '&'.join(f'{k}={v}' for k, v in sorted(request.args.items(multi=True)))
+    return f'{request.path}?{params}|{datetime.now().date()}|{fingerprint}'
+
+
+def _entry(response):
+    """JSON-safe copy of a response to store in the cache"""
+    return {
+        'body': base64.b64encode(response.get_data()).decode('ascii'),
+        'status': response.status_code,
+        'headers': [['Content-Type', response.content_type]],
+    }
+
+
+def _response(entry):
+    """A fresh response for one request, built from a cached entry"""
+    return make_response(base64.b64decode(entry['body']), entry['status'], entry['headers'])
+
+
+def _wait_for_entry(key):
+    """Poll the shared cache while another worker computes key
+
+    Returns the entry, or None once that worker's lock is gone without an
+    entry (its response was not cacheable, or it died) or the wait runs out.
+    """
+    deadline = time.monotonic() + CACHE_LOCK_MS / 1000
+    while time.monotonic() < deadline:
+        time.sleep(CACHE_POLL_SECONDS)
+        entry = backend.get(key)
+        if entry is not None:
+            return entry
+        if not backend.locked(key):
+            return None
+    return None
+
+
+def cached(view):
+    """Serve a view's 200 responses from the cache, computing each key once
+
+    Within a worker, concurrent misses wait on one SingleFlight call. With
+    the Redis backend the computing worker also holds a short lock in Redis,
+    and other workers poll for its entry instead of running the query too.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.method != 'GET' or session.get('_flashes'):
+            return view(*args, **kwargs)
+
+        try:
+            key = _cache_key()
+        except Exception as e:
+            print(f"Response cache bypassed: {e}")
+            return view(*args, **kwargs)
+
+        # A response that cannot be cached goes only to the request that made it
+        uncached = {}
+
+        def render():
+            entry = backend.get(key)
+            if entry is not None:
+                return entry
+            token = backend.lock(key, CACHE_LOCK_MS)
+            if token is None:
+                entry = _wait_for_entry(key)
+                if entry is not None:
+                    return entry
+            try:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200 or response.is_streamed:
+                    uncached['response'] = response
+                    return None
+                entry = _entry(response)
+                backend.set(key, entry, CACHE_TTL)
+                return entry
+            finally:
+                if token is not None:
+                    backend.unlock(key, token)
+
+        entry = backend.get(key)
+        if entry is None:
+            entry = _flights.do(key, render)
+        if entry is None:
+            return uncached.get('response') or view(*args, **kwargs)
+        return _response(entry)
+
+    return wrapper
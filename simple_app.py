@@ -4,7 +4,7 @@ Simple Flask app for Expiry Tracker - minimal startup
 """
 
 import os
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash
+from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, Response, stream_with_context
 from flask_migrate import Migrate
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
@@ -12,6 +12,7 @@ import base64
 import io
 from PIL import Image
 import json
+import socket
 import uuid
 
 # Load environment variables
@@ -30,33 +31,64 @@ if not database_url:
 app.config['SQLALCHEMY_DATABASE_URI'] = database_url
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# 'memory' runs OCR on this process's thread pool; 'database' queues it in
+# the ocr_jobs table for `python -m ocr_worker` processes
+OCR_QUEUE = os.getenv('OCR_QUEUE', 'memory').lower()
+# Camera uploads are scaled on the phone to this narrow side and JPEG quality
+UPLOAD_SHORT_SIDE = int(os.getenv('UPLOAD_SHORT_SIDE', 1200))
+UPLOAD_QUALITY = float(os.getenv('UPLOAD_QUALITY', 0.82))
+
+# Per-route timings at /metrics, slowest statements at /admin/slow_queries
+from metrics import init_metrics
+from slow_query import init_slow_query_admin
+init_metrics(app)
+init_slow_query_admin(app)
+
 # Try to import models, but don't fail if database is not available
 try:
     from models import db, Item, Receipt
+    from http_cache import conditional
+    from response_cache import cached, invalidate as invalidate_cache
+    from stats import get_item_stats, enable_daily_summary, items_with_status, status_summary, empty_status_summary
     db.init_app(app)
     migrate = Migrate(app, db)
+    if os.getenv('DAILY_SUMMARY_ENABLED', 'false').lower() == 'true':
+        enable_daily_summary()
     DATABASE_AVAILABLE = True
     print("Database models loaded successfully")
 except Exception as e:
     print(f"Database models not available: {e}")
     DATABASE_AVAILABLE = False
+    
+    def conditional(view):
+        return view
+    
+    def cached(view):
+        return view
+    
+    try:
+        from stats import empty_status_summary
+    except Exception:
+        from collections import defaultdict
+        
+        def empty_status_summary():
+            return {'counts': defaultdict(int), 'total_items': 0, 'total_value': 0.0}
 
 @app.route('/')
+@conditional
+@cached
 def index():
     """Simple home page"""
     if not DATABASE_AVAILABLE:
-        return render_template('mobile_index.html', items=[])
+        return render_template('mobile_index.html', items=[], summary=empty_status_summary())
     
     try:
-        items = Item.query.order_by(Item.expiration_date.asc().nulls_last()).all()
-        print(f"Found {len(items)} items in database")
-        for item in items:
-            print(f"- {item.product_name}: {item.expiration_date}")
-        print(f"Rendering template with {len(items)} items")
-        return render_template('mobile_index_fixed.html', items=items)
+        today = datetime.now().date()
+        items = items_with_status(Item.query.order_by(Item.expiration_date.asc().nulls_last()), today)
+        return render_template('mobile_index_fixed.html', items=items, summary=status_summary(today))
     except Exception as e:
         print(f"Database error: {e}")
-        return render_template('mobile_index_fixed.html', items=[])
+        return render_template('mobile_index_fixed.html', items=[], summary=empty_status_summary())
 
 @app.route('/health')
 def health_check():
@@ -108,6 +140,7 @@ def add_item():
             
             db.session.add(item)
             db.session.commit()
+            invalidate_cache()
             
             flash(f'Item "{product_name}" added successfully!', 'success')
             return redirect(url_for('index'))
@@ -169,7 +202,143 @@ def test_template():
         print(f"Template error: {e}")
         return render_template('test.html', items=[])
 
+@app.route('/api/items')
+@conditional
+@cached
+def api_items():
+    """API endpoint to get items as JSON, one keyset page at a time
+
+    Pass ``all=1`` to get the legacy unpaginated list of every item.
+    """
+    if not DATABASE_AVAILABLE:
+        return jsonify({'error': 'Database not available'}), 500
+    
+    from pagination import keyset_page, parse_limit
+    
+    if request.args.get('all') == '1':
+        items = Item.query.order_by(Item.expiration_date.asc().nulls_last(), Item.id.asc()).all()
+        return jsonify([item.to_dict() for item in items])
+    
+    try:
+        limit = parse_limit(request.args.get('limit'))
+        items, next_cursor = keyset_page(Item.query, request.args.get('cursor'), limit)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify({
+        'items': [item.to_dict() for item in items],
+        'next_cursor': next_cursor
+    })
+
+@app.route('/api/items/changes')
+def api_item_changes():
+    """Delta sync: items created or updated, and ids deleted, since a token
+
+    Call without ``since`` for the initial sync and keep the returned
+    ``next_token`` for the next call.
+    """
+    if not DATABASE_AVAILABLE:
+        return jsonify({'error': 'Database not available'}), 500
+    
+    from pagination import parse_limit, MAX_PAGE_SIZE
+    from sync import changes_since
+    
+    try:
+        limit = parse_limit(request.args.get('limit'), default=MAX_PAGE_SIZE)
+        return jsonify(changes_since(request.args.get('since'), limit))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/api/receipts')
+def api_receipts():
+    """API endpoint to get receipts with their items, one page at a time"""
+    if not DATABASE_AVAILABLE:
+        return jsonify({'error': 'Database not available'}), 500
+    
+    from pagination import receipt_page, parse_limit
+    
+    try:
+        limit = parse_limit(request.args.get('limit'))
+        receipts, next_cursor = receipt_page(request.args.get('cursor'), limit)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify({
+        'receipts': [receipt.to_dict() for receipt in receipts],
+        'next_cursor': next_cursor
+    })
+
+@app.route('/api/receipts', methods=['POST'])
+def api_create_receipt():
+    """Create a receipt and its items in one bulk, idempotent write
+    
+    Send the same ``Idempotency-Key`` header (or ``idempotency_key`` field)
+    when retrying; the first stored result is returned with status 200.
+    """
+    if not DATABASE_AVAILABLE:
+        return jsonify({'error': 'Database not available'}), 500
+    
+    from ingest import ingest_receipt, DuplicateReceipt
+    
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({'error': 'No receipt data provided'}), 400
+    
+    try:
+        idempotency_key = request.headers.get('Idempotency-Key') or data.get('idempotency_key')
+        receipt, created = ingest_receipt(data, idempotency_key)
+    except DuplicateReceipt as e:
+        return jsonify({'error': str(e)}), 409
+    except (KeyError, ValueError) as e:
+        db.session.rollback()
+        return jsonify({'error': f'Invalid receipt data: {e}'}), 400
+    
+    if created:
+        invalidate_cache()
+    return jsonify(receipt), 201 if created else 200
+
+@app.route('/api/receipts/<receipt_id>')
+def api_receipt_detail(receipt_id):
+    """API endpoint to get a single receipt with its items"""
+    if not DATABASE_AVAILABLE:
+        return jsonify({'error': 'Database not available'}), 500
+    
+    from sqlalchemy.orm import selectinload
+    
+    receipt = Receipt.query.options(selectinload(Receipt.items)).filter_by(receipt_id=receipt_id).first()
+    if receipt is None:
+        return jsonify({'error': 'Receipt not found'}), 404
+    return jsonify(receipt.to_dict())
+
+@app.route('/api/export/<table>')
+def api_export(table):
+    """Stream every item or receipt as NDJSON (default) or CSV
+
+    Rows are written as they are fetched, so memory stays flat and the
+    first bytes go out before the query has finished.
+    """
+    if not DATABASE_AVAILABLE:
+        return jsonify({'error': 'Database not available'}), 500
+    
+    from export import EXPORTS, EXPORT_FORMATS, generate_export
+    
+    if table not in EXPORTS:
+        return jsonify({'error': f'Unknown export: {table}'}), 404
+    
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'error': f'Unsupported format: {export_format}'}), 400
+    
+    filename = f"{table}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.{export_format}"
+    return Response(
+        stream_with_context(generate_export(table, export_format)),
+        mimetype=EXPORT_FORMATS[export_format],
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
 @app.route('/expiring_soon')
+@conditional
+@cached
 def expiring_soon():
     """Show items expiring soon"""
     if not DATABASE_AVAILABLE:
@@ -178,126 +347,308 @@ def expiring_soon():
     try:
         today = datetime.now().date()
         next_week = today + timedelta(days=7)
-        items = Item.query.filter(
+        items = items_with_status(Item.query.filter(
             Item.expiration_date >= today,
             Item.expiration_date <= next_week
-        ).order_by(Item.expiration_date.asc()).all()
+        ).order_by(Item.expiration_date.asc()), today)
         return render_template('mobile_items_list.html', items=items)
     except Exception as e:
         print(f"Database error: {e}")
         return render_template('mobile_items_list.html', items=[])
 
 @app.route('/analytics')
+@conditional
 def analytics():
     """Show analytics"""
     if not DATABASE_AVAILABLE:
         return jsonify({'error': 'Database not available'})
     
     try:
-        total_items = Item.query.count()
-        today = datetime.now().date()
-        expired_count = Item.query.filter(Item.expiration_date < today).count()
-        expiring_soon_count = Item.query.filter(
-            Item.expiration_date >= today,
-            Item.expiration_date <= today + timedelta(days=3)
-        ).count()
-        total_value = db.session.query(db.func.sum(Item.price)).scalar() or 0
-        
-        return jsonify({
-            'total_items': total_items,
-            'expired_count': expired_count,
-            'expiring_soon_count': expiring_soon_count,
-            'total_value': total_value
-        })
+        return jsonify(get_item_stats())
     except Exception as e:
         return jsonify({'error': str(e)})
 
 @app.route('/camera')
 def camera_capture():
     """Camera capture page for receipt scanning"""
-    return render_template('camera_capture.html')
+    return render_template('camera_capture.html',
+                           upload_short_side=UPLOAD_SHORT_SIDE,
+                           upload_quality=UPLOAD_QUALITY)
 
 @app.route('/process_receipt', methods=['POST'])
 def process_receipt():
-    """Process receipt image from camera"""
+    """Queue a receipt image from the camera for OCR
+    
+    Accepts a multipart upload (field ``image``), a raw ``image/*`` body or
+    the older JSON ``{"image": <base64 data URL>}``. Bodies are streamed
+    to a file and hashed on the way rather than read into memory. Returns
+    202 with a job id right away; poll /jobs/<job_id> for the result. A
+    photo that has been processed before comes back at once with 200 and
+    the cached result.
+    """
+    from ocr_jobs import QueueFull
+    from uploads import spool_to_tempfile, UploadTooLarge
+    
+    upload_path = None
     try:
-        data = request.get_json()
-        if not data or 'image' not in data:
-            return jsonify({'error': 'No image data provided'}), 400
-        
-        # Extract base64 image data
-        image_data = data['image']
-        if image_data.startswith('data:image'):
-            image_data = image_data.split(',')[1]
-        
-        # Decode and process image
-        image_bytes = base64.b64decode(image_data)
-        
-        # Generate unique filename
-        image_id = str(uuid.uuid4())
-        filename = f"receipt_{image_id}.jpg"
-        
-        # Ensure receipts directory exists
-        receipts_dir = os.path.join(app.root_path, 'receipts')
-        os.makedirs(receipts_dir, exist_ok=True)
-        
-        # Save image to disk
-        image_path = os.path.join(receipts_dir, filename)
-        
-        # Process and save image with PIL
-        with Image.open(io.BytesIO(image_bytes)) as img:
-            # Convert to RGB if needed
-            if img.mode != 'RGB':
-                img = img.convert('RGB')
-            # Save as JPEG
-            img.save(image_path, 'JPEG', quality=85, optimize=True)
+        if request.mimetype == 'multipart/form-data':
+            upload = request.files.get('image')
+            if upload is None:
+                return jsonify({'error': 'No image file provided'}), 400
+            upload_path, image_id = spool_to_tempfile(upload.stream, _uploads_dir())
+        elif request.mimetype.startswith('image/'):
+            upload_path, image_id = spool_to_tempfile(request.stream, _uploads_dir())
+        else:
+            data = request.get_json(silent=True)
+            if not data or 'image' not in data:
+                return jsonify({'error': 'No image data provided'}), 400
+            
+            # Extract base64 image data
+            image_data = data['image']
+            if image_data.startswith('data:image'):
+                image_data = image_data.split(',')[1]
+            upload_path, image_id = spool_to_tempfile(io.BytesIO(base64.b64decode(image_data)), _uploads_dir())
         
-        print(f"Image saved to: {image_path}")
+        return queue_receipt_ocr(upload_path, image_id)
         
-        # Try to extract text using OCR
+    except UploadTooLarge as e:
+        return jsonify({'error': str(e)}), 413
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except QueueFull as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '5'}
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    finally:
+        _discard_upload(upload_path)
+
+def _discard_upload(path):
+    """Delete a spooled upload unless it was handed to an OCR job"""
+    if path is not None and os.path.exists(path):
+        os.remove(path)
+
+def queue_receipt_ocr(upload_path, image_id):
+    """Hand a spooled upload to the OCR queue
+    
+    ``image_id`` is the SHA-256 of the upload. A repeat upload is answered
+    from the OCR result cache with 200 instead of queueing another job
+    (202). Only the file is queued: the job decodes and stores the image.
+    """
+    from ocr_jobs import runner, QueueFull
+    from receipt_processing import check_image, park_upload
+    
+    check_image(upload_path)
+    durable = OCR_QUEUE == 'database' and DATABASE_AVAILABLE
+    if DATABASE_AVAILABLE:
+        from ocr_cache import get_cached_result, BASIC_ENGINE, ENHANCED_ENGINE
+        cached = get_cached_result(image_id, ENHANCED_ENGINE if durable else BASIC_ENGINE)
+        if cached is not None:
+            return jsonify({'status': 'done', 'cached': True, 'result': cached}), 200
+    
+    filename = park_upload(upload_path, os.path.join(app.root_path, 'receipts'), image_id)
+    if durable:
+        # Durable queue: any `python -m ocr_worker` process picks it up
+        from ocr_queue import enqueue_job
+        job_id = enqueue_job(image_id, f"receipts/{filename}")
+    elif DATABASE_AVAILABLE:
+        # Run here, but record the job so any gunicorn worker can report it
+        from ocr_queue import start_local_job, discard_job
+        job_id = start_local_job(image_id, f"receipts/{filename}", _local_worker_id())
         try:
-            import pytesseract
-            ocr_text = pytesseract.image_to_string(Image.open(io.BytesIO(image_bytes)))
-            print(f"OCR extracted text: {ocr_text[:100]}...")
-        except Exception as e:
-            print(f"OCR failed: {e}")
-            ocr_text = "OCR not available"
-        
-        # For now, return mock data with OCR text - in production you'd parse OCR results
-        mock_receipt_data = {
-            'is_receipt': True,
-            'vendor': 'Safeway',
-            'date': datetime.now().strftime('%Y-%m-%d'),
-            'total': '$45.67',
-            'image_path': f"receipts/{filename}",
-            'image_id': image_id,
-            'ocr_text': ocr_text,
-            'items': [
-                {'name': 'Organic Milk', 'price': 4.99, 'expiration_days': 7},
-                {'name': 'Whole Wheat Bread', 'price': 2.49, 'expiration_days': 5},
-                {'name': 'Free Range Eggs', 'price': 5.99, 'expiration_days': 14},
-                {'name': 'Greek Yogurt', 'price': 3.99, 'expiration_days': 10},
-                {'name': 'Fresh Spinach', 'price': 2.99, 'expiration_days': 3}
-            ]
-        }
-        
-        return jsonify(mock_receipt_data)
-        
+            runner.submit(run_receipt_ocr, image_id, filename, job_id, job_id=job_id)
+        except QueueFull:
+            discard_job(job_id)
+            raise
+    else:
+        job_id = runner.submit(run_receipt_ocr, image_id, filename)
+    return jsonify({
+        'job_id': job_id,
+        'status': 'queued',
+        'status_url': url_for('job_status', job_id=job_id)
+    }), 202
+
+def _local_worker_id():
+    """ocr_jobs.worker_id for jobs run on this process's thread pool"""
+    return f"web:{socket.gethostname()}:{os.getpid()}"
+
+def run_receipt_ocr(image_id, filename, job_id=None):
+    """OCR job for the in-process runner
+    
+    Decodes and stores the parked upload, then caches the result and
+    updates the job's ocr_jobs row when there is a database; the row's
+    claim is kept fresh while OCR runs so no ocr_worker takes the job over.
+    """
+    from receipt_processing import ocr_receipt, store_receipt_image
+    
+    def ocr():
+        _, img = store_receipt_image(os.path.join(app.root_path, 'receipts'), image_id)
+        return ocr_receipt(img, image_id, filename)
+    
+    try:
+        if job_id is None:
+            result = ocr()
+        else:
+            from ocr_queue import heartbeat
+            with heartbeat(app, job_id, _local_worker_id()):
+                result = ocr()
+    except Exception as e:
+        if job_id is not None:
+            from ocr_queue import finish_local_job
+            with app.app_context():
+                finish_local_job(job_id, error=str(e))
+        raise
+    if DATABASE_AVAILABLE:
+        from ocr_cache import store_cached_result, BASIC_ENGINE
+        with app.app_context():
+            store_cached_result(image_id, BASIC_ENGINE, result)
+            if job_id is not None:
+                from ocr_queue import finish_local_job
+                finish_local_job(job_id, result=result)
+    return result
+
+def _uploads_dir():
+    return os.path.join(app.root_path, 'receipts', 'uploads')
+
+def _upload_headers(offset, length):
+    headers = {'Upload-Offset': str(offset), 'Cache-Control': 'no-store'}
+    if length is not None:
+        headers['Upload-Length'] = str(length)
+    return headers
+
+@app.route('/uploads', methods=['POST'])
+def create_receipt_upload():
+    """Start a resumable receipt upload
+    
+    Send the total size in an ``Upload-Length`` header, then PUT the bytes
+    in chunks to the returned upload_url with an ``Upload-Offset`` header.
+    After a dropped connection, HEAD the upload_url to find where to resume.
+    """
+    from uploads import create_upload, UploadTooLarge
+    
+    length = request.headers.get('Upload-Length')
+    try:
+        length = int(length) if length is not None else None
+        if length is not None and length <= 0:
+            raise ValueError
+    except ValueError:
+        return jsonify({'error': 'Upload-Length must be a positive integer'}), 400
+    
+    try:
+        upload_id = create_upload(_uploads_dir(), length)
+    except UploadTooLarge as e:
+        return jsonify({'error': str(e)}), 413
+    upload_url = url_for('receipt_upload', upload_id=upload_id)
+    return jsonify({
+        'upload_id': upload_id,
+        'offset': 0,
+        'upload_url': upload_url,
+        'finalize_url': url_for('finalize_receipt_upload', upload_id=upload_id)
+    }), 201, {**_upload_headers(0, length), 'Location': upload_url}
+
+@app.route('/uploads/<upload_id>', methods=['GET', 'HEAD', 'PUT'])
+def receipt_upload(upload_id):
+    """Report the current offset of an upload, or append a chunk to it"""
+    from uploads import upload_status, append_chunk, UploadNotFound, OffsetMismatch, UploadTooLarge
+    
+    uploads_dir = _uploads_dir()
+    try:
+        if request.method == 'PUT':
+            try:
+                offset = int(request.headers['Upload-Offset'])
+            except (KeyError, ValueError):
+                return jsonify({'error': 'Upload-Offset header is required'}), 400
+            append_chunk(uploads_dir, upload_id, offset, request.stream)
+        offset, length = upload_status(uploads_dir, upload_id)
+    except UploadNotFound:
+        return jsonify({'error': 'Upload not found'}), 404
+    except OffsetMismatch as e:
+        return jsonify({'error': str(e), 'offset': e.offset}), 409, _upload_headers(e.offset, None)
+    except UploadTooLarge as e:
+        return jsonify({'error': str(e)}), 413
+    
+    return jsonify({'upload_id': upload_id, 'offset': offset, 'length': length}), 200, _upload_headers(offset, length)
+
+@app.route('/uploads/<upload_id>/finalize', methods=['POST'])
+def finalize_receipt_upload(upload_id):
+    """Assemble a completed upload and queue it for OCR like /process_receipt"""
+    from ocr_jobs import QueueFull
+    from uploads import finalize_upload, file_sha256, UploadNotFound, IncompleteUpload
+    
+    try:
+        path = finalize_upload(_uploads_dir(), upload_id)
+    except UploadNotFound:
+        return jsonify({'error': 'Upload not found'}), 404
+    except IncompleteUpload as e:
+        return jsonify({'error': str(e)}), 409
+    
+    try:
+        return queue_receipt_ocr(path, file_sha256(path))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except QueueFull as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '5'}
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+    finally:
+        _discard_upload(path)
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """Report the status, and once finished the result, of an OCR job"""
+    from ocr_jobs import runner
+    
+    job = runner.get(job_id)
+    if job is None and DATABASE_AVAILABLE:
+        from ocr_queue import get_job
+        job = get_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
 
 @app.route('/receipts/<filename>')
 def serve_receipt_image(filename):
-    """Serve uploaded receipt images"""
+    """Serve uploaded receipt images
+    
+    ``?size=thumb|medium|full`` picks a resized copy, made on first request.
+    WebP is sent to browsers that accept it. Photos are found in whichever
+    storage tier receipt_storage has moved them to. Stored images never change, so
+    responses are cacheable forever and support ETag revalidation and
+    Range requests.
+    """
+    from flask import send_file
+    from receipt_images import is_receipt_filename, variant_path, VARIANT_SIZES
+    
+    size = request.args.get('size', 'full')
+    if size != 'full' and size not in VARIANT_SIZES:
+        return jsonify({'error': f"size must be one of: full, {', '.join(VARIANT_SIZES)}"}), 400
+    if not is_receipt_filename(filename):
+        return jsonify({'error': 'Image not found'}), 404
+    
     try:
         receipts_dir = os.path.join(app.root_path, 'receipts')
-        image_path = os.path.join(receipts_dir, filename)
-        
-        if os.path.exists(image_path):
-            from flask import send_file
-            return send_file(image_path, mimetype='image/jpeg')
-        else:
-            return jsonify({'error': 'Image not found'}), 404
+        accept_webp = bool(request.accept_mimetypes['image/webp'])
+        # receipt_storage may re-encode or move the original between finding
+        # and opening it; looking again finds it in its new tier
+        for attempt in range(2):
+            try:
+                image_path, fmt = variant_path(receipts_dir, filename, size, accept_webp)
+                if image_path is None:
+                    return jsonify({'error': 'Image not found'}), 404
+                
+                etag = f"{os.path.splitext(filename)[0]}-{size}-{fmt.lower()}"
+                if not isinstance(image_path, str):
+                    # Converted from a WebP original: not the bytes of a JPEG original
+                    etag += '-converted'
+                response = send_file(image_path, mimetype=f'image/{fmt.lower()}', conditional=True,
+                                     etag=etag, max_age=365 * 24 * 3600)
+                break
+            except FileNotFoundError:
+                if attempt:
+                    return jsonify({'error': 'Image not found'}), 404
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        response.vary.add('Accept')
+        return response
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -307,39 +658,38 @@ def save_receipt_items():
     if not DATABASE_AVAILABLE:
         return jsonify({'error': 'Database not available'}), 500
     
+    from ingest import ingest_receipt, DuplicateReceipt
+    
     try:
-        data = request.get_json()
-        items = data.get('items', [])
-        
-        saved_items = []
-        for item_data in items:
-            # Calculate expiration date
-            expiration_date = datetime.now().date() + timedelta(days=item_data.get('expiration_days', 7))
-            
-            # Create new item
-            item = Item(
-                receipt_id=f"REC-{datetime.now().strftime('%Y%m%d-%H%M%S')}",
-                product_name=item_data['name'],
-                purchase_date=datetime.now().date(),
-                expiration_date=expiration_date,
-                price=item_data['price']
-            )
-            
-            db.session.add(item)
-            saved_items.append({
-                'name': item.product_name,
-                'expiration_date': expiration_date.strftime('%Y-%m-%d'),
-                'price': item.price
-            })
+        data = request.get_json() or {}
+        idempotency_key = request.headers.get('Idempotency-Key') or data.get('idempotency_key')
+        receipt, created = ingest_receipt({
+            'store_name': data.get('vendor'),
+            'total_amount': data.get('total'),
+            'image_hash': data.get('image_hash'),
+            'items': data.get('items', [])
+        }, idempotency_key)
+        if created:
+            invalidate_cache()
         
-        db.session.commit()
+        saved_items = [{
+            'name': item['productName'],
+            'expiration_date': item['expirationDate'],
+            'price': item['price']
+        } for item in receipt['items']]
         
         return jsonify({
             'success': True,
+            'receipt_id': receipt['receiptId'],
             'saved_items': saved_items,
             'message': f'Successfully saved {len(saved_items)} items'
         })
         
+    except DuplicateReceipt as e:
+        return jsonify({'error': str(e)}), 409
+    except (KeyError, ValueError) as e:
+        db.session.rollback()
+        return jsonify({'error': f'Invalid receipt data: {e}'}), 400
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
@@ -4,9 +4,10 @@ Simple OCR script to convert receipt images to text
 """
 
 import os
-from pathlib import Path
 from PIL import Image
-import pytesseract
+
+import ocr_engine
+from receipt_geometry import prepare_for_ocr
 
 def convert_receipt_to_text(image_path):
     """Convert receipt image to text"""
@@ -27,7 +28,7 @@ def convert_receipt_to_text(image_path):
                 img = img.convert('RGB')
             
             # Extract text using Tesseract
-            text = pytesseract.image_to_string(img)
+            text = ocr_engine.image_to_string(prepare_for_ocr(img))
             
             return text
             
@@ -37,45 +38,9 @@ def convert_receipt_to_text(image_path):
 
 def main():
     """Main function"""
-    receipts_dir = Path("receipts")
-    
-    if not receipts_dir.exists():
-        print("Receipts directory not found!")
-        return
-    
-    # Find image files
-    image_files = []
-    for ext in ['.jpg', '.jpeg', '.png', '.bmp', '.tiff']:
-        image_files.extend(receipts_dir.glob(f"*{ext}"))
-        image_files.extend(receipts_dir.glob(f"*{ext.upper()}"))
-    
-    if not image_files:
-        print("No image files found!")
-        return
-    
-    print(f"Found {len(image_files)} image file(s)")
-    
-    for image_file in image_files:
-        print(f"\n{'='*60}")
-        print(f"Converting: {image_file.name}")
-        print(f"{'='*60}")
-        
-        # Convert to text
-        text = convert_receipt_to_text(str(image_file))
-        
-        if text:
-            print(f"\nExtracted Text:")
-            print(f"{'-'*40}")
-            print(text)
-            print(f"{'-'*40}")
-            
-            # Save to text file
-            text_file = image_file.with_suffix('.txt')
-            with open(text_file, 'w', encoding='utf-8') as f:
-                f.write(text)
-            print(f"\nText saved to: {text_file}")
-        else:
-            print("Failed to extract text")
+    # Only new and changed images are OCR'd; see batch_ocr
+    import batch_ocr
+    batch_ocr.main()
 
 if __name__ == "__main__":
     main()
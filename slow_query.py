@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Slow-query log with out-of-band EXPLAIN capture on Postgres
+"""
+
+import hmac
+import json
+import logging
+import os
+import queue
+import re
+import threading
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+
+from flask import has_request_context, jsonify, request
+
+from metrics import add_statement_observer
+
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', 200))
+SLOW_QUERY_LOG = os.getenv('SLOW_QUERY_LOG', os.path.join('logs', 'slow_queries.jsonl'))
+MAX_TRACKED_STATEMENTS = 500
+
+_logger = None
+_explain_queue = queue.Queue(maxsize=100)
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def _get_logger():
+    """JSONL logger rotating at 10 MB, created on the first slow query"""
+    global _logger
+    if _logger is None:
+        os.makedirs(os.path.dirname(SLOW_QUERY_LOG) or '.', exist_ok=True)
+        handler = RotatingFileHandler(SLOW_QUERY_LOG, maxBytes=10 * 1024 * 1024, backupCount=5)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger = logging.getLogger('expiry.slow_query')
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        logger.addHandler(handler)
+        _logger = logger
+    return _logger
+
+
+def normalize_statement(statement):
+    """Collapse literals and IN lists so similar statements group together"""
+    normalized = re.sub(r"'(?:[^']|'')*'", '?', statement)
+    normalized = re.sub(r'\b\d+(?:\.\d+)?\b', '?', normalized)
+    normalized = re.sub(r'%\(\w+\)s|:\w+|\$\d+|%s', '?', normalized)
+    normalized = re.sub(r'\(\s*\?(?:\s*,\s*\?)*\s*\)', '(?)', normalized)
+    return re.sub(r'\s+', ' ', normalized).strip()
+
+
+def _record(normalized, duration_ms):
+    with _stats_lock:
+        entry = _stats.get(normalized)
+        if entry is None:
+            if len(_stats) >= MAX_TRACKED_STATEMENTS:
+                # Forget the cheapest statement to make room
+                del _stats[min(_stats, key=lambda key: _stats[key]['total_ms'])]
+            entry = _stats[normalized] = {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0}
+        entry['count'] += 1
+        entry['total_ms'] += duration_ms
+        entry['max_ms'] = max(entry['max_ms'], duration_ms)
+
+
+def top_statements(limit=20):
+    """Slowest normalized statements by total time spent"""
+    with _stats_lock:
+        rows = [dict(statement=statement, mean_ms=stats['total_ms'] / stats['count'], **stats)
+                for statement, stats in _stats.items()]
+    rows.sort(key=lambda row: row['total_ms'], reverse=True)
+    return rows[:limit]
+
+
+def _write(entry):
+    _get_logger().info(json.dumps(entry, default=str))
+
+
+def _explain_worker():
+    """Run EXPLAIN on a separate connection so requests never wait for it
+
+    Plain EXPLAIN only plans the statement. EXPLAIN ANALYZE would run it
+    again, taking the row locks of a FOR UPDATE SKIP LOCKED claim or
+    performing the writes of a data-modifying WITH.
+    """
+    while True:
+        engine, statement, parameters, entry = _explain_queue.get()
+        try:
+            with engine.connect() as conn:
+                conn.info['slow_query_skip'] = True
+                try:
+                    plan = conn.exec_driver_sql(f'EXPLAIN (FORMAT JSON) {statement}', parameters).scalar()
+                finally:
+                    conn.info.pop('slow_query_skip', None)
+                    conn.rollback()
+            entry['explain'] = plan
+        except Exception as e:
+            entry['explain_error'] = str(e)
+        _write(entry)
+
+
+_explain_thread = None
+
+
+def _queue_explain(engine, statement, parameters, entry):
+    global _explain_thread
+    if _explain_thread is None:
+        _explain_thread = threading.Thread(target=_explain_worker, name='slow-query-explain', daemon=True)
+        _explain_thread.start()
+    try:
+        _explain_queue.put_nowait((engine, statement, parameters, entry))
+    except queue.Full:
+        entry['explain_error'] = 'explain queue full'
+        _write(entry)
+
+
+def _observe_statement(conn, statement, parameters, executemany, seconds):
+    duration_ms = seconds * 1000
+    if duration_ms < SLOW_QUERY_MS or conn.info.get('slow_query_skip'):
+        return
+
+    normalized = normalize_statement(statement)
+    _record(normalized, duration_ms)
+
+    entry = {
+        'timestamp': datetime.utcnow().isoformat(),
+        'duration_ms': round(duration_ms, 3),
+        'statement': statement,
+        'normalized': normalized,
+        'parameters': repr(parameters)[:2000],
+        'route': request.url_rule.rule if has_request_context() and request.url_rule else None,
+    }
+    if conn.dialect.name == 'postgresql' and not executemany:
+        _queue_explain(conn.engine, statement, parameters, entry)
+    else:
+        _write(entry)
+
+
+def install_slow_query_log():
+    """Check the duration of every statement timed by the metrics listeners"""
+    add_statement_observer(_observe_statement)
+
+
+def init_slow_query_admin(app):
+    """Expose the slowest statements at /admin/slow_queries.
+
+    Callers must send ADMIN_TOKEN as X-Admin-Token; without ADMIN_TOKEN
+    set the page is closed to everyone.
+    """
+    @app.route('/admin/slow_queries')
+    def slow_queries():
+        """Top-N slowest normalized statements seen by this worker"""
+        token = os.getenv('ADMIN_TOKEN')
+        if not token or not hmac.compare_digest(request.headers.get('X-Admin-Token', ''), token):
+            return jsonify({'error': 'Forbidden'}), 403
+        limit = request.args.get('limit', 20, type=int)
+        return jsonify({
+            'threshold_ms': SLOW_QUERY_MS,
+            'log_file': SLOW_QUERY_LOG,
+            'statements': top_statements(limit)
+        })
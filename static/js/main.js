@@ -138,11 +138,12 @@ document.addEventListener('DOMContentLoaded', function() {
     // Refresh data every 5 minutes
     setInterval(() => {
         if (window.location.pathname === '/') {
-            fetch('/api/items')
+            fetch('/api/items?limit=100')
                 .then(response => response.json())
                 .then(data => {
                     // Update the page with fresh data if needed
-                    console.log('Data refreshed:', data.length, 'items');
+                    console.log('Data refreshed:', data.items.length, 'items',
+                        data.next_cursor ? '(more available)' : '');
                 })
                 .catch(error => {
                     console.error('Error refreshing data:', error);
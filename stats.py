@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Dashboard statistics: one-pass aggregate plus an optional daily rollup
+
+Usage: python -m stats  (rebuild today's rollup row; run daily after midnight)
+"""
+
+from datetime import datetime, timedelta
+
+from sqlalchemy import case, func, select, text
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Item, DailyItemSummary, EXPIRING_SOON_DAYS, apply_summary_delta, summary_contribution
+
+STATUSES = ('expired', 'expiring_soon', 'expiring_this_week', 'fresh', 'no_expiration')
+
+_summary_enabled = False
+
+
+def item_stats_query(today):
+    """Every dashboard counter as conditional aggregates over one scan"""
+    soon = today + timedelta(days=EXPIRING_SOON_DAYS)
+    return select(
+        func.count(Item.id),
+        func.coalesce(func.sum(case((Item.expiration_date < today, 1), else_=0)), 0),
+        func.coalesce(func.sum(case((Item.expiration_date.between(today, soon), 1), else_=0)), 0),
+        func.coalesce(func.sum(Item.price), 0),
+    )
+
+
+def compute_item_stats(today=None):
+    """Run the single-pass aggregate and return the analytics dictionary"""
+    today = today or datetime.now().date()
+    total_items, expired_count, expiring_soon_count, total_value = \
+        db.session.execute(item_stats_query(today)).one()
+    return {
+        'total_items': total_items,
+        'expired_count': int(expired_count),
+        'expiring_soon_count': int(expiring_soon_count),
+        'total_value': float(total_value)
+    }
+
+
+def refresh_daily_summary(today=None):
+    """Recompute the rollup row for today in full and commit it
+
+    Item writes adjust the row in their own transactions. On Postgres the
+    table is locked first, which waits for writers that already applied a
+    delta and holds back new ones until the recomputed row is committed,
+    so no delta is lost between the aggregate and the write. SQLite allows
+    a single writer anyway.
+    """
+    today = today or datetime.now().date()
+    try:
+        if db.session.get_bind().dialect.name == 'postgresql':
+            db.session.execute(text('LOCK TABLE daily_item_summary IN SHARE ROW EXCLUSIVE MODE'))
+        stats = compute_item_stats(today)
+        db.session.merge(DailyItemSummary(summary_date=today, refreshed_at=datetime.utcnow(), **stats))
+        db.session.commit()
+    except IntegrityError:
+        # SQLite only: another refresh inserted the row first, from the same data
+        db.session.rollback()
+    except BaseException:
+        db.session.rollback()
+        raise
+    return stats
+
+
+def get_item_stats(today=None):
+    """Return dashboard counters, from the rollup table when it is enabled
+
+    Reads never write: without today's row the counters are computed live.
+    """
+    today = today or datetime.now().date()
+    if _summary_enabled:
+        summary = db.session.get(DailyItemSummary, today)
+        if summary is not None:
+            return summary.to_dict()
+    return compute_item_stats(today)
+
+
+def items_with_status(query, today=None):
+    """Run an items query with the status bucket computed by the database
+
+    Days until expiration are worked out once per row from the same
+    ``today``, so templates can read them without touching the clock.
+    """
+    today = today or datetime.now().date()
+    items = []
+    for item, status in query.add_columns(Item.status_expression(today).label('status')).all():
+        item._status = status
+        if item.expiration_date is not None:
+            item._days_until_expiration = (item.expiration_date - today).days
+        items.append(item)
+    return items
+
+
+def empty_status_summary():
+    """Summary shape for views rendered without a database"""
+    return {'counts': dict.fromkeys(STATUSES, 0), 'total_items': 0, 'total_value': 0.0}
+
+
+def status_summary(today=None):
+    """Per-status item counts and totals from a single GROUP BY"""
+    today = today or datetime.now().date()
+    status = Item.status_expression(today)
+    rows = db.session.execute(
+        select(status, func.count(Item.id), func.coalesce(func.sum(Item.price), 0)).group_by(status)
+    ).all()
+
+    summary = empty_status_summary()
+    for bucket, count, value in rows:
+        summary['counts'][bucket] = count
+        summary['total_items'] += count
+        summary['total_value'] += float(value)
+    return summary
+
+
+def apply_bulk_insert(connection, rows):
+    """Core multi-row inserts skip mapper events, so apply their delta here"""
+    if not rows:
+        return
+    today = datetime.now().date()
+    contributions = [summary_contribution(row['expiration_date'], row['price'], today) for row in rows]
+    apply_summary_delta(connection, (0, 0, 0, 0), [sum(column) for column in zip(*contributions)])
+
+
+def enable_daily_summary():
+    """Serve analytics from daily_item_summary when today's row exists
+
+    Writes keep the row current wherever they happen (see the listeners in
+    models.py); run ``python -m stats`` after midnight to build each day's row.
+    """
+    global _summary_enabled
+    _summary_enabled = True
+
+
+def main():
+    """Main function"""
+    from simple_app import app, DATABASE_AVAILABLE
+    if not DATABASE_AVAILABLE:
+        print("Database not available")
+        return
+    with app.app_context():
+        stats = refresh_daily_summary()
+    print(f"Daily summary for {datetime.now().date()}: {stats}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Test the incremental batch OCR command: unchanged images are skipped, changed and new ones are redone
+"""
+
+import os
+import shutil
+
+import pytest
+from PIL import Image
+
+import batch_ocr
+import ocr_engine
+
+
+@pytest.fixture
+def receipts(tmp_path, monkeypatch):
+    # Pool processes are forked, so they inherit the patched Tesseract
+    monkeypatch.setattr(ocr_engine, 'image_to_string', lambda image, config='': f"{image.shape[1]}x{image.shape[0]}")
+    monkeypatch.setattr(ocr_engine, 'version', lambda: 'tesseract-test')
+    monkeypatch.setattr('receipt_geometry.OCR_DETECT_RECEIPT', False)
+    for i, size in enumerate([(100, 200), (110, 220), (120, 240)]):
+        Image.new('RGB', size, 'white').save(tmp_path / f"receipt_{i}.jpg")
+    return tmp_path
+
+
+def test_reruns_only_what_changed(receipts):
+    first = batch_ocr.run(str(receipts), workers=2)
+    assert (first['processed'], first['skipped'], first['failed']) == (3, 0, 0)
+    assert (receipts / 'receipt_1.txt').read_text() == '110x220'
+
+    assert batch_ocr.run(str(receipts), workers=2)['skipped'] == 3
+
+    # Touched but identical, changed, moved into a subdirectory, and new
+    os.utime(receipts / 'receipt_0.jpg', ns=(1, 1))
+    Image.new('RGB', (130, 260), 'white').save(receipts / 'receipt_1.jpg')
+    (receipts / 'cold').mkdir()
+    shutil.move(receipts / 'receipt_2.jpg', receipts / 'cold' / 'receipt_2.jpg')
+    Image.new('RGB', (140, 280), 'white').save(receipts / 'receipt_3.jpg')
+
+    stats = batch_ocr.run(str(receipts), workers=2)
+    assert (stats['processed'], stats['skipped'], stats['forgotten']) == (2, 2, 1)
+    assert (receipts / 'receipt_1.txt').read_text() == '130x260'
+    assert (receipts / 'cold' / 'receipt_2.txt').read_text() == '120x240'
+
+    assert batch_ocr.run(str(receipts), workers=2)['skipped'] == 4
+    assert batch_ocr.run(str(receipts), workers=2, force=True)['processed'] == 4
+
+
+def test_reencoded_cold_photos_reuse_text(receipts):
+    from receipt_storage import cold_path
+    image_id = 'ab' * 32
+    jpeg = receipts / f"receipt_{image_id}.jpg"
+    Image.new('RGB', (150, 300), 'white').save(jpeg)
+    assert batch_ocr.run(str(receipts), workers=2)['processed'] == 4
+
+    # What receipt_storage does: new bytes, new format, new directory, same name
+    webp = cold_path(str(receipts), f"receipt_{image_id}.webp")
+    os.makedirs(os.path.dirname(webp))
+    with Image.open(jpeg) as img:
+        img.save(webp, 'WEBP')
+    os.remove(jpeg)
+
+    stats = batch_ocr.run(str(receipts), workers=2)
+    assert (stats['processed'], stats['forgotten']) == (0, 1)
+    assert open(os.path.splitext(webp)[0] + '.txt').read() == '150x300'
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Test the enhanced OCR search: early exit, and the same answer however it is run
+"""
+
+import cv2
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw
+
+import enhanced_receipt_ocr
+import ocr_engine
+import receipt_geometry
+
+
+def fake_image_to_data(image, config=''):
+    """Deterministic stand-in for Tesseract that depends on the pixels and config"""
+    pixels = np.asarray(image)
+    seed = int(pixels.sum()) % 9973 + len(config)
+    words = [f"w{seed}", "TOTAL", f"{seed % 97}.99", "MILK"]
+    return {
+        'text': words,
+        'conf': [40 + (seed * (i + 3)) % 60 for i in range(len(words))],
+        'block_num': [1, 1, 1, 2],
+        'par_num': [1, 1, 1, 1],
+        'line_num': [1, 1, 2, 1],
+    }
+
+
+@pytest.fixture
+def receipt_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(ocr_engine, 'image_to_data', fake_image_to_data)
+    img = Image.new('RGB', (240, 320), 'white')
+    draw = ImageDraw.Draw(img)
+    for row in range(10):
+        draw.text((10, 10 + row * 30), f"ITEM {row}   {row * 1.25:.2f}", fill='black')
+    path = tmp_path / 'receipt.jpg'
+    img.save(path)
+    yield str(path)
+    # Pool processes are forked with the patched Tesseract; don't reuse them
+    enhanced_receipt_ocr.shutdown_pool()
+
+
+@pytest.mark.parametrize('threshold', [60, 101])
+def test_parallel_search_matches_sequential(receipt_path, threshold):
+    sequential = enhanced_receipt_ocr.convert_image_to_text_enhanced(
+        receipt_path, workers=1, confidence_threshold=threshold)
+    parallel = enhanced_receipt_ocr.convert_image_to_text_enhanced(
+        receipt_path, workers=3, confidence_threshold=threshold)
+    assert parallel == sequential
+
+
+def test_stops_at_first_confident_result(receipt_path):
+    exhaustive = enhanced_receipt_ocr.convert_image_to_text_enhanced(receipt_path, confidence_threshold=101)
+    assert exhaustive['candidates_tried'] == 30
+
+    threshold = sorted(r['score'] for r in exhaustive['all_results'])[-5]
+    adaptive = enhanced_receipt_ocr.convert_image_to_text_enhanced(receipt_path, confidence_threshold=threshold)
+    assert adaptive['candidates_tried'] < 30
+    assert adaptive['best_score'] >= threshold
+    # Words are regrouped into Tesseract's lines, with a blank line between blocks
+    lines = adaptive['best_text'].split('\n')
+    assert lines[0].endswith(' TOTAL')
+    assert lines[2:] == ['', 'MILK']
+
+
+def test_max_candidates_and_explicit_order(receipt_path):
+    order = [("Adaptive Threshold", '--psm 6'), ("Original Grayscale", '')]
+    result = enhanced_receipt_ocr.convert_image_to_text_enhanced(
+        receipt_path, confidence_threshold=101, order=order, max_candidates=1)
+    assert result['candidates_tried'] == 1
+    assert result['all_results'][0]['preprocessing'] == "Adaptive Threshold"
+
+
+def test_parse_config():
+    whitelist = '--psm 6 --oem 1 -c tessedit_char_whitelist=0123456789.$ '
+    assert ocr_engine.parse_config(whitelist) == (6, 1, {'tessedit_char_whitelist': '0123456789.$'})
+    assert ocr_engine.parse_config('') == (None, None, {})
+
+
+def test_tesserocr_engine_reads_numpy_buffers():
+    pytest.importorskip('tesserocr')
+    img = Image.new('L', (400, 80), 255)
+    ImageDraw.Draw(img).text((10, 30), "TOTAL 12.99", fill=0)
+    engine = ocr_engine.TesserocrEngine()
+    data = engine.image_to_data(np.asarray(img), '--psm 6')
+    assert set(data) == set(ocr_engine.DATA_KEYS)
+    assert engine.image_to_string(np.asarray(img), '--psm 6') == engine.image_to_string(img, '--psm 6')
+
+
+def test_bilevel_images_keep_their_contrast():
+    img = Image.new('1', (4, 2), 1)
+    img.putpixel((0, 0), 0)
+    pixels = ocr_engine._as_array(img)
+    assert pixels.dtype == np.uint8
+    assert (pixels[0, 0], pixels[1, 1]) == (0, 255)
+
+
+class FailingApi:
+    """Tesseract handle whose recognition fails"""
+
+    def __init__(self, lang=None, oem=None):
+        self.variables = {'tessedit_char_whitelist': ''}
+        self.cleared = False
+
+    def SetPageSegMode(self, psm):
+        pass
+
+    def GetVariableAsString(self, name):
+        return self.variables[name]
+
+    def SetVariable(self, name, value):
+        self.variables[name] = value
+
+    def SetImageBytes(self, *args):
+        pass
+
+    def Recognize(self):
+        raise RuntimeError('recognition failed')
+
+    def Clear(self):
+        self.cleared = True
+
+
+def test_tesserocr_settings_are_reset_after_a_failure(monkeypatch):
+    from types import SimpleNamespace
+    api = FailingApi()
+    monkeypatch.setattr(ocr_engine, 'tesserocr', SimpleNamespace(
+        PSM=SimpleNamespace(AUTO=3), OEM=SimpleNamespace(DEFAULT=3), PyTessBaseAPI=lambda lang, oem: api))
+    engine = ocr_engine.TesserocrEngine()
+
+    with pytest.raises(RuntimeError):
+        engine.image_to_string(np.zeros((8, 8), np.uint8), '-c tessedit_char_whitelist=0123456789')
+    assert api.variables == {'tessedit_char_whitelist': ''}
+    assert api.cleared
+
+
+def long_receipt(rows=28):
+    paper = np.full((rows * 48 + 56, 500), 245, np.uint8)
+    for row in range(rows):
+        cv2.putText(paper, f"ITEM {row:02d}   {row}.99", (20, 45 + row * 48), cv2.FONT_HERSHEY_SIMPLEX, 0.9, 20, 2)
+    return paper
+
+
+def test_receipt_is_cropped_straightened_and_scaled():
+    paper = long_receipt()
+
+    # Lay the receipt on a dark table, turned by 12 degrees
+    matrix = cv2.getRotationMatrix2D((250, 700), 12, 1.0)
+    matrix[:, 2] += (500, 300)
+    photo = np.full((2000, 1500), 60, np.uint8)
+    placed = cv2.warpAffine(paper, matrix, (1500, 2000))
+    mask = cv2.warpAffine(np.full_like(paper, 255), matrix, (1500, 2000))
+    photo[mask > 0] = placed[mask > 0]
+
+    prepared, info = receipt_geometry.prepare_receipt(photo, target_text_height=30)
+    assert info['cropped']
+    assert abs(receipt_geometry.text_angle(prepared)) < 1
+    assert receipt_geometry.text_height(prepared) == pytest.approx(30, abs=3)
+    # Only the paper is left, at the paper's proportions
+    height, width = prepared.shape
+    assert height / width == pytest.approx(1400 / 500, rel=0.05)
+
+
+def test_strips_are_cut_between_lines():
+    paper = long_receipt(rows=120)
+    strips = receipt_geometry.find_strips(paper, strip_height=1000, overlap=60)
+    assert len(strips) > 3
+    assert strips[0][0] == 0 and strips[-1][1] == paper.shape[0]
+    ink_rows = (paper < 128).any(axis=1)
+    for (_, bottom, _), (top, _, overlapped) in zip(strips, strips[1:]):
+        assert bottom == top
+        assert not ink_rows[top]
+        assert not overlapped
+
+
+def test_strips_without_gaps_overlap():
+    solid = np.zeros((3000, 200), np.uint8)
+    strips = receipt_geometry.find_strips(solid, strip_height=1000, overlap=60)
+    assert [overlapped for _, _, overlapped in strips] == [False, True, True]
+    for (_, bottom, _), (top, _, _) in zip(strips, strips[1:]):
+        assert bottom - top == 60
+
+
+def test_stitch_drops_repeated_lines_only_at_overlaps():
+    texts = ["MILK 3.99\nEGGS 2.49", "EGGS  2.49\nBREAD 1.99", "TOTAL 8.47"]
+    assert enhanced_receipt_ocr.stitch_strips(texts, [False, True, True]) == \
+        "MILK 3.99\nEGGS 2.49\nBREAD 1.99\nTOTAL 8.47"
+    # At a cut through a gap the same item bought again is kept
+    assert enhanced_receipt_ocr.stitch_strips(['MILK 3.99\nMILK 3.99', 'MILK 3.99\nTOTAL 11.97']) == \
+        "MILK 3.99\nMILK 3.99\nMILK 3.99\nTOTAL 11.97"
+
+
+def test_parallel_strips_match_sequential_strips(tmp_path, monkeypatch):
+    monkeypatch.setattr(ocr_engine, 'image_to_data', fake_image_to_data)
+    monkeypatch.setattr(enhanced_receipt_ocr, 'OCR_STRIP_HEIGHT', 600)
+    path = str(tmp_path / 'long.png')
+    cv2.imwrite(path, long_receipt(rows=80))
+    try:
+        sequential = enhanced_receipt_ocr.convert_image_to_text_enhanced(path, workers=1, strips=True, detect=False, max_candidates=4)
+        parallel = enhanced_receipt_ocr.convert_image_to_text_enhanced(path, workers=3, strips=True, detect=False, max_candidates=4)
+    finally:
+        enhanced_receipt_ocr.shutdown_pool()
+    assert sequential['strips'] > 3
+    assert parallel == sequential
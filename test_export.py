@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Test the streaming NDJSON/CSV export of items and receipts
+"""
+
+import csv
+import io
+import json
+from datetime import date
+
+import pytest
+
+import export
+
+
+@pytest.fixture
+def app(load_app):
+    simple_app = load_app()
+    with simple_app.app.app_context():
+        yield simple_app.app.test_client(), simple_app.db
+
+
+def add_items(db, count):
+    from models import Item
+    # Core insert: fast, and the export does not care about ORM events
+    db.session.execute(Item.__table__.insert(), [
+        {'product_name': f'Item {n}', 'purchase_date': date(2030, 1, 1), 'price': float(n)}
+        for n in range(count)
+    ])
+    db.session.commit()
+
+
+def test_ndjson_spans_several_batches(app):
+    client, db = app
+    count = export.EXPORT_BATCH_SIZE * 2 + 5
+    add_items(db, count)
+
+    response = client.get('/api/export/items')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    assert 'attachment; filename="items-' in response.headers['Content-Disposition']
+    records = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert len(records) == count
+    assert [record['id'] for record in records] == sorted(record['id'] for record in records)
+    assert records[0]['productName'] == 'Item 0'
+    assert records[0]['purchaseDate'] == '2030-01-01'
+
+
+def test_csv_spans_several_batches(app):
+    client, db = app
+    count = export.EXPORT_BATCH_SIZE + 1
+    add_items(db, count)
+
+    response = client.get('/api/export/items?format=csv')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/csv'
+    rows = list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+    assert rows[0] == [name for name, _ in export.ITEM_FIELDS]
+    assert len(rows) == count + 1
+
+
+def test_chunks_follow_the_batch_size(app):
+    client, db = app
+    add_items(db, 5)
+
+    chunks = list(export.generate_export('items', 'ndjson', batch_size=2))
+    assert [chunk.count('\n') for chunk in chunks] == [2, 2, 1]
+    chunks = list(export.generate_export('items', 'csv', batch_size=2))
+    # Header, then one chunk per batch
+    assert [chunk.count('\n') for chunk in chunks] == [1, 2, 2, 1]
+
+
+def test_csv_quotes_awkward_values(app):
+    client, db = app
+    from models import Receipt
+    store = 'Joe\'s "Fresh", Market\nDowntown'
+    db.session.add(Receipt(receipt_id='REC-1', store_name=store, total_amount=9.5))
+    db.session.commit()
+
+    response = client.get('/api/export/receipts?format=csv')
+    rows = list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+    assert len(rows) == 2
+    record = dict(zip(rows[0], rows[1]))
+    assert (record['receiptId'], record['storeName'], record['totalAmount']) == ('REC-1', store, '9.5')
+    assert record['purchaseDate'] == ''
+
+
+def test_empty_export(app):
+    client, db = app
+    response = client.get('/api/export/receipts')
+    assert response.status_code == 200
+    assert response.get_data(as_text=True) == ''
+
+    response = client.get('/api/export/receipts?format=csv')
+    assert response.status_code == 200
+    rows = list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+    assert rows == [[name for name, _ in export.RECEIPT_FIELDS]]
+
+
+def test_rejects_unknown_table_and_format(app):
+    client, db = app
+    assert client.get('/api/export/users').status_code == 404
+    assert client.get('/api/export/items?format=xml').status_code == 400
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Test conditional GETs: 304 for a current copy, 200 after any item write
+"""
+
+from datetime import date, datetime, timedelta
+
+import pytest
+
+import http_cache
+
+
+@pytest.fixture
+def app(load_app):
+    simple_app = load_app()
+    with simple_app.app.app_context():
+        yield simple_app.app.test_client(), simple_app.db
+
+
+def add_item(db, name):
+    from models import Item
+    item = Item(product_name=name, purchase_date=date(2030, 1, 1), price=1.0)
+    db.session.add(item)
+    db.session.commit()
+    return item
+
+
+def settle(db):
+    """Move every write back a few seconds so Last-Modified is sent"""
+    from models import Item, ItemTombstone
+    past = datetime.utcnow() - timedelta(seconds=5)
+    db.session.query(Item).update({Item.updated_at: past})
+    db.session.query(ItemTombstone).update({ItemTombstone.deleted_at: past})
+    db.session.commit()
+
+
+def revalidate(client, response):
+    return client.get('/api/items', headers={'If-None-Match': response.headers['ETag']})
+
+
+def test_etag_round_trip_and_invalidation(app):
+    client, db = app
+    from models import Item
+    item = add_item(db, 'Milk')
+
+    first = client.get('/api/items')
+    assert first.status_code == 200
+    assert revalidate(client, first).status_code == 304
+
+    # Insert
+    add_item(db, 'Bread')
+    second = revalidate(client, first)
+    assert second.status_code == 200
+    assert revalidate(client, second).status_code == 304
+
+    # Update
+    item.price = 2.5
+    db.session.commit()
+    third = revalidate(client, second)
+    assert third.status_code == 200
+    assert revalidate(client, third).status_code == 304
+
+    # Delete leaves a tombstone
+    db.session.delete(db.session.get(Item, item.id))
+    db.session.commit()
+    fourth = revalidate(client, third)
+    assert fourth.status_code == 200
+    assert [i['productName'] for i in fourth.get_json()['items']] == ['Bread']
+
+
+def test_etag_decides_over_if_modified_since(app):
+    client, db = app
+    add_item(db, 'Milk')
+    settle(db)
+    first = client.get('/api/items')
+    add_item(db, 'Bread')
+    settle(db)
+
+    response = client.get('/api/items', headers={
+        'If-None-Match': first.headers['ETag'],
+        'If-Modified-Since': 'Fri, 01 Jan 2100 00:00:00 GMT',
+    })
+    assert response.status_code == 200
+
+
+def test_last_modified_round_trip(app):
+    client, db = app
+    add_item(db, 'Milk')
+    settle(db)
+
+    first = client.get('/api/items')
+    since = first.headers['Last-Modified']
+    assert client.get('/api/items', headers={'If-Modified-Since': since}).status_code == 304
+
+
+def test_same_second_write_is_not_answered_with_304(app, monkeypatch):
+    client, db = app
+    from models import Item
+    moment = datetime.utcnow().replace(microsecond=200000) - timedelta(seconds=5)
+
+    class Clock(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return (moment + timedelta(microseconds=500000)).replace(tzinfo=tz)
+    monkeypatch.setattr(http_cache, 'datetime', Clock)
+
+    milk = add_item(db, 'Milk')
+    milk.updated_at = moment
+    db.session.commit()
+    first = client.get('/api/items')
+    # The write's second has not ended, so there is no date to echo back
+    assert 'Last-Modified' not in first.headers
+
+    # A second write in the same second would not move Last-Modified
+    bread = add_item(db, 'Bread')
+    bread.updated_at = moment + timedelta(microseconds=300000)
+    db.session.commit()
+    response = client.get('/api/items', headers={
+        'If-Modified-Since': moment.strftime('%a, %d %b %Y %H:%M:%S GMT'),
+    })
+    assert response.status_code == 200
+    assert len(response.get_json()['items']) == 2
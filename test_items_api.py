@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Test keyset pagination of /api/items across dated and undated items
+"""
+
+import sys
+from datetime import date, timedelta
+
+import pytest
+
+
+@pytest.fixture
+def client(load_app):
+    """simple_app with a mix of dated items, shared dates and no dates"""
+    simple_app = load_app()
+    from models import Item
+
+    with simple_app.app.app_context():
+        start = date(2030, 1, 1)
+        expirations = [start, None, start + timedelta(days=1), start, None, start + timedelta(days=2), None, start]
+        for n, expiration in enumerate(expirations):
+            simple_app.db.session.add(Item(product_name=f"Item {n}", purchase_date=start,
+                                           expiration_date=expiration, price=1.0))
+        simple_app.db.session.commit()
+        yield simple_app.app.test_client()
+
+
+@pytest.mark.parametrize('limit', [1, 2, 3, 5, 7, 8, 20])
+def test_pages_cover_every_item_once_in_order(client, limit):
+    expected = [item['id'] for item in client.get('/api/items?all=1').get_json()]
+    assert len(expected) == 8
+
+    seen = []
+    cursor = None
+    while True:
+        params = {'limit': limit}
+        if cursor:
+            params['cursor'] = cursor
+        data = client.get('/api/items', query_string=params).get_json()
+        assert len(data['items']) <= limit
+        seen.extend(item['id'] for item in data['items'])
+        cursor = data['next_cursor']
+        if not cursor:
+            break
+
+    assert seen == expected
+    # Dated items first, then the undated block
+    dates = [item['expirationDate'] for item in client.get('/api/items?all=1').get_json()]
+    assert dates[-3:] == [None, None, None] and None not in dates[:-3]
+
+
+def test_rejects_bad_cursor(client):
+    assert client.get('/api/items?cursor=bogus').status_code == 400
+
+
+if __name__ == '__main__':
+    sys.exit(pytest.main([__file__, '-v']))
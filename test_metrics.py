@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Test the per-route histograms served at /metrics
+"""
+
+import pytest
+
+import metrics
+
+
+@pytest.fixture
+def client(load_app, monkeypatch):
+    simple_app = load_app()
+    # Histograms are process-wide; start each test from empty series
+    for histogram in metrics.HISTOGRAMS:
+        monkeypatch.setattr(histogram, '_series', {})
+    return simple_app.app.test_client()
+
+
+def scrape(client):
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    return response.get_data(as_text=True).splitlines()
+
+
+def test_request_shows_up_in_route_histograms(client):
+    assert client.get('/api/receipts/REC-1').status_code == 404
+    assert client.get('/api/receipts/REC-2').status_code == 404
+
+    lines = scrape(client)
+    labels = 'route="/api/receipts/<receipt_id>",method="GET",status="404"'
+    assert f'expiry_request_duration_seconds_count{{{labels}}} 2' in lines
+    assert f'expiry_request_duration_seconds_bucket{{{labels},le="+Inf"}} 2' in lines
+    buckets = [line for line in lines if line.startswith(f'expiry_request_duration_seconds_bucket{{{labels},')]
+    assert len(buckets) == len(metrics.TIME_BUCKETS) + 1
+    # Cumulative buckets never decrease
+    counts = [int(line.rsplit(' ', 1)[1]) for line in buckets]
+    assert counts == sorted(counts)
+    assert 'expiry_sql_statements_per_request_count{route="/api/receipts/<receipt_id>"} 2' in lines
+    assert 'expiry_response_size_bytes_count{route="/api/receipts/<receipt_id>"} 2' in lines
+
+
+def test_unmatched_paths_share_one_label(client):
+    for n in range(3):
+        assert client.get(f'/no/such/page/{n}').status_code == 404
+
+    lines = scrape(client)
+    assert 'expiry_request_duration_seconds_count{route="unmatched",method="GET",status="404"} 3' in lines
+    assert not any('/no/such/page' in line for line in lines)
+    # The scrape itself is the only other series
+    assert set(metrics.REQUEST_DURATION._series) == {('unmatched', 'GET', '404'), ('/metrics', 'GET', '200')}
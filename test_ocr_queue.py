@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Test the durable OCR queue: claims, reclaiming stale jobs and the attempt limit
+"""
+
+import io
+from datetime import datetime, timedelta
+
+import pytest
+from PIL import Image
+
+import ocr_queue
+import ocr_worker
+from models import db, OcrJob
+
+
+@pytest.fixture
+def app(load_app):
+    simple_app = load_app()
+    with simple_app.app.app_context():
+        yield simple_app.app
+
+
+def _go_stale(job_id):
+    job = db.session.get(OcrJob, job_id)
+    job.claimed_at = datetime.utcnow() - timedelta(seconds=ocr_queue.OCR_VISIBILITY_TIMEOUT + 1)
+    db.session.commit()
+
+
+def test_a_job_is_claimed_once(app):
+    job_id = ocr_queue.enqueue_job('abc', 'receipts/receipt_abc.jpg')
+
+    job = ocr_queue.claim_job('worker-1')
+    assert (job.id, job.status, job.worker_id, job.attempts) == (job_id, 'running', 'worker-1', 1)
+    assert ocr_queue.claim_job('worker-2') is None
+
+
+def test_a_stale_job_is_reclaimed_until_out_of_attempts(app, monkeypatch):
+    monkeypatch.setattr(ocr_queue, 'OCR_MAX_ATTEMPTS', 2)
+    job_id = ocr_queue.enqueue_job('abc', 'receipts/receipt_abc.jpg')
+    ocr_queue.claim_job('worker-1')
+
+    _go_stale(job_id)
+    job = ocr_queue.claim_job('worker-2')
+    assert (job.id, job.worker_id, job.attempts) == (job_id, 'worker-2', 2)
+
+    _go_stale(job_id)
+    assert ocr_queue.claim_job('worker-3') is None
+    job = db.session.get(OcrJob, job_id, populate_existing=True)
+    assert job.status == 'failed'
+    assert job.finished_at is not None
+    assert 'stopped responding' in job.error
+
+
+def test_heartbeat_keeps_the_claim(app):
+    job_id = ocr_queue.enqueue_job('abc', 'receipts/receipt_abc.jpg')
+    ocr_queue.claim_job('worker-1')
+    _go_stale(job_id)
+
+    with ocr_queue.heartbeat(app, job_id, 'worker-1', interval=60):
+        pass
+    assert ocr_queue.claim_job('worker-2') is None
+    # Only the worker holding the claim can refresh it
+    assert not ocr_queue.touch_job(job_id, 'worker-2')
+
+
+def test_worker_records_a_failed_commit(app, monkeypatch):
+    job_id = ocr_queue.enqueue_job('abc', 'receipts/receipt_abc.jpg')
+    monkeypatch.setattr(ocr_worker, 'run_job', lambda job, root_path: {'text': 'MILK 3.99'})
+
+    def broken_complete(job, result):
+        # Leaves the session needing a rollback, like a failed commit would
+        db.session.add(OcrJob(id='broken', status='done'))
+        db.session.flush()
+    monkeypatch.setattr(ocr_worker, 'complete_job', broken_complete)
+
+    assert ocr_worker.work(app, 'worker-1', once=True) == ocr_queue.OCR_MAX_ATTEMPTS
+    job = db.session.get(OcrJob, job_id, populate_existing=True)
+    assert (job.status, job.attempts) == ('failed', ocr_queue.OCR_MAX_ATTEMPTS)
+    assert job.error
+
+
+def test_worker_decodes_and_stores_the_upload(load_app, tmp_path, monkeypatch):
+    simple_app = load_app(OCR_QUEUE='database')
+    monkeypatch.setattr(ocr_worker, 'convert_image_to_text_enhanced',
+                        lambda path, image=None: {'best_text': 'MILK 3.99'})
+    buf = io.BytesIO()
+    Image.new('RGB', (120, 80), 'white').save(buf, 'PNG')
+    client = simple_app.app.test_client()
+
+    response = client.post('/process_receipt', data=buf.getvalue(), content_type='image/png')
+    assert response.status_code == 202
+    receipts = tmp_path / 'receipts'
+    # The request only parked the upload
+    assert not list(receipts.glob('*.jpg'))
+
+    assert ocr_worker.work(simple_app.app, 'worker-1', once=True) == 1
+    job = client.get(response.get_json()['status_url']).get_json()
+    assert job['status'] == 'done', job.get('error')
+    with Image.open(tmp_path / job['result']['image_path']) as img:
+        assert (img.format, img.size) == ('JPEG', (120, 80))
+    assert not list((receipts / 'queued').iterdir())
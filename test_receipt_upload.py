@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+Test binary receipt uploads to /process_receipt
+"""
+
+import base64
+import io
+import os
+import time
+
+import pytest
+from PIL import Image
+
+
+@pytest.fixture
+def client(load_app, monkeypatch):
+    """simple_app writing receipt images under tmp_path, with Tesseract stubbed out"""
+    import ocr_engine
+    monkeypatch.setattr(ocr_engine, 'image_to_string', lambda image, config='': 'MILK 3.99')
+    return load_app(OCR_QUEUE='memory').app.test_client()
+
+
+def png_bytes(size=(120, 80)):
+    buf = io.BytesIO()
+    Image.new('RGBA', size, 'white').save(buf, 'PNG')
+    return buf.getvalue()
+
+
+def wait_for_job(client, response):
+    assert response.status_code == 202, response.get_json()
+    status_url = response.get_json()['status_url']
+    for _ in range(100):
+        job = client.get(status_url).get_json()
+        if job['status'] in ('done', 'failed'):
+            return job
+        time.sleep(0.05)
+    raise AssertionError('OCR job did not finish')
+
+
+@pytest.mark.parametrize('send', ['multipart', 'raw', 'json'])
+def test_upload_formats(client, tmp_path, send):
+    image = png_bytes()
+    if send == 'multipart':
+        response = client.post('/process_receipt', data={'image': (io.BytesIO(image), 'receipt.png')},
+                               content_type='multipart/form-data')
+    elif send == 'raw':
+        response = client.post('/process_receipt', data=image, content_type='image/png')
+    else:
+        data_url = 'data:image/png;base64,' + base64.b64encode(image).decode()
+        response = client.post('/process_receipt', json={'image': data_url})
+
+    job = wait_for_job(client, response)
+    assert job['status'] == 'done', job.get('error')
+    saved = tmp_path / job['result']['image_path']
+    with Image.open(saved) as img:
+        assert img.format == 'JPEG'
+        assert img.size == (120, 80)
+
+
+def test_job_status_is_visible_to_every_web_worker(client):
+    """Jobs run in-process are recorded in ocr_jobs, not just in this worker's memory"""
+    from ocr_jobs import runner
+
+    job = wait_for_job(client, client.post('/process_receipt', data=png_bytes(), content_type='image/png'))
+    status_url = f"/jobs/{job['id']}"
+    runner._jobs.clear()  # as seen from another gunicorn worker
+
+    elsewhere = client.get(status_url).get_json()
+    assert elsewhere['status'] == 'done'
+    assert elsewhere['result'] == job['result']
+
+
+def test_rejects_missing_image(client):
+    assert client.post('/process_receipt', data=b'', content_type='image/jpeg').status_code == 400
+    assert client.post('/process_receipt', json={}).status_code == 400
+
+
+def test_resumable_upload(client, tmp_path):
+    image = png_bytes()
+    created = client.post('/uploads', headers={'Upload-Length': str(len(image))})
+    assert created.status_code == 201
+    upload_url = created.get_json()['upload_url']
+
+    first, rest = image[:100], image[100:]
+    assert client.put(upload_url, data=first, headers={'Upload-Offset': '0'}).get_json()['offset'] == 100
+
+    # A retried chunk at a stale offset is refused with the current offset
+    retry = client.put(upload_url, data=first, headers={'Upload-Offset': '0'})
+    assert retry.status_code == 409
+    assert retry.headers['Upload-Offset'] == '100'
+
+    # Finalizing early is refused; the client can ask where to resume
+    assert client.post(created.get_json()['finalize_url']).status_code == 409
+    assert client.head(upload_url).headers['Upload-Offset'] == '100'
+
+    client.put(upload_url, data=rest, headers={'Upload-Offset': '100'})
+    job = wait_for_job(client, client.post(created.get_json()['finalize_url']))
+    assert job['status'] == 'done', job.get('error')
+    assert (tmp_path / job['result']['image_path']).exists()
+    assert client.head(upload_url).status_code == 404
+    assert not list((tmp_path / 'receipts' / 'uploads').iterdir())
+
+
+def test_prune_expires_part_and_json_together(tmp_path):
+    from uploads import create_upload, append_chunk, finalize_upload, prune_uploads, UploadNotFound
+    uploads_dir = str(tmp_path)
+    live = create_upload(uploads_dir)
+    stale = create_upload(uploads_dir)
+    old = time.time() - 3600
+    # A slow upload: its .part is old but the last chunk touched the .json
+    os.utime(tmp_path / f"{live}.part", (old, old))
+    for name in (f"{stale}.part", f"{stale}.json"):
+        os.utime(tmp_path / name, (old, old))
+
+    prune_uploads(uploads_dir, max_age=60)
+    assert sorted(os.listdir(tmp_path)) == [f"{live}.json", f"{live}.part"]
+
+    append_chunk(uploads_dir, live, 0, io.BytesIO(b'data'))
+    path = finalize_upload(uploads_dir, live)
+    with pytest.raises(UploadNotFound):
+        finalize_upload(uploads_dir, live)
+    assert open(path, 'rb').read() == b'data'
+
+
+def test_failed_ocr_is_recorded_and_not_cached(client, tmp_path, monkeypatch):
+    import ocr_cache
+    import ocr_engine
+    from models import OcrResult
+
+    def broken(image, config=''):
+        raise RuntimeError('tesseract is not installed')
+    monkeypatch.setattr(ocr_engine, 'image_to_string', broken)
+    monkeypatch.setattr(ocr_cache, 'config_version', lambda: '1/test')
+    image = png_bytes()
+
+    job = wait_for_job(client, client.post('/process_receipt', data=image, content_type='image/png'))
+    assert job['status'] == 'failed'
+    assert 'tesseract' in job['error']
+    with client.application.app_context():
+        assert OcrResult.query.count() == 0
+
+    # The same photo is OCR'd again rather than answered with the failure,
+    # and stored only once
+    again = wait_for_job(client, client.post('/process_receipt', data=image, content_type='image/png'))
+    assert again['status'] == 'failed'
+    assert len(list((tmp_path / 'receipts').glob('*.jpg'))) == 1
+
+
+def test_serves_cacheable_variants(client, tmp_path):
+    job = wait_for_job(client, client.post('/process_receipt', data=png_bytes((600, 1200)), content_type='image/png'))
+    url = '/' + job['result']['image_path']
+
+    thumb = client.get(url + '?size=thumb', headers={'Accept': 'image/webp,*/*'})
+    assert thumb.status_code == 200
+    assert thumb.mimetype == 'image/webp'
+    image_id = job['result']['image_id']
+    assert (tmp_path / 'receipts' / 'variants' / image_id[:2] / image_id[2:4]
+            / f"receipt_{image_id}_thumb.webp").exists()
+    assert 'immutable' in thumb.headers['Cache-Control']
+    with Image.open(io.BytesIO(thumb.data)) as img:
+        assert img.size == (100, 200)
+
+    revalidated = client.get(url + '?size=thumb', headers={'Accept': 'image/webp', 'If-None-Match': thumb.headers['ETag']})
+    assert revalidated.status_code == 304
+
+    partial = client.get(url, headers={'Range': 'bytes=0-9'})
+    assert partial.status_code == 206
+    assert partial.mimetype == 'image/jpeg'
+    assert len(partial.data) == 10
+
+    assert client.get(url + '?size=huge').status_code == 400
+    assert client.get('/receipts/missing.jpg').status_code == 404
+
+
+def test_compaction_and_cold_tier_are_served(client, tmp_path):
+    from receipt_storage import compact, cold_path
+
+    image = png_bytes((600, 1200))
+    job = wait_for_job(client, client.post('/process_receipt', data=image, content_type='image/png'))
+    filename = job['result']['image_path'].split('/')[-1]
+    receipts_dir = str(tmp_path / 'receipts')
+    original_etag = client.get('/receipts/' + filename).headers['ETag']
+
+    stats = compact(receipts_dir, {job['result']['image_hash']}, older_than_days=-1)
+    assert stats['recompressed'] == 1
+    assert stats['bytes_reclaimed'] > 0
+    assert stats['moved'] == 1
+    assert not (tmp_path / 'receipts' / filename).exists()
+    assert (tmp_path / 'receipts').joinpath(cold_path(receipts_dir, filename.replace('.jpg', '.webp'))).exists()
+
+    full = client.get('/receipts/' + filename, headers={'Accept': 'image/webp'})
+    assert full.status_code == 200
+    assert full.mimetype == 'image/webp'
+    legacy = client.get('/receipts/' + filename)
+    assert legacy.mimetype == 'image/jpeg'
+    # Different bytes from the JPEG served before compaction, so a new ETag
+    assert legacy.headers['ETag'] != original_etag
+    assert client.get('/receipts/' + filename, headers={'If-None-Match': original_etag}).status_code == 200
+    with Image.open(io.BytesIO(legacy.data)) as img:
+        assert img.size == (600, 1200)
+    # Converted on the fly rather than kept as a second full-size copy
+    assert not list((tmp_path / 'receipts').rglob('*_full.*'))
+
+    # The same photo uploaded again is found in the cold tier, not stored twice
+    again = wait_for_job(client, client.post('/process_receipt', data=image, content_type='image/png'))
+    assert again['status'] == 'done', again.get('error')
+    assert not list((tmp_path / 'receipts').glob('receipt_*'))
+
+
+def test_original_moved_while_serving_is_found_again(client, tmp_path, monkeypatch):
+    import receipt_images
+    from receipt_storage import compact
+
+    job = wait_for_job(client, client.post('/process_receipt', data=png_bytes(), content_type='image/png'))
+    filename = job['result']['image_path'].split('/')[-1]
+    receipts_dir = str(tmp_path / 'receipts')
+    hot = os.path.join(receipts_dir, filename)
+    compact(receipts_dir, {job['result']['image_hash']}, older_than_days=-1)
+
+    # The first lookup still sees the hot JPEG that compaction just removed
+    locate_original = receipt_images.locate_original
+    lookups = []
+    def locate(receipts_dir, filename):
+        lookups.append(filename)
+        return hot if len(lookups) == 1 else locate_original(receipts_dir, filename)
+    monkeypatch.setattr(receipt_images, 'locate_original', locate)
+
+    response = client.get('/receipts/' + filename, headers={'Accept': 'image/webp'})
+    assert response.status_code == 200
+    assert response.mimetype == 'image/webp'
+    assert len(lookups) == 2
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Test that /api/receipts loads receipt items without N+1 queries
+"""
+
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+
+@pytest.fixture
+def client(load_app):
+    """simple_app bound to a throwaway SQLite database"""
+    simple_app = load_app()
+    with simple_app.app.app_context():
+        yield simple_app.app.test_client(), simple_app.db
+
+
+def add_receipts(db, start, count, items_per_receipt=3):
+    """Insert receipts with a few items each"""
+    from models import Item, Receipt
+
+    today = datetime.now().date()
+    for n in range(start, start + count):
+        receipt_id = f"REC-TEST-{n:04d}"
+        db.session.add(Receipt(receipt_id=receipt_id, store_name='Safeway', purchase_date=today, total_amount=10.0))
+        for i in range(items_per_receipt):
+            db.session.add(Item(
+                receipt_id=receipt_id,
+                product_name=f"Item {n}-{i}",
+                purchase_date=today,
+                expiration_date=today + timedelta(days=i),
+                price=1.0 + i
+            ))
+    db.session.commit()
+    db.session.expunge_all()
+
+
+def count_statements(db, func):
+    """Run func and return how many SQL statements it executed"""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        func()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+    return len(statements)
+
+
+def test_receipt_list_statement_count_is_constant(client):
+    """Serializing 2 or 20 receipts costs the same number of statements"""
+    client, db = client
+
+    add_receipts(db, 0, 2)
+    small = count_statements(db, lambda: client.get('/api/receipts?limit=50'))
+
+    add_receipts(db, 2, 18)
+    response = None
+
+    def fetch():
+        nonlocal response
+        response = client.get('/api/receipts?limit=50')
+
+    large = count_statements(db, fetch)
+
+    data = response.get_json()
+    assert len(data['receipts']) == 20
+    assert all(len(receipt['items']) == 3 for receipt in data['receipts'])
+    assert large == small
+    print(f"✓ {small} statements for 2 receipts, {large} for 20")
+
+
+def test_receipt_pagination_and_detail(client):
+    """Pages walk every receipt once and detail returns its items"""
+    client, db = client
+    add_receipts(db, 0, 5)
+
+    seen = []
+    cursor = None
+    while True:
+        params = {'limit': 2}
+        if cursor:
+            params['cursor'] = cursor
+        data = client.get('/api/receipts', query_string=params).get_json()
+        seen.extend(receipt['receiptId'] for receipt in data['receipts'])
+        cursor = data['next_cursor']
+        if not cursor:
+            break
+
+    assert sorted(seen) == [f"REC-TEST-{n:04d}" for n in range(5)]
+
+    detail = client.get('/api/receipts/REC-TEST-0003').get_json()
+    assert [item['productName'] for item in detail['items']] == ['Item 3-0', 'Item 3-1', 'Item 3-2']
+    assert client.get('/api/receipts/NOPE').status_code == 404
+    assert client.get('/api/receipts?cursor=bogus').status_code == 400
+
+
+def test_receipt_ingestion_is_idempotent(client):
+    """A retried POST with the same key stores the receipt only once"""
+    client, db = client
+    from models import Item, Receipt
+
+    payload = {
+        'store_name': 'Safeway',
+        'total_amount': '$7.98',
+        'items': [
+            {'name': 'Organic Milk', 'price': 4.99, 'expiration_days': 7},
+            {'name': 'Fresh Spinach', 'price': 2.99, 'expiration_days': 3}
+        ]
+    }
+    headers = {'Idempotency-Key': 'retry-me'}
+
+    first = client.post('/api/receipts', json=payload, headers=headers)
+    retry = client.post('/api/receipts', json=payload, headers=headers)
+
+    assert first.status_code == 201
+    assert retry.status_code == 200
+    assert retry.get_json() == first.get_json()
+    assert first.get_json()['totalAmount'] == 7.98
+    assert Receipt.query.count() == 1
+    assert Item.query.count() == 2
+
+
+def test_ingestion_rejects_duplicates_and_parses_prices(client):
+    """A reused receipt_id is a 409, OCR-style prices are parsed, bad ones are a 400"""
+    client, db = client
+    from models import Item
+
+    payload = {'receipt_id': 'REC-DUP', 'items': [{'name': 'Milk', 'price': '$4.99'}]}
+    assert client.post('/api/receipts', json=payload).status_code == 201
+    assert Item.query.filter_by(receipt_id='REC-DUP').one().price == 4.99
+
+    duplicate = client.post('/api/receipts', json=payload)
+    assert duplicate.status_code == 409
+    assert 'REC-DUP' in duplicate.get_json()['error']
+
+    bad_price = client.post('/api/receipts', json={'items': [{'name': 'Eggs', 'price': 'free'}]})
+    assert bad_price.status_code == 400
+    assert client.post('/api/receipts', json={'items': [{'name': 'Eggs'}]}).status_code == 400
+
+
+
+def test_save_receipt_items_reports_a_taken_receipt_id(client, monkeypatch):
+    client, db = client
+    import ingest
+    monkeypatch.setattr(ingest, 'new_receipt_id', lambda: 'REC-SAME')
+    payload = {'vendor': 'Safeway', 'items': [{'name': 'Milk', 'price': 4.99}]}
+
+    assert client.post('/save_receipt_items', json=payload).status_code == 200
+    duplicate = client.post('/save_receipt_items', json=payload)
+    assert duplicate.status_code == 409
+    assert 'REC-SAME' in duplicate.get_json()['error']
+
+
+def test_other_integrity_errors_are_not_reported_as_duplicates(client):
+    client, db = client
+    from sqlalchemy import text
+    from sqlalchemy.exc import IntegrityError
+    from ingest import ingest_receipt
+    db.session.execute(text('CREATE UNIQUE INDEX ux_test_store ON receipts (store_name)'))
+    db.session.commit()
+
+    ingest_receipt({'receipt_id': 'REC-1', 'store_name': 'Safeway', 'items': []})
+    with pytest.raises(IntegrityError):
+        ingest_receipt({'receipt_id': 'REC-2', 'store_name': 'Safeway', 'items': []})
+
+
+if __name__ == '__main__':
+    sys.exit(pytest.main([__file__, '-v']))
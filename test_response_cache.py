@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Test the response cache: JSON entries, and one computation per key across workers
+"""
+
+import json
+import sys
+import threading
+import time
+
+import pytest
+from flask import Flask, g, jsonify
+
+import response_cache
+
+
+class FakeRedis:
+    """The few Redis commands RedisBackend uses, shared like a real server"""
+
+    def __init__(self):
+        self.data = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value, expires = self.data.get(key, (None, None))
+            if expires is not None and expires < time.monotonic():
+                del self.data[key]
+                return None
+            return value
+
+    def set(self, key, value, ex=None, px=None, nx=False):
+        with self.lock:
+            if nx and key in self.data:
+                return None
+            ttl = ex if ex is not None else (px / 1000 if px is not None else None)
+            value = value.encode() if isinstance(value, str) else value
+            self.data[key] = (value, time.monotonic() + ttl if ttl else None)
+            return True
+
+    def delete(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+
+    def incr(self, key):
+        with self.lock:
+            value = int(self.data.get(key, (b'0', None))[0]) + 1
+            self.data[key] = (str(value).encode(), None)
+            return value
+
+
+@pytest.fixture
+def redis_app(monkeypatch):
+    server = FakeRedis()
+    monkeypatch.setattr(response_cache, 'backend', response_cache.RedisBackend(server))
+    calls = []
+
+    app = Flask(__name__)
+
+    @app.before_request
+    def fingerprint():
+        g.data_fingerprint = 'v1'
+
+    @app.route('/items')
+    @response_cache.cached
+    def items():
+        calls.append(1)
+        time.sleep(0.2)
+        return jsonify({'items': [1, 2, 3]})
+
+    @app.route('/missing')
+    @response_cache.cached
+    def missing():
+        calls.append(1)
+        return jsonify({'error': 'nope'}), 404
+
+    return app, server, calls
+
+
+def test_entries_are_json_and_responses_fresh(redis_app):
+    app, server, calls = redis_app
+    client = app.test_client()
+
+    first = client.get('/items')
+    second = client.get('/items')
+    assert first.get_json() == second.get_json() == {'items': [1, 2, 3]}
+    assert len(calls) == 1
+
+    stored = [json.loads(value) for key, (value, _) in server.data.items()
+              if '/items?' in key and not key.endswith(':lock')]
+    assert [entry['status'] for entry in stored] == [200]
+
+    assert client.get('/missing').status_code == 404
+    assert client.get('/missing').status_code == 404
+    assert len(calls) == 3
+
+
+def test_other_workers_wait_for_the_lock_holder(redis_app, monkeypatch):
+    """A second process sharing Redis polls for the entry instead of querying"""
+    app, server, calls = redis_app
+    with app.test_request_context('/items'):
+        g.data_fingerprint = 'v1'
+        key = response_cache._cache_key()
+    other_worker = response_cache.RedisBackend(server)
+    token = other_worker.lock(key, 5000)
+
+    def finish_elsewhere():
+        time.sleep(0.2)
+        other_worker.set(key, {'body': 'eyJpdGVtcyI6IFtdfQ==', 'status': 200,
+                               'headers': [['Content-Type', 'application/json']]}, 60)
+        other_worker.unlock(key, token)
+
+    thread = threading.Thread(target=finish_elsewhere)
+    thread.start()
+    response = app.test_client().get('/items')
+    thread.join()
+
+    assert response.get_json() == {'items': []}
+    assert calls == []
+
+
+def test_concurrent_misses_compute_once(redis_app):
+    app, _, calls = redis_app
+    results = []
+
+    def fetch():
+        results.append(app.test_client().get('/items').get_json())
+
+    threads = [threading.Thread(target=fetch) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [{'items': [1, 2, 3]}] * 5
+    assert len(calls) == 1
+
+
+if __name__ == '__main__':
+    sys.exit(pytest.main([__file__, '-v']))
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+Test the slow-query log: admin access and timing through the metrics listeners
+"""
+
+import sys
+
+import pytest
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+
+import slow_query
+
+
+@pytest.fixture
+def app(load_app, tmp_path, monkeypatch):
+    monkeypatch.setattr(slow_query, 'SLOW_QUERY_LOG', str(tmp_path / 'slow.jsonl'))
+    monkeypatch.setattr(slow_query, '_logger', None)
+    monkeypatch.setattr(slow_query, '_stats', {})
+    simple_app = load_app()
+    with simple_app.app.app_context():
+        yield simple_app.app.test_client(), simple_app.db
+
+
+def test_admin_page_is_closed_without_a_token(app, monkeypatch):
+    client, _ = app
+    monkeypatch.delenv('ADMIN_TOKEN', raising=False)
+    assert client.get('/admin/slow_queries').status_code == 403
+
+    monkeypatch.setenv('ADMIN_TOKEN', 'secret')
+    assert client.get('/admin/slow_queries').status_code == 403
+    assert client.get('/admin/slow_queries', headers={'X-Admin-Token': 'wrong'}).status_code == 403
+    assert client.get('/admin/slow_queries', headers={'X-Admin-Token': 'secret'}).status_code == 200
+
+
+def test_slow_statements_are_timed_by_the_metrics_listeners(app, monkeypatch):
+    _, db = app
+    monkeypatch.setattr(slow_query, 'SLOW_QUERY_MS', 0)
+    db.session.execute(text('SELECT 42'))
+
+    assert any(row['statement'] == 'SELECT ?' for row in slow_query.top_statements())
+    # No second pair of timing listeners on the Engine
+    assert not any(event.contains(Engine, 'before_cursor_execute', listener)
+                   for listener in vars(slow_query).values() if callable(listener))
+
+
+if __name__ == '__main__':
+    sys.exit(pytest.main([__file__, '-v']))
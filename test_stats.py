@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Test the dashboard counters and the daily rollup kept current by item writes
+"""
+
+import sys
+from datetime import date, timedelta
+
+import pytest
+
+
+@pytest.fixture
+def app(load_app, monkeypatch):
+    simple_app = load_app()
+    import stats
+    monkeypatch.setattr(stats, '_summary_enabled', False)
+    with simple_app.app.app_context():
+        yield simple_app.app.test_client(), simple_app.db
+
+
+def add_items(db, *days):
+    from models import Item
+    today = date.today()
+    items = [Item(product_name=f"Item {n}", purchase_date=today,
+                  expiration_date=None if d is None else today + timedelta(days=d), price=1.5)
+             for n, d in enumerate(days)]
+    db.session.add_all(items)
+    db.session.commit()
+    return items
+
+
+def test_reads_do_not_write_the_rollup(app, monkeypatch):
+    client, db = app
+    import stats
+    from models import DailyItemSummary
+
+    add_items(db, -1, 2, 10)
+    monkeypatch.setattr(stats, '_summary_enabled', True)
+    counters = client.get('/analytics').get_json()
+    assert counters == {'total_items': 3, 'expired_count': 1, 'expiring_soon_count': 1, 'total_value': 4.5}
+    assert DailyItemSummary.query.count() == 0
+
+
+def test_writes_keep_the_rollup_exact_without_enabling_it(app):
+    """Listeners are registered with the model, so any process's writes apply deltas"""
+    client, db = app
+    import stats
+
+    items = add_items(db, -1, 2, None)
+    stats.refresh_daily_summary()
+
+    add_items(db, 1)
+    items[0].expiration_date = date.today() + timedelta(days=1)
+    items[1].price = 4.0
+    db.session.delete(items[2])
+    db.session.commit()
+    client.post('/api/receipts', json={'items': [{'name': 'Jam', 'price': 2.0, 'expiration_days': -3}]})
+
+    from models import DailyItemSummary
+    summary = db.session.get(DailyItemSummary, date.today())
+    db.session.refresh(summary)
+    assert summary.to_dict() == stats.compute_item_stats()
+    assert summary.total_items == 4
+
+
+def test_refresh_overwrites_a_drifted_row(app):
+    _, db = app
+    import stats
+    from models import DailyItemSummary
+
+    add_items(db, 0, 5)
+    stats.refresh_daily_summary()
+    db.session.get(DailyItemSummary, date.today()).total_items = 99
+    db.session.commit()
+
+    assert stats.refresh_daily_summary()['total_items'] == 2
+    assert db.session.get(DailyItemSummary, date.today()).total_items == 2
+
+
+def test_status_and_days_use_one_today(app):
+    _, db = app
+    from models import Item
+    from stats import items_with_status, status_summary, empty_status_summary, STATUSES
+
+    add_items(db, 2, None)
+    # A fixed day far from the real clock: every row must be measured from it
+    today = date.today() - timedelta(days=10)
+    items = items_with_status(Item.query.order_by(Item.id), today)
+    assert [(item.status, item.days_until_expiration) for item in items] == [('fresh', 12), ('no_expiration', None)]
+
+    assert set(status_summary(today)['counts']) == set(STATUSES)
+    assert set(empty_status_summary()['counts']) == set(STATUSES)
+
+
+if __name__ == '__main__':
+    sys.exit(pytest.main([__file__, '-v']))
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Test delta sync: changed items and delete tombstones arrive exactly once
+"""
+
+import sys
+from datetime import date
+
+import pytest
+
+
+@pytest.fixture
+def app(load_app):
+    simple_app = load_app()
+    with simple_app.app.app_context():
+        yield simple_app.app.test_client(), simple_app.db
+
+
+def sync(client, token=None, limit=None):
+    params = {}
+    if token:
+        params['since'] = token
+    if limit:
+        params['limit'] = limit
+    response = client.get('/api/items/changes', query_string=params)
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+
+def add_item(db, name):
+    from models import Item
+    item = Item(product_name=name, purchase_date=date(2030, 1, 1), price=1.0)
+    db.session.add(item)
+    db.session.commit()
+    return item.id
+
+
+def test_delta_returns_updates_and_tombstones(app):
+    client, db = app
+    from models import Item
+
+    first_id = add_item(db, 'Milk')
+    second_id = add_item(db, 'Bread')
+    initial = sync(client)
+    assert [item['productName'] for item in initial['items']] == ['Milk', 'Bread']
+    assert initial['deleted'] == []
+
+    assert sync(client, initial['next_token'])['items'] == []
+
+    db.session.get(Item, first_id).price = 2.5
+    db.session.delete(db.session.get(Item, second_id))
+    db.session.commit()
+
+    delta = sync(client, initial['next_token'])
+    assert [(item['id'], item['price']) for item in delta['items']] == [(first_id, 2.5)]
+    assert delta['deleted'] == [second_id]
+
+    after = sync(client, delta['next_token'])
+    assert after['items'] == [] and after['deleted'] == []
+
+
+def test_initial_sync_skips_earlier_tombstones_and_pages(app):
+    client, db = app
+    from models import Item
+
+    gone = add_item(db, 'Gone')
+    db.session.delete(db.session.get(Item, gone))
+    db.session.commit()
+    names = [f"Item {n}" for n in range(5)]
+    for name in names:
+        add_item(db, name)
+
+    seen, token = [], None
+    while True:
+        page = sync(client, token, limit=2)
+        assert page['deleted'] == []
+        seen.extend(item['productName'] for item in page['items'])
+        token = page['next_token']
+        if not page['has_more']:
+            break
+    assert seen == names
+
+
+def test_bulk_ingested_items_are_numbered(app):
+    client, db = app
+    token = sync(client)['next_token']
+    response = client.post('/api/receipts', json={'items': [{'name': 'Eggs', 'price': 3.0}, {'name': 'Jam', 'price': 4.0}]})
+    assert response.status_code == 201
+    assert [item['productName'] for item in sync(client, token)['items']] == ['Eggs', 'Jam']
+
+
+def test_rejects_bad_token(app):
+    client, _ = app
+    assert client.get('/api/items/changes?since=bogus').status_code == 400
+
+
+if __name__ == '__main__':
+    sys.exit(pytest.main([__file__, '-v']))
+
+
+def test_upgrade_schema_adds_columns_and_numbers_old_items(app):
+    client, db = app
+    from sqlalchemy import inspect, text
+    from models import upgrade_schema
+    # The tables as an older release created them
+    db.drop_all()
+    with db.engine.begin() as connection:
+        connection.execute(text(
+            'CREATE TABLE items (id INTEGER PRIMARY KEY, receipt_id VARCHAR(100), '
+            'product_name VARCHAR(200) NOT NULL, purchase_date DATE NOT NULL, expiration_date DATE, '
+            'price FLOAT NOT NULL, created_at DATETIME, updated_at DATETIME)'
+        ))
+        connection.execute(text(
+            'CREATE TABLE receipts (id INTEGER PRIMARY KEY, receipt_id VARCHAR(100) NOT NULL UNIQUE, '
+            'store_name VARCHAR(200), purchase_date DATE, total_amount FLOAT, tax_amount FLOAT, '
+            'created_at DATETIME)'
+        ))
+        connection.execute(text(
+            "INSERT INTO items (product_name, purchase_date, price) "
+            "VALUES ('Milk', '2030-01-01', 1.0), ('Bread', '2030-01-01', 2.0)"
+        ))
+
+    upgrade_schema()
+    upgrade_schema()
+
+    inspector = inspect(db.engine)
+    assert {'idempotency_key', 'image_hash'} <= {c['name'] for c in inspector.get_columns('receipts')}
+    assert 'ix_items_change_seq' in {i['name'] for i in inspector.get_indexes('items')}
+    page = sync(client)
+    assert [item['productName'] for item in page['items']] == ['Milk', 'Bread']
+    add_item(db, 'Eggs')
+    assert [item['productName'] for item in sync(client, page['next_token'])['items']] == ['Eggs']
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+Streaming and resumable receipt image uploads
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
+import uuid
+
+UPLOAD_CHUNK_SIZE = 64 * 1024
+MAX_UPLOAD_BYTES = int(os.getenv('MAX_UPLOAD_MB', 32)) * 1024 * 1024
+# Unfinished resumable uploads are discarded after this many seconds
+UPLOAD_EXPIRY = int(os.getenv('UPLOAD_EXPIRY', 24 * 3600))
+
+_UPLOAD_ID = re.compile(r'^[0-9a-f]{32}$')
+
+
+class UploadTooLarge(ValueError):
+    """Raised when an upload exceeds MAX_UPLOAD_BYTES"""
+
+
+class UploadNotFound(LookupError):
+    """Raised for an unknown, expired or already finalized upload id"""
+
+
+class OffsetMismatch(ValueError):
+    """Raised when a chunk does not start where the stored data ends"""
+
+    def __init__(self, offset):
+        super().__init__(f'Upload is at offset {offset}')
+        self.offset = offset
+
+
+class IncompleteUpload(ValueError):
+    """Raised when finalizing before all declared bytes have arrived"""
+
+
+def spool_to_tempfile(stream, directory=None, max_bytes=MAX_UPLOAD_BYTES, chunk_size=UPLOAD_CHUNK_SIZE):
+    """Copy a request body to a temporary file one chunk at a time.
+
+    Only ``chunk_size`` bytes are held in memory at once, and the SHA-256
+    of the body is worked out as it streams past. Returns
+    ``(path, sha256)``; the caller is responsible for deleting the file.
+    """
+    if directory is not None:
+        os.makedirs(directory, exist_ok=True)
+    fd, path = tempfile.mkstemp(prefix='receipt_upload_', dir=directory)
+    digest = hashlib.sha256()
+    written = 0
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                written += len(chunk)
+                if written > max_bytes:
+                    raise UploadTooLarge(f'Upload exceeds {max_bytes // (1024 * 1024)} MB')
+                digest.update(chunk)
+                out.write(chunk)
+        if written == 0:
+            raise ValueError('Empty upload')
+    except BaseException:
+        os.remove(path)
+        raise
+    return path, digest.hexdigest()
+
+
+def file_sha256(path, chunk_size=UPLOAD_CHUNK_SIZE):
+    """SHA-256 of a file already on disk, read a chunk at a time"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Resumable uploads live in <uploads_dir>/<id>.part with a small <id>.json
+# beside it, so any web process can accept the next chunk.
+
+def _paths(uploads_dir, upload_id):
+    if not _UPLOAD_ID.match(upload_id or ''):
+        raise UploadNotFound(upload_id)
+    base = os.path.join(uploads_dir, upload_id)
+    return base + '.part', base + '.json'
+
+
+def _load_meta(meta_path, upload_id):
+    try:
+        with open(meta_path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise UploadNotFound(upload_id) from None
+
+
+def _remove_if_older(path, cutoff):
+    try:
+        if os.path.getmtime(path) < cutoff:
+            os.remove(path)
+    except OSError:
+        pass
+
+
+def _expire_upload(uploads_dir, upload_id, cutoff):
+    """Delete an upload's .part and .json together once it was last touched before cutoff"""
+    part_path, meta_path = _paths(uploads_dir, upload_id)
+    try:
+        part = open(part_path, 'rb')
+    except FileNotFoundError:
+        _remove_if_older(meta_path, cutoff)
+        return
+    with part:
+        try:
+            fcntl.flock(part, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            # A chunk is being written or the upload is being finalized
+            return
+        try:
+            # Every chunk touches the .json, so it dates the whole upload
+            touched = os.path.getmtime(meta_path)
+        except FileNotFoundError:
+            touched = os.fstat(part.fileno()).st_mtime
+        if touched >= cutoff:
+            return
+        for path in (part_path, meta_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def prune_uploads(uploads_dir, max_age=UPLOAD_EXPIRY):
+    """Delete abandoned uploads older than max_age seconds"""
+    cutoff = time.time() - max_age
+    try:
+        names = os.listdir(uploads_dir)
+    except FileNotFoundError:
+        return
+    upload_ids = set()
+    for name in names:
+        upload_id, ext = os.path.splitext(name)
+        if ext in ('.part', '.json') and _UPLOAD_ID.match(upload_id):
+            upload_ids.add(upload_id)
+        else:
+            # Assembled by finalize_upload for a caller that crashed
+            _remove_if_older(os.path.join(uploads_dir, name), cutoff)
+    for upload_id in upload_ids:
+        _expire_upload(uploads_dir, upload_id, cutoff)
+
+
+def create_upload(uploads_dir, length=None):
+    """Start a resumable upload of ``length`` bytes (if known); returns its id"""
+    if length is not None and length > MAX_UPLOAD_BYTES:
+        raise UploadTooLarge(f'Upload exceeds {MAX_UPLOAD_BYTES // (1024 * 1024)} MB')
+    os.makedirs(uploads_dir, exist_ok=True)
+    prune_uploads(uploads_dir)
+
+    upload_id = uuid.uuid4().hex
+    part_path, meta_path = _paths(uploads_dir, upload_id)
+    open(part_path, 'wb').close()
+    with open(meta_path, 'w') as f:
+        json.dump({'length': length, 'created_at': time.time()}, f)
+    return upload_id
+
+
+def upload_status(uploads_dir, upload_id):
+    """Return (offset, length) for an upload in progress"""
+    part_path, meta_path = _paths(uploads_dir, upload_id)
+    meta = _load_meta(meta_path, upload_id)
+    try:
+        return os.path.getsize(part_path), meta['length']
+    except FileNotFoundError:
+        raise UploadNotFound(upload_id) from None
+
+
+def append_chunk(uploads_dir, upload_id, offset, stream, chunk_size=UPLOAD_CHUNK_SIZE):
+    """Append a request body at ``offset`` and return the new offset.
+
+    The chunk must start exactly where the stored data ends. If the
+    connection drops part way, the bytes already written are kept and the
+    client resumes from the offset reported by upload_status().
+    """
+    part_path, meta_path = _paths(uploads_dir, upload_id)
+    meta = _load_meta(meta_path, upload_id)
+    limit = meta['length'] if meta['length'] is not None else MAX_UPLOAD_BYTES
+
+    try:
+        out = open(part_path, 'ab')
+    except FileNotFoundError:
+        raise UploadNotFound(upload_id) from None
+    with out:
+        # Serialise writers of the same upload across web processes
+        fcntl.flock(out, fcntl.LOCK_EX)
+        if not os.path.exists(meta_path):
+            # Finalized or expired while this request waited for the lock
+            raise UploadNotFound(upload_id)
+        written = out.seek(0, os.SEEK_END)
+        if written != offset:
+            raise OffsetMismatch(written)
+        while True:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                break
+            if written + len(chunk) > limit:
+                raise UploadTooLarge(f'Upload exceeds {limit} bytes')
+            out.write(chunk)
+            written += len(chunk)
+        out.flush()
+    os.utime(meta_path)
+    return written
+
+
+def finalize_upload(uploads_dir, upload_id):
+    """Close an upload and return the path of the assembled file.
+
+    Holds the same lock as append_chunk, so a chunk still being written
+    either lands before the size check or is refused afterwards. The
+    caller takes ownership of the file and must delete it when done.
+    """
+    part_path, meta_path = _paths(uploads_dir, upload_id)
+    try:
+        part = open(part_path, 'rb')
+    except FileNotFoundError:
+        raise UploadNotFound(upload_id) from None
+    with part:
+        fcntl.flock(part, fcntl.LOCK_EX)
+        # Another request may have finalized it while this one waited
+        length = _load_meta(meta_path, upload_id)['length']
+        offset = os.fstat(part.fileno()).st_size
+        if offset == 0 or (length is not None and offset != length):
+            raise IncompleteUpload(f'Received {offset} of {length if length is not None else "?"} bytes')
+
+        fd, path = tempfile.mkstemp(prefix='receipt_upload_', dir=uploads_dir)
+        os.close(fd)
+        os.replace(part_path, path)
+        os.remove(meta_path)
+    return path